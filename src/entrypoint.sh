@@ -6,6 +6,14 @@ rcb dump-env > /.env
 # Write crontab
 rcb crontab > crontab
 
+# Start the watcher for change-triggered backups if enabled
+rcb watch
+
+# The built-in scheduler replaces cron when enabled
+if [ "$SCHEDULER" = "builtin" ]; then
+    exec rcb scheduler
+fi
+
 # Start cron in the background and capture its PID
 crontab crontab
 crond -f &
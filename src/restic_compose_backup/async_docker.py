@@ -0,0 +1,386 @@
+"""
+Minimal asyncio client for the Docker Engine API.
+
+Speaks HTTP/1.1 directly over the docker unix socket (or tcp, optionally
+with TLS) using only the standard library. Connections are pooled and
+reused so many container operations and exec stream relays can be in
+flight at once from a single thread.
+"""
+
+import asyncio
+import json
+import logging
+import os
+import ssl
+import struct
+from typing import AsyncIterator, List, Optional, Tuple, Union
+from urllib.parse import quote, urlencode, urlparse
+
+logger = logging.getLogger(__name__)
+
+API_VERSION = "1.41"
+DEFAULT_MAX_CONNECTIONS = 10
+
+# Stream types in the multiplexed exec/attach stream
+STREAM_STDOUT = 1
+STREAM_STDERR = 2
+
+
+class DockerAPIError(Exception):
+    """Error response from the docker daemon"""
+
+    def __init__(self, status: int, message: str):
+        super().__init__(f"{status} {message}")
+        self.status = status
+        self.message = message
+
+
+class _Connection:
+    """A single HTTP connection to the docker daemon"""
+
+    def __init__(self, reader: asyncio.StreamReader, writer: asyncio.StreamWriter):
+        self.reader = reader
+        self.writer = writer
+        self.reusable = True
+
+    def close(self):
+        self.writer.close()
+
+
+class _Response:
+    """Response with the body not yet consumed"""
+
+    def __init__(self, status: int, headers: dict, connection: _Connection):
+        self.status = status
+        self.headers = headers
+        self.connection = connection
+
+    async def iter_chunks(self) -> AsyncIterator[bytes]:
+        """Yield the raw body as it arrives"""
+        reader = self.connection.reader
+        if self.status in (204, 304):
+            return
+
+        if self.headers.get("transfer-encoding", "").lower() == "chunked":
+            while True:
+                size = int((await reader.readline()).split(b";")[0].strip(), 16)
+                if size == 0:
+                    # Trailing headers end with an empty line
+                    while (await reader.readline()) not in (b"\r\n", b"\n", b""):
+                        pass
+                    return
+                yield await reader.readexactly(size)
+                await reader.readexactly(2)
+
+        elif "content-length" in self.headers:
+            remaining = int(self.headers["content-length"])
+            while remaining > 0:
+                data = await reader.read(min(remaining, 65536))
+                if not data:
+                    raise asyncio.IncompleteReadError(b"", remaining)
+                remaining -= len(data)
+                yield data
+
+        else:
+            # Raw stream until the daemon closes the connection
+            self.connection.reusable = False
+            while True:
+                data = await reader.read(65536)
+                if not data:
+                    return
+                yield data
+
+    async def read(self) -> bytes:
+        return b"".join([chunk async for chunk in self.iter_chunks()])
+
+    async def json(self):
+        data = await self.read()
+        return json.loads(data) if data else None
+
+
+class AsyncDockerClient:
+    """
+    Asyncio docker client with a pool of keep-alive connections.
+
+    Use as an async context manager so pooled connections are closed::
+
+        async with AsyncDockerClient.from_env() as client:
+            containers = await client.list_containers()
+    """
+
+    def __init__(
+        self,
+        base_url: str,
+        tls: Optional[ssl.SSLContext] = None,
+        max_connections: int = DEFAULT_MAX_CONNECTIONS,
+    ):
+        parsed = urlparse(base_url)
+        self._scheme = parsed.scheme
+        if self._scheme == "unix":
+            # unix://tmp/docker.sock and unix:///tmp/docker.sock are the same path
+            self._path = "/" + (parsed.netloc + parsed.path).lstrip("/")
+        elif self._scheme in ("tcp", "http", "https"):
+            self._host = parsed.hostname
+            self._port = parsed.port or (2376 if tls else 2375)
+        else:
+            raise ValueError(f"Unsupported docker host: {base_url}")
+
+        self._tls = tls
+        self._idle: List[_Connection] = []
+        self._slots = asyncio.Semaphore(max_connections)
+
+    @classmethod
+    def from_env(cls, max_connections: int = DEFAULT_MAX_CONNECTIONS):
+        """Create a client from ``DOCKER_HOST``, ``DOCKER_TLS_VERIFY`` and ``DOCKER_CERT_PATH``"""
+        # NOTE: Remove this fallback in 1.0
+        base_url = os.environ.get("DOCKER_HOST") or "unix://tmp/docker.sock"
+
+        tls = None
+        cert_path = os.environ.get("DOCKER_CERT_PATH")
+        if os.environ.get("DOCKER_TLS_VERIFY") or cert_path:
+            cert_path = cert_path or os.path.expanduser("~/.docker")
+            tls = ssl.create_default_context(cafile=os.path.join(cert_path, "ca.pem"))
+            tls.load_cert_chain(
+                os.path.join(cert_path, "cert.pem"),
+                os.path.join(cert_path, "key.pem"),
+            )
+            if not os.environ.get("DOCKER_TLS_VERIFY"):
+                tls.check_hostname = False
+                tls.verify_mode = ssl.CERT_NONE
+
+        return cls(base_url, tls=tls, max_connections=max_connections)
+
+    async def __aenter__(self):
+        return self
+
+    async def __aexit__(self, *args):
+        await self.close()
+
+    async def close(self):
+        """Close all idle connections"""
+        while self._idle:
+            self._idle.pop().close()
+
+    async def _connect(self) -> _Connection:
+        if self._idle:
+            return self._idle.pop()
+
+        if self._scheme == "unix":
+            reader, writer = await asyncio.open_unix_connection(self._path)
+        else:
+            reader, writer = await asyncio.open_connection(
+                self._host, self._port, ssl=self._tls
+            )
+        return _Connection(reader, writer)
+
+    def _release(self, connection: _Connection):
+        if connection.reusable and not connection.writer.is_closing():
+            self._idle.append(connection)
+        else:
+            connection.close()
+        self._slots.release()
+
+    async def _send(
+        self, method: str, path: str, params: dict = None, body=None
+    ) -> _Response:
+        """Send a request on a pooled connection. The caller must release it."""
+        url = f"/v{API_VERSION}{path}"
+        if params:
+            url += "?" + urlencode(params)
+
+        payload = b"" if body is None else json.dumps(body).encode()
+        request = (
+            f"{method} {url} HTTP/1.1\r\n"
+            "Host: docker\r\n"
+            f"Content-Length: {len(payload)}\r\n"
+            + ("Content-Type: application/json\r\n" if body is not None else "")
+            + "\r\n"
+        ).encode() + payload
+
+        await self._slots.acquire()
+        try:
+            while True:
+                # A pooled keep-alive connection may have been closed by the
+                # daemon in the meantime. Retry those on a fresh connection.
+                pooled = len(self._idle) > 0
+                connection = await self._connect()
+                try:
+                    connection.writer.write(request)
+                    await connection.writer.drain()
+                    status_line = await connection.reader.readline()
+                except (ConnectionError, OSError):
+                    connection.close()
+                    if pooled:
+                        continue
+                    raise
+
+                if not status_line:
+                    connection.close()
+                    if pooled:
+                        continue
+                    raise ConnectionError("Docker daemon closed the connection")
+                break
+
+            status = int(status_line.split()[1])
+            headers = {}
+            while True:
+                line = await connection.reader.readline()
+                if line in (b"\r\n", b"\n", b""):
+                    break
+                name, _, value = line.decode("latin-1").partition(":")
+                headers[name.strip().lower()] = value.strip()
+
+            if headers.get("connection", "").lower() == "close":
+                connection.reusable = False
+        except BaseException:
+            self._slots.release()
+            raise
+
+        return _Response(status, headers, connection)
+
+    async def _request(self, method: str, path: str, params: dict = None, body=None):
+        """Send a request and return the decoded json body"""
+        response = await self._send(method, path, params=params, body=body)
+        try:
+            data = await response.read()
+        except BaseException:
+            response.connection.reusable = False
+            raise
+        finally:
+            self._release(response.connection)
+
+        if response.status >= 400:
+            try:
+                message = json.loads(data).get("message", "")
+            except ValueError:
+                message = data.decode(errors="replace")
+            raise DockerAPIError(response.status, message)
+
+        return json.loads(data) if data else None
+
+    # --- Containers ---
+
+    async def list_containers(self, all: bool = True, inspect: bool = True) -> list:
+        """
+        List containers. With ``inspect`` the full container json is fetched
+        for all containers concurrently, matching what docker-py returns.
+        """
+        summaries = await self._request(
+            "GET", "/containers/json", params={"all": int(all)}
+        )
+        if not inspect:
+            return summaries
+
+        async def _inspect(container_id):
+            try:
+                return await self.inspect_container(container_id)
+            except DockerAPIError as ex:
+                # Removed between list and inspect
+                if ex.status == 404:
+                    return None
+                raise
+
+        results = await asyncio.gather(*[_inspect(s["Id"]) for s in summaries])
+        return [r for r in results if r is not None]
+
+    async def inspect_container(self, container: str) -> dict:
+        return await self._request("GET", f"/containers/{quote(container)}/json")
+
+    async def start_container(self, container: str):
+        await self._request("POST", f"/containers/{quote(container)}/start")
+
+    async def stop_container(self, container: str, timeout: int = 10):
+        await self._request(
+            "POST", f"/containers/{quote(container)}/stop", params={"t": timeout}
+        )
+
+    async def pause_container(self, container: str):
+        await self._request("POST", f"/containers/{quote(container)}/pause")
+
+    async def unpause_container(self, container: str):
+        await self._request("POST", f"/containers/{quote(container)}/unpause")
+
+    async def wait_container(self, container: str) -> int:
+        """Wait for the container to stop and return the exit code"""
+        result = await self._request("POST", f"/containers/{quote(container)}/wait")
+        return result.get("StatusCode")
+
+    async def remove_container(self, container: str, force: bool = False):
+        await self._request(
+            "DELETE", f"/containers/{quote(container)}", params={"force": int(force)}
+        )
+
+    # --- System ---
+
+    async def system_info(self) -> dict:
+        """System wide information like ``docker info``"""
+        return await self._request("GET", "/info")
+
+    # --- Exec ---
+
+    async def exec_create(
+        self, container: str, cmd: List[str], environment: Union[dict, list] = None
+    ) -> str:
+        """Create an exec instance and return its id"""
+        if isinstance(environment, dict):
+            environment = [f"{k}={v}" for k, v in environment.items()]
+
+        result = await self._request(
+            "POST",
+            f"/containers/{quote(container)}/exec",
+            body={
+                "AttachStdout": True,
+                "AttachStderr": True,
+                "Cmd": cmd,
+                "Env": environment or [],
+            },
+        )
+        return result["Id"]
+
+    async def exec_start(
+        self, exec_id: str
+    ) -> AsyncIterator[Tuple[Optional[bytes], Optional[bytes]]]:
+        """
+        Start an exec instance and stream its output as it arrives.
+        Yields ``(stdout, stderr)`` tuples like docker-py with ``demux=True``.
+        """
+        response = await self._send(
+            "POST", f"/exec/{exec_id}/start", body={"Detach": False, "Tty": False}
+        )
+        try:
+            if response.status >= 400:
+                raise DockerAPIError(response.status, (await response.read()).decode())
+
+            buffer = b""
+            async for data in response.iter_chunks():
+                buffer += data
+                while len(buffer) >= 8:
+                    stream_type, size = struct.unpack(">BxxxL", buffer[:8])
+                    if len(buffer) < 8 + size:
+                        break
+                    frame, buffer = buffer[8 : 8 + size], buffer[8 + size :]
+                    if stream_type == STREAM_STDERR:
+                        yield None, frame
+                    else:
+                        yield frame, None
+        except BaseException:
+            response.connection.reusable = False
+            raise
+        finally:
+            self._release(response.connection)
+
+    async def exec_inspect(self, exec_id: str) -> dict:
+        return await self._request("GET", f"/exec/{exec_id}/json")
+
+    async def exec_run(
+        self, container: str, cmd: List[str], environment: Union[dict, list] = None
+    ) -> Tuple[int, bytes, bytes]:
+        """Run a command in a container and return exit code, stdout and stderr"""
+        exec_id = await self.exec_create(container, cmd, environment=environment)
+        stdout, stderr = b"", b""
+        async for out, err in self.exec_start(exec_id):
+            stdout += out or b""
+            stderr += err or b""
+
+        result = await self.exec_inspect(exec_id)
+        return result.get("ExitCode"), stdout, stderr
@@ -15,18 +15,13 @@ def run(
     source_container_id: str = None,
 ):
     logger.info("Starting backup container")
-    client = utils.docker_client()
-
-    container = client.containers.run(
-        image,
-        command,
-        labels=labels,
-        detach=True,
-        environment=environment + ["BACKUP_PROCESS_CONTAINER=true"],
+    container = _start_container(
+        image=image,
+        command=command,
         volumes=volumes,
-        network_mode=f"container:{source_container_id}",  # reuse original container network for optional access to docker proxy
-        working_dir=os.getcwd(),
-        tty=True,
+        environment=environment + ["BACKUP_PROCESS_CONTAINER=true"],
+        labels=labels,
+        source_container_id=source_container_id,
     )
 
     logger.info("Backup process container: %s", container.name)
@@ -66,3 +61,51 @@ def run(
     container.remove()
 
     return container.attrs["State"]["ExitCode"]
+
+
+def start_watch_process(
+    image: str = None,
+    command: str = None,
+    volumes: dict = None,
+    environment: dict = None,
+    labels: dict = None,
+    source_container_id: str = None,
+):
+    """Start the long running watch process container and return its name"""
+    logger.info("Starting watch process container")
+    container = _start_container(
+        image=image,
+        command=command,
+        volumes=volumes,
+        environment=environment
+        + [
+            "WATCH_PROCESS_CONTAINER=true",
+            f"WATCH_SOURCE_CONTAINER={source_container_id}",
+        ],
+        labels=labels,
+        source_container_id=source_container_id,
+    )
+    logger.info("Watch process container: %s", container.name)
+    return container.name
+
+
+def _start_container(
+    image: str = None,
+    command: str = None,
+    volumes: dict = None,
+    environment: list = None,
+    labels: dict = None,
+    source_container_id: str = None,
+):
+    client = utils.docker_client()
+    return client.containers.run(
+        image,
+        command,
+        labels=labels,
+        detach=True,
+        environment=environment,
+        volumes=volumes,
+        network_mode=f"container:{source_container_id}",  # reuse original container network for optional access to docker proxy
+        working_dir=os.getcwd(),
+        tty=True,
+    )
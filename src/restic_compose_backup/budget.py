@@ -0,0 +1,182 @@
+"""
+Host-wide concurrency budget shared by stack-back instances
+
+Instances on the same host share a directory (``HOST_BUDGET_DIR``) on a
+common volume. Each kind of work has a number of slots there. A slot is
+a file held with ``flock`` while the work runs so a crashed process
+never keeps its slot.
+
+Waiting processes queue in FIFO order with a wait file named after the
+time they arrived. Only the first live waiter may take a free slot.
+Wait files are locked by their owner. A wait file that can be locked
+by someone else belongs to a dead process and is removed.
+"""
+
+import fcntl
+import logging
+import os
+import time
+import uuid
+from contextlib import contextmanager
+from typing import Dict
+
+logger = logging.getLogger(__name__)
+
+KIND_SCAN = "scan"
+KIND_DUMP = "dump"
+KIND_BACKUP = "backup"
+KINDS = [KIND_SCAN, KIND_DUMP, KIND_BACKUP]
+
+WAIT_SUFFIX = ".wait"
+
+
+def parse_budget(value: str) -> Dict[str, int]:
+    """
+    dict: Slots per kind from a single number for all kinds or a list like
+    ``scan=1,dump=1,backup=2``. Kinds left out are not limited.
+    """
+    value = str(value or "").strip()
+    if not value:
+        return {}
+    if "=" not in value:
+        return {kind: int(value) for kind in KINDS}
+
+    limits = {}
+    for item in value.split(","):
+        kind, _, slots = item.partition("=")
+        kind = kind.strip().lower()
+        if kind not in KINDS:
+            raise ValueError(f"Unknown budget kind: {kind}")
+        limits[kind] = int(slots)
+    return limits
+
+
+class HostBudget:
+    """Slots for scans, dumps and backups shared through a directory"""
+
+    def __init__(self, directory: str, limits: Dict[str, int], poll: float = 1.0):
+        self.directory = directory
+        self.limits = limits
+        self.poll = poll
+
+    @contextmanager
+    def slot(self, kind: str, name: str):
+        """
+        Hold a slot of the given kind while the block runs. Yields the
+        seconds spent waiting for it.
+        """
+        limit = self.limits.get(kind)
+        if not limit:
+            yield 0.0
+            return
+
+        waited = 0.0
+        try:
+            os.makedirs(self.directory, exist_ok=True)
+            # Free slots are only taken right away when no one is queued
+            fd = self._try_slot(kind, limit) if not self._waiters(kind) else None
+            if fd is None:
+                logger.info("Waiting for a host %s slot: %s", kind, name)
+                start = time.monotonic()
+                fd = self._wait(kind, limit)
+                waited = time.monotonic() - start
+                logger.info("Waited %.1fs for a host %s slot: %s", waited, kind, name)
+        except OSError as ex:
+            logger.warning("Host budget unavailable. Running %s anyway: %s", name, ex)
+            yield waited
+            return
+
+        try:
+            yield waited
+        finally:
+            fcntl.flock(fd, fcntl.LOCK_UN)
+            os.close(fd)
+
+    def _try_slot(self, kind: str, limit: int) -> int:
+        """int: The locked file descriptor of a free slot or None"""
+        for index in range(limit):
+            path = os.path.join(self.directory, f"{kind}-slot-{index}.lock")
+            fd = os.open(path, os.O_RDWR | os.O_CREAT, 0o666)
+            try:
+                fcntl.flock(fd, fcntl.LOCK_EX | fcntl.LOCK_NB)
+                return fd
+            except BlockingIOError:
+                os.close(fd)
+        return None
+
+    def _wait(self, kind: str, limit: int) -> int:
+        """int: Queue up and return the locked slot once it is our turn"""
+        ticket, ticket_fd = self._enqueue(kind)
+        try:
+            while True:
+                waiters = self._waiters(kind)
+                if waiters and waiters[0] == ticket:
+                    fd = self._try_slot(kind, limit)
+                    if fd is not None:
+                        return fd
+                time.sleep(self.poll)
+        finally:
+            os.unlink(os.path.join(self.directory, ticket))
+            os.close(ticket_fd)
+
+    def _enqueue(self, kind: str):
+        """tuple: The name and locked file descriptor of a new wait file"""
+        ticket = f"{kind}-{time.time_ns():020d}-{uuid.uuid4().hex[:8]}{WAIT_SUFFIX}"
+        # Locked before it is visible so no one takes it for a dead waiter
+        tmp = os.path.join(self.directory, f".{ticket}")
+        fd = os.open(tmp, os.O_RDWR | os.O_CREAT, 0o666)
+        fcntl.flock(fd, fcntl.LOCK_EX)
+        os.rename(tmp, os.path.join(self.directory, ticket))
+        return ticket, fd
+
+    def _waiters(self, kind: str):
+        """list: Wait files of live waiters, first in line first"""
+        names = sorted(
+            name
+            for name in os.listdir(self.directory)
+            if name.startswith(f"{kind}-") and name.endswith(WAIT_SUFFIX)
+        )
+        return [name for name in names if self._alive(name)]
+
+    def _alive(self, name: str) -> bool:
+        path = os.path.join(self.directory, name)
+        try:
+            fd = os.open(path, os.O_RDWR)
+        except FileNotFoundError:
+            return False
+        try:
+            fcntl.flock(fd, fcntl.LOCK_EX | fcntl.LOCK_NB)
+        except BlockingIOError:
+            return True
+        finally:
+            os.close(fd)
+
+        logger.debug("Removing wait file of a dead process: %s", name)
+        try:
+            os.unlink(path)
+        except FileNotFoundError:
+            pass
+        return False
+
+
+def from_config(config) -> HostBudget:
+    """HostBudget: The configured host budget or None if disabled"""
+    if not config.host_budget_dir:
+        return None
+
+    try:
+        limits = parse_budget(config.host_budget)
+    except ValueError as ex:
+        logger.warning("Invalid HOST_BUDGET. The host budget is off: %s", ex)
+        return None
+    return HostBudget(config.host_budget_dir, limits)
+
+
+@contextmanager
+def slot(host_budget: HostBudget, kind: str, name: str):
+    """Hold a slot of the host budget if there is one"""
+    if host_budget is None:
+        yield 0.0
+        return
+    with host_budget.slot(kind, name) as waited:
+        yield waited
@@ -0,0 +1,156 @@
+"""
+Discovery of cache directories inside the backed up volumes.
+
+A directory is a cache candidate when
+
+- it contains a ``CACHEDIR.TAG`` file with the standard signature
+  (https://bford.info/cachedir/),
+- it has a well known tool cache name like ``node_modules``, or
+- it matches a pattern in a ``.stackbackignore`` file. Each line in the
+  file is a glob relative to the directory holding the file. Empty lines
+  and lines starting with ``#`` are ignored.
+
+Candidates are reported with the bytes and files they hold and can be
+excluded from the restic runs.
+"""
+
+import fnmatch
+import logging
+import os
+from dataclasses import dataclass
+from typing import List
+
+from restic_compose_backup import sizing
+from restic_compose_backup.plan import BackupPlan, VolumeTarget
+
+logger = logging.getLogger(__name__)
+
+CACHEDIR_TAG = "CACHEDIR.TAG"
+CACHEDIR_SIGNATURE = b"Signature: 8a477f597d28d172789f06886806bc55"
+IGNORE_FILE = ".stackbackignore"
+
+CACHE_DIR_NAMES = [
+    "node_modules",
+    ".cache",
+    "__pycache__",
+    ".npm",
+    ".yarn",
+    ".gradle",
+    ".pytest_cache",
+]
+
+MODE_OFF = "off"
+MODE_REPORT = "report"
+MODE_EXCLUDE = "exclude"
+
+
+@dataclass
+class Candidate:
+    """A cache directory found in a volume"""
+
+    service: str
+    path: str
+    reason: str
+    size: sizing.Size = None
+
+
+def _has_cachedir_tag(path: str) -> bool:
+    try:
+        with open(os.path.join(path, CACHEDIR_TAG), "rb") as fd:
+            return fd.read(len(CACHEDIR_SIGNATURE)) == CACHEDIR_SIGNATURE
+    except OSError:
+        return False
+
+
+def _read_ignore_file(path: str) -> List[str]:
+    try:
+        with open(os.path.join(path, IGNORE_FILE)) as fd:
+            lines = [line.strip() for line in fd]
+    except (OSError, ValueError):
+        return []
+    return [line.strip("/") for line in lines if line and not line.startswith("#")]
+
+
+def discover_volume(volume: VolumeTarget) -> List[Candidate]:
+    """list: Cache candidates in a mounted volume. Candidates are not descended into."""
+    candidates = []
+    # (directory, patterns from .stackbackignore files above it as (base, pattern))
+    stack = [(volume.destination, [])]
+    while stack:
+        directory, patterns = stack.pop()
+        patterns = patterns + [(directory, p) for p in _read_ignore_file(directory)]
+
+        try:
+            with os.scandir(directory) as it:
+                entries = [e for e in it if e.is_dir(follow_symlinks=False)]
+        except OSError:
+            continue
+
+        for entry in entries:
+            reason = None
+            if entry.name in CACHE_DIR_NAMES:
+                reason = entry.name
+            elif _has_cachedir_tag(entry.path):
+                reason = CACHEDIR_TAG
+            else:
+                for base, pattern in patterns:
+                    relative = os.path.relpath(entry.path, base)
+                    if fnmatch.fnmatchcase(relative, pattern) or (
+                        "/" not in pattern and fnmatch.fnmatchcase(entry.name, pattern)
+                    ):
+                        reason = IGNORE_FILE
+                        break
+
+            if reason:
+                candidates.append(Candidate(volume.service, entry.path, reason))
+            else:
+                stack.append((entry.path, patterns))
+
+    return candidates
+
+
+def discover(plan: BackupPlan, workers: int = 8) -> List[Candidate]:
+    """list: Cache candidates in all planned volumes with their size"""
+    candidates = []
+    for volume in plan.volumes:
+        if os.path.isdir(volume.destination):
+            candidates += discover_volume(volume)
+
+    sizes = sizing.size_paths([c.path for c in candidates], workers=workers)
+    for candidate in candidates:
+        candidate.size = sizes[candidate.path]
+    return sorted(candidates, key=lambda c: c.path)
+
+
+def apply_excludes(plan: BackupPlan, candidates: List[Candidate]):
+    """Add the candidates as restic excludes to the volumes holding them"""
+    for volume in plan.volumes:
+        prefix = volume.destination.rstrip("/") + "/"
+        volume.excludes = volume.excludes + [
+            c.path for c in candidates if c.path.startswith(prefix)
+        ]
+
+
+def log_report(candidates: List[Candidate], excluded: bool):
+    """Log the candidates and what excluding them saves"""
+    if not candidates:
+        logger.info("No cache directories found")
+        return
+
+    logger.info("%s Cache Directories %s", "-" * 24, "-" * 24)
+    for candidate in candidates:
+        logger.info(
+            " - %s %s (%s): %s in %s files",
+            candidate.service,
+            candidate.path,
+            candidate.reason,
+            sizing.format_bytes(candidate.size.bytes),
+            candidate.size.files,
+        )
+    logger.info(
+        "%s %s in %s files",
+        "Excluded" if excluded else "Excluding would save",
+        sizing.format_bytes(sum(c.size.bytes for c in candidates)),
+        sum(c.size.files for c in candidates),
+    )
+    logger.info("-" * 67)
@@ -1,16 +1,28 @@
 import argparse
 import os
 import logging
+import time
+from datetime import datetime
 
 from restic_compose_backup import (
     alerts,
     backup_runner,
+    budget,
+    caches,
+    jobs,
     log,
+    pressure,
     restic,
+    retention,
+    scheduler,
+    sizing,
 )
 from restic_compose_backup.config import Config
 from restic_compose_backup.containers import RunningContainers
-from restic_compose_backup import cron, utils
+from restic_compose_backup.plan import PLAN_ENV, BackupPlan
+from restic_compose_backup.throttle import Throttle
+from restic_compose_backup import cron, enums, utils
+from restic_compose_backup import watch as watcher
 
 logger = logging.getLogger(__name__)
 
@@ -20,6 +32,17 @@ def main():
     args = parse_args()
     config = Config()
     log.setup(level=args.log_level or config.log_level)
+
+    # The backup process container runs the plan handed over by the parent
+    # and should not have to discover the containers all over again
+    if args.action == "start-backup-process":
+        start_backup_process(config)
+        return
+
+    if args.action == "start-watch-process":
+        start_watch_process(config)
+        return
+
     containers = RunningContainers()
 
     # Ensure log level is propagated to parent container if overridden
@@ -33,16 +56,28 @@ def main():
         snapshots(config, containers)
 
     elif args.action == "backup":
-        backup(config, containers)
-
-    elif args.action == "start-backup-process":
-        start_backup_process(config, containers)
+        services = args.service
+        if args.due:
+            services = due_services(config, containers, datetime.now())
+            if not services:
+                return
+            delay = schedule_delay(config, containers)
+            if delay:
+                logger.info("Starting in %ss to spread the load", delay)
+                time.sleep(delay)
+        backup(config, containers, services=services)
+
+    elif args.action == "watch":
+        watch(config, containers)
+
+    elif args.action == "plan":
+        plan(config, containers, as_json=args.json)
 
     elif args.action == "maintenance":
-        maintenance(config, containers)
+        maintenance(config, BackupPlan.from_containers(containers))
 
     elif args.action == "cleanup":
-        cleanup(config, containers)
+        cleanup(config, BackupPlan.from_containers(containers))
 
     elif args.action == "alert":
         alert(config, containers)
@@ -53,7 +88,10 @@ def main():
         print(restic_compose_backup.__version__)
 
     elif args.action == "crontab":
-        crontab(config)
+        crontab(config, containers)
+
+    elif args.action == "scheduler":
+        run_scheduler(config)
 
     elif args.action == "dump-env":
         dump_env()
@@ -77,6 +115,31 @@ def status(config, containers):
         "Include project name in backup path?: %s",
         utils.is_true(config.include_project_name),
     )
+    logger.info(
+        "Volume backup mode: %s (concurrency %s)",
+        config.volume_backup_mode,
+        config.backup_concurrency,
+    )
+    logger.info(
+        "restic options: %s",
+        " ".join(
+            restic.global_options(config, config.repository)
+            + restic.backup_options(config)
+            + Throttle.from_config(config).restic_args()
+        ),
+    )
+    throttle = Throttle.from_config(config)
+    logger.info(
+        "Backup priority: nice %s, ionice %s",
+        throttle.nice if throttle.nice is not None else "unchanged",
+        throttle.ionice or "unchanged",
+    )
+    if int(config.schedule_spread):
+        logger.info(
+            "Scheduled runs start %ss late (spread over %s minutes)",
+            schedule_delay(config, containers),
+            config.schedule_spread,
+        )
     logger.debug(
         "Exclude bind mounts from backups?: %s",
         utils.is_true(config.exclude_bind_mounts),
@@ -113,6 +176,8 @@ def status(config, containers):
 
         if container.volume_backup_enabled:
             logger.info(f" - stop during backup: {container.stop_during_backup}")
+            if container.pause_during_backup:
+                logger.info(" - pause during backup: True")
             for mount in container.filter_mounts():
                 logger.info(
                     " - volume: %s -> %s",
@@ -139,11 +204,43 @@ def status(config, containers):
     if len(backup_containers) == 0:
         logger.info("No containers in the project has 'stack-back.*' label")
 
+    backup_plan = BackupPlan.from_containers(containers, source_prefix="/volumes")
+    for volume in backup_plan.volumes:
+        if volume.shared_with:
+            logger.info(
+                "Shared source %s is backed up once by %s (also used by %s)",
+                volume.source,
+                volume.service,
+                ", ".join(volume.shared_with),
+            )
+
     logger.info("-" * 67)
 
+    status_sizing(config, backup_plan)
+
+
+def status_sizing(config, backup_plan):
+    """
+    Show the sizes of the last sizing pass with an ETA. Database sizes are
+    only queried live when ``BACKUP_SIZING`` is enabled.
+    """
+    volume_sizes, database_sizes = sizing.load_sizes(config)
+
+    if utils.is_true(config.backup_sizing):
+        try:
+            database_sizes.update(sizing.size_databases(backup_plan))
+        except Exception as ex:
+            logger.debug("Cannot query database sizes: %s", ex)
+
+    if volume_sizes or database_sizes:
+        sizing.log_report(config, volume_sizes, database_sizes)
 
-def backup(config, containers: RunningContainers):
-    """Request a backup to start"""
+
+def backup(config, containers: RunningContainers, services=None):
+    """
+    Request a backup to start. Optionally limited to the given services.
+    Returns True if the backup process succeeded.
+    """
     # Make sure we don't spawn multiple backup processes
     if containers.backup_process_running:
         alerts.send(
@@ -157,12 +254,30 @@ def backup(config, containers: RunningContainers):
         )
         raise RuntimeError("Backup process already running")
 
+    if containers.stale_backup_process_containers:
+        utils.remove_containers(containers.stale_backup_process_containers)
+
+    # The backup process container trusts the repository is ready
+    if not restic.is_initialized(config.repository):
+        logger.info("Repository is not initialized. Attempting to initialize it.")
+        if restic.init_repo(config.repository) != 0:
+            logger.error("Failed to initialize repository")
+
+    backup_plan = BackupPlan.from_containers(
+        containers, source_prefix="/volumes", services=services
+    )
+    if services and backup_plan.is_empty:
+        logger.warning("Nothing to back up for services: %s", ", ".join(services))
+        return True
+
     # Map all volumes from the backup container into the backup process container
     volumes = containers.this_container.volumes
 
     # Map volumes from other containers we are backing up
-    mounts = containers.generate_backup_mounts("/volumes")
-    volumes.update(mounts)
+    volumes.update(backup_plan.mounts(mode="ro"))
+
+    # Hand the plan over to the backup process
+    containers.this_container.set_config_env(PLAN_ENV, backup_plan.to_json())
 
     logger.debug(
         "Starting backup container with image %s", containers.this_container.image
@@ -173,7 +288,10 @@ def backup(config, containers: RunningContainers):
             command="rcb start-backup-process",
             volumes=volumes,
             environment=containers.this_container.environment,
-            source_container_id=containers.this_container.id,
+            # Backups triggered by the watcher share the network of the
+            # original backup container, not the one of the watcher
+            source_container_id=os.environ.get("WATCH_SOURCE_CONTAINER")
+            or containers.this_container.id,
             labels={
                 containers.backup_process_label: "True",
                 "com.docker.compose.project": containers.project_name,
@@ -186,7 +304,7 @@ def backup(config, containers: RunningContainers):
             body=str(ex),
             alert_type="ERROR",
         )
-        return
+        return False
 
     logger.info("Backup container exit code: %s", result)
 
@@ -197,9 +315,40 @@ def backup(config, containers: RunningContainers):
             body=open("backup.log").read(),
             alert_type="ERROR",
         )
+    return result == 0
+
+
+def plan(config, containers, as_json=False):
+    """Display the backup plan resolved from the running containers"""
+    backup_plan = BackupPlan.from_containers(containers, source_prefix="/volumes")
+    if as_json:
+        print(backup_plan.to_json(indent=2))
+        return
+
+    logger.info("Backup plan for compose project '%s'", backup_plan.project_name)
+    for volume in backup_plan.volumes:
+        logger.info(
+            " - volume (%s): %s -> %s",
+            volume.service,
+            volume.source,
+            volume.destination,
+        )
+        if volume.shared_with:
+            logger.info("   shared with: %s", ", ".join(volume.shared_with))
+    for database in backup_plan.databases:
+        logger.info(
+            " - %s (%s) -> %s",
+            database.container_type,
+            database.service,
+            database.destination,
+        )
+    for target in backup_plan.stop:
+        logger.info(
+            " - %s during backup: %s", "pause" if target.pause else "stop", target.name
+        )
 
 
-def start_backup_process(config, containers):
+def start_backup_process(config):
     """The actual backup process running inside the spawned container"""
     if not utils.is_true(os.environ.get("BACKUP_PROCESS_CONTAINER")):
         logger.error(
@@ -215,8 +364,18 @@ def start_backup_process(config, containers):
         )
         exit(1)
 
-    status(config, containers)
+    backup_plan = BackupPlan.from_env()
+    if backup_plan is None:
+        logger.warning("No backup plan received. Discovering containers instead.")
+        backup_plan = BackupPlan.from_containers(RunningContainers())
+
     errors = False
+    deadline = jobs.window_deadline(config)
+    if deadline is not None:
+        logger.info(
+            "Backup window ends at %s",
+            datetime.fromtimestamp(deadline).strftime("%Y-%m-%d %H:%M"),
+        )
 
     # Did we actually get any volumes mounted?
     try:
@@ -226,68 +385,202 @@ def start_backup_process(config, containers):
         has_volumes = False
 
     # Warn if there is nothing to do
-    if len(containers.containers_for_backup()) == 0 and not has_volumes:
+    if backup_plan.is_empty and not has_volumes:
         logger.error("No containers for backup found")
         exit(1)
 
-    # stop containers labeled to stop during backup
-    if len(containers.stop_during_backup_containers) > 0:
-        utils.stop_containers(containers.stop_during_backup_containers)
+    host_budget = budget.from_config(config)
+
+    volume_sizes, database_sizes = {}, {}
+    if utils.is_true(config.backup_sizing):
+        with budget.slot(host_budget, budget.KIND_SCAN, "sizing"):
+            logger.info("Sizing volumes and databases")
+            volume_sizes = sizing.size_volumes(
+                backup_plan, workers=int(config.sizing_workers)
+            )
+            database_sizes = sizing.size_databases(backup_plan)
+        sizing.save_sizes(config, volume_sizes, database_sizes)
+        sizing.log_report(config, volume_sizes, database_sizes)
+
+    if config.cache_discovery != caches.MODE_OFF:
+        with budget.slot(host_budget, budget.KIND_SCAN, "cache discovery"):
+            logger.info("Looking for cache directories in volumes")
+            candidates = caches.discover(
+                backup_plan, workers=int(config.sizing_workers)
+            )
+        excluded = config.cache_discovery == caches.MODE_EXCLUDE
+        if excluded:
+            caches.apply_excludes(backup_plan, candidates)
+        caches.log_report(candidates, excluded=excluded)
+
+    monitor = pressure.start_monitor(config)
+
+    deferred = []
+
+    # Containers labeled to stop during backup are only stopped while the
+    # volumes of their service are backed up
+    stops = jobs.service_stops(backup_plan)
 
     # back up volumes
     if has_volumes:
+        logger.info("Backing up volumes")
+        start = time.monotonic()
+        volume_jobs = jobs.volume_jobs(
+            config, backup_plan, source="/volumes", monitor=monitor, stops=stops
+        )
+        for stop in stops.values():
+            if not stop.jobs:
+                logger.warning(
+                    "Service %s has no volumes of its own. "
+                    "It is stopped while all volumes are backed up.",
+                    stop.service,
+                )
+                stop.stop()
         try:
-            logger.info("Backing up volumes")
-            vol_result = restic.backup_files(config.repository, source="/volumes")
-            logger.debug("Volume backup exit code: %s", vol_result)
-            if vol_result != 0:
-                logger.error("Volume backup exited with non-zero code: %s", vol_result)
-                errors = True
-        except Exception as ex:
-            logger.error("Exception raised during volume backup")
-            logger.exception(ex)
+            results = jobs.run_scheduled(
+                config,
+                volume_jobs,
+                concurrency=int(config.backup_concurrency),
+                host_budget=host_budget,
+                deadline=deadline,
+            )
+        finally:
+            for stop in stops.values():
+                stop.start()
+        jobs.log_results(results)
+        jobs.log_downtime(stops.values())
+        deferred += [result for result in results if result.deferred]
+        if not all(result.ok for result in results):
+            logger.error("One or more volume backups exited with non-zero code")
             errors = True
+        elif not any(
+            result.skipped or result.waited or result.deferred for result in results
+        ):
+            # Skipped jobs would make the throughput look better than it is
+            # and waiting for other instances would make it look worse
+            sizing.record_throughput(
+                config,
+                sizing.KIND_VOLUME,
+                sum(size.bytes for size in volume_sizes.values()),
+                time.monotonic() - start,
+            )
 
     # back up databases
     logger.info("Backing up databases")
-    for container in containers.containers_for_backup():
-        if container.database_backup_enabled:
-            try:
-                instance = container.instance
-                logger.debug(
-                    "Backing up %s in service %s from project %s",
-                    instance.container_type,
-                    instance.service_name,
-                    instance.project_name,
-                )
-                result = instance.backup()
-                logger.debug("Exit code: %s", result)
-                if result != 0:
-                    logger.error("Backup command exited with non-zero code: %s", result)
-                    errors = True
-            except Exception as ex:
-                logger.exception(ex)
-                errors = True
-
-    # restart stopped containers after backup
-    if len(containers.stop_during_backup_containers) > 0:
-        utils.start_containers(containers.stop_during_backup_containers)
+    start = time.monotonic()
+    results = jobs.run_scheduled(
+        config,
+        jobs.database_jobs(config, backup_plan, monitor=monitor),
+        concurrency=int(config.database_concurrency),
+        host_budget=host_budget,
+        deadline=deadline,
+    )
+    jobs.log_results(results)
+    deferred += [result for result in results if result.deferred]
+    if not all(result.ok for result in results):
+        logger.error("One or more database backups exited with non-zero code")
+        errors = True
+    elif not any(result.waited or result.deferred for result in results):
+        sizing.record_throughput(
+            config,
+            sizing.KIND_DATABASE,
+            sum(size.bytes for size in database_sizes.values()),
+            time.monotonic() - start,
+        )
+
+    if monitor is not None:
+        monitor.stop()
+
+    if deferred:
+        alerts.send(
+            subject=f"{backup_plan.project_name}: Backup jobs deferred",
+            body=(
+                "These jobs would not have finished within the backup window "
+                "and go first in the next run:\n"
+                + "\n".join(f"{r.kind} {r.name}" for r in deferred)
+            ),
+        )
 
     if errors:
         logger.error("Exit code: %s", errors)
         exit(1)
 
-    # Only run maintenance tasks if maintenance is not scheduled
+    # Only run maintenance tasks if maintenance is not scheduled. Runs of
+    # some services leave it to the next full run so frequent change
+    # triggered and scheduled runs do not prune every few minutes.
     if not config.maintenance_schedule:
-        maintenance(config, containers)
+        if backup_plan.is_partial:
+            logger.info("Skipping maintenance after a backup of some services")
+        else:
+            maintenance(config, backup_plan)
 
     logger.info("Backup completed")
 
 
-def maintenance(config, containers):
+def watch(config, containers):
+    """Start the watch process container for change-triggered backups"""
+    if not utils.is_true(config.watch_enabled):
+        logger.info("Change-triggered backups are disabled (WATCH_ENABLED)")
+        return
+
+    # Replace any watcher left behind by a previous start
+    if containers.watch_process_containers:
+        logger.info("Replacing existing watch process containers")
+        utils.container_operation(
+            "stop", "stopping", containers.watch_process_containers
+        )
+        utils.container_operation(
+            "remove", "deleting", containers.watch_process_containers
+        )
+
+    backup_plan = BackupPlan.from_containers(containers, source_prefix="/volumes")
+    volumes = containers.this_container.volumes
+    volumes.update(backup_plan.mounts(mode="ro"))
+    containers.this_container.set_config_env(PLAN_ENV, backup_plan.to_json())
+
+    backup_runner.start_watch_process(
+        image=containers.this_container.image,
+        command="rcb start-watch-process",
+        volumes=volumes,
+        environment=containers.this_container.environment,
+        source_container_id=containers.this_container.id,
+        labels={
+            containers.watch_process_label: "True",
+            "com.docker.compose.project": containers.project_name,
+        },
+    )
+
+
+def start_watch_process(config):
+    """The watcher running inside the spawned watch process container"""
+    if not utils.is_true(os.environ.get("WATCH_PROCESS_CONTAINER")):
+        logger.error(
+            "Cannot run the watcher in this container. Use watch command instead."
+        )
+        exit(1)
+
+    backup_plan = BackupPlan.from_env()
+    if backup_plan is None:
+        backup_plan = BackupPlan.from_containers(RunningContainers())
+
+    def trigger(services):
+        containers = RunningContainers()
+        if containers.backup_process_running:
+            logger.info("Backup already running. Services stay dirty.")
+            return False
+        return backup(config, containers, services=services)
+
+    def source_running():
+        source = os.environ.get("WATCH_SOURCE_CONTAINER")
+        return not source or utils.is_container_running(source)
+
+    watcher.watch(config, backup_plan, trigger, keep_running=source_running)
+
+
+def maintenance(config, backup_plan: BackupPlan = None):
     """Run maintenance tasks"""
     logger.info("Running maintenance tasks")
-    result = cleanup(config, containers)
+    result = cleanup(config, backup_plan)
     if result != 0:
         logger.error("Cleanup exit code: %s", result)
         exit(1)
@@ -300,15 +593,13 @@ def maintenance(config, containers):
         exit(1)
 
 
-def cleanup(config, containers):
+def cleanup(config, backup_plan: BackupPlan = None):
     """Run forget / prune to minimize storage space"""
     logger.info("Forget outdated snapshots")
-    forget_result = restic.forget(
-        config.repository,
-        config.keep_daily,
-        config.keep_weekly,
-        config.keep_monthly,
-        config.keep_yearly,
+    forget_result = retention.forget(
+        config,
+        backup_plan.retention if backup_plan else None,
+        backup_plan.projects if backup_plan else None,
     )
     logger.info("Prune stale data freeing storage space")
     prune_result = restic.prune(config.repository)
@@ -331,9 +622,120 @@ def alert(config, containers):
     )
 
 
-def crontab(config):
+def crontab(config, containers: RunningContainers):
     """Generate the crontab"""
-    print(cron.generate_crontab(config))
+    # Only check for the label. The output must not contain warnings.
+    scheduled = any(
+        container.get_label(enums.LABEL_SCHEDULE)
+        for container in containers.containers_for_backup()
+    )
+    print(
+        cron.generate_crontab(
+            config, scheduled=scheduled, delay=schedule_delay(config, containers)
+        )
+    )
+
+
+def schedule_delay(config, containers: RunningContainers) -> int:
+    """
+    int: Seconds scheduled runs start after their time. The offset is
+    stable for a host and project and spread over ``SCHEDULE_SPREAD``.
+    """
+    spread = int(config.schedule_spread)
+    if not spread:
+        return 0
+    key = config.schedule_jitter_key or (
+        f"{utils.get_host_name()}/{containers.project_name}"
+    )
+    return cron.jitter_offset(key, spread)
+
+
+def scheduled_jobs(config, containers: RunningContainers) -> list:
+    """
+    list: The backup schedules of the services and the maintenance
+    schedule. Services without a ``stack-back.schedule`` label follow
+    ``CRON_SCHEDULE``.
+    """
+    try:
+        default = cron.parse(config.cron_schedule)
+    except ValueError:
+        default = cron.parse(config.default_crontab_schedule)
+
+    by_schedule, unscheduled = {}, []
+    for container in containers.containers_for_backup():
+        service = container.service_name
+        services = (
+            by_schedule.setdefault(container.schedule, [])
+            if container.schedule
+            else unscheduled
+        )
+        if service not in services:
+            services.append(service)
+
+    jobs = [
+        scheduler.ScheduledJob(
+            f"backup [{expression}]", cron.parse(expression), services=services
+        )
+        for expression, services in by_schedule.items()
+    ]
+    if not by_schedule:
+        jobs.append(scheduler.ScheduledJob("backup", default))
+    elif unscheduled:
+        jobs.append(scheduler.ScheduledJob("backup", default, services=unscheduled))
+
+    if config.maintenance_schedule and cron.validate_schedule(
+        cron.strip_quotes(config.maintenance_schedule.strip())
+    ):
+        jobs.append(
+            scheduler.ScheduledJob(
+                "maintenance",
+                cron.parse(config.maintenance_schedule),
+                group=scheduler.GROUP_MAINTENANCE,
+            )
+        )
+    return jobs
+
+
+def due_services(config, containers: RunningContainers, when: datetime) -> list:
+    """
+    list: Services due in the minute of ``when``. All due services are
+    backed up in the same run.
+    """
+    due = [
+        job
+        for job in scheduled_jobs(config, containers)
+        if job.group == scheduler.GROUP_BACKUP and job.schedule.matches(when)
+    ]
+    services = scheduler.merge_services(due)
+    if services is None:
+        services = [c.service_name for c in containers.containers_for_backup()]
+
+    if services:
+        logger.info("Services due for backup: %s", ", ".join(services))
+    return services
+
+
+def run_scheduler(config):
+    """Run the built-in scheduler in the foreground"""
+
+    def load_jobs():
+        return scheduled_jobs(config, RunningContainers())
+
+    def run_group(group, services):
+        containers = RunningContainers()
+        if group == scheduler.GROUP_MAINTENANCE:
+            maintenance(config, BackupPlan.from_containers(containers))
+        else:
+            backup(config, containers, services=services)
+
+    logger.info("Starting the built-in scheduler")
+    scheduler.Scheduler(
+        config,
+        load_jobs,
+        run_group,
+        overlap=config.scheduler_overlap,
+        delay=schedule_delay(config, RunningContainers()),
+    ).run()
 
 
 def dump_env():
@@ -351,12 +753,16 @@ def parse_args():
             "status",
             "snapshots",
             "backup",
+            "plan",
             "start-backup-process",
+            "watch",
+            "start-watch-process",
             "maintenance",
             "alert",
             "cleanup",
             "version",
             "crontab",
+            "scheduler",
             "dump-env",
             "test",
         ],
@@ -367,6 +773,22 @@ def parse_args():
         choices=list(log.LOG_LEVELS.keys()),
         help="Log level",
     )
+    parser.add_argument(
+        "--service",
+        action="append",
+        default=None,
+        help="Only back up the given service. Can be repeated.",
+    )
+    parser.add_argument(
+        "--due",
+        action="store_true",
+        help="Only back up the services due now by their schedule",
+    )
+    parser.add_argument(
+        "--json",
+        action="store_true",
+        help="Output the plan as JSON",
+    )
     return parser.parse_args()
 
 
@@ -1,6 +1,8 @@
+import asyncio
+import functools
 import logging
 from typing import List, Tuple, Union
-from restic_compose_backup import utils
+from restic_compose_backup.async_docker import AsyncDockerClient
 from subprocess import Popen, PIPE
 
 logger = logging.getLogger(__name__)
@@ -63,11 +65,13 @@ def docker_exec(
     container_id: str, cmd: List[str], environment: Union[dict, list] = []
 ) -> int:
     """Execute a command within the given container"""
-    client = utils.docker_client()
     logger.debug("docker exec inside %s: %s", container_id, " ".join(cmd))
-    exit_code, (stdout, stderr) = client.containers.get(container_id).exec_run(
-        cmd, demux=True, environment=environment
-    )
+
+    async def _exec():
+        async with AsyncDockerClient.from_env() as client:
+            return await client.exec_run(container_id, cmd, environment=environment)
+
+    exit_code, stdout, stderr = asyncio.run(_exec())
 
     if stdout:
         log_std(
@@ -102,6 +106,15 @@ def run(cmd: List[str]) -> int:
     return child.returncode
 
 
+def run_capture(cmd: List[str]) -> Tuple[int, bytes, bytes]:
+    """Run a command with parameters and return the exit code, stdout and stderr"""
+    logger.debug("cmd: %s", " ".join(cmd))
+    child = Popen(cmd, stdout=PIPE, stderr=PIPE)
+    stdoutdata, stderrdata = child.communicate()
+    logger.debug("returncode %s", child.returncode)
+    return child.returncode, stdoutdata, stderrdata
+
+
 def run_capture_std(cmd: List[str]) -> Tuple[str, str]:
     """Run a command with parameters and return stdout, stderr"""
     logger.debug("cmd: %s", " ".join(cmd))
@@ -116,7 +129,7 @@ def log_std(source: str, data: str, level: int):
     if not data.strip():
         return
 
-    log_func = logger.debug if level == logging.DEBUG else logger.error
+    log_func = functools.partial(logger.log, level)
     log_func("%s %s %s", "-" * 10, source, "-" * 10)
 
     lines = data.split("\n")
@@ -8,6 +8,12 @@ class Config:
     default_backup_command = "source /.env && rcb backup > /proc/1/fd/1"
     default_crontab_schedule = "0 2 * * *"
     default_maintenance_command = "source /.env && rcb maintenance > /proc/1/fd/1"
+    # Runs every minute when services have their own schedule
+    default_dispatch_command = "source /.env && rcb backup --due > /proc/1/fd/1"
+    default_volume_backup_mode = "all"
+    volume_backup_modes = ["all", "service", "mount"]
+    cache_discovery_modes = ["off", "report", "exclude"]
+    scheduler_overlap_modes = ["skip", "queue"]
 
     """Bag for config values"""
 
@@ -45,6 +51,70 @@ class Config:
             os.environ.get("AUTO_BACKUP_ALL") or self.include_all_volumes
         )
 
+        # Volume backup jobs: "all" backs up /volumes in a single restic run,
+        # "service" and "mount" run one restic backup per service or mount
+        self.volume_backup_mode = (
+            os.environ.get("VOLUME_BACKUP_MODE") or self.default_volume_backup_mode
+        ).lower()
+        self.backup_concurrency = os.environ.get("BACKUP_CONCURRENCY") or "2"
+        self.database_concurrency = os.environ.get("DATABASE_CONCURRENCY") or "1"
+
+        # Local time (HH:MM) by which backups should be done
+        self.backup_window_end = os.environ.get("BACKUP_WINDOW_END") or ""
+
+        # Host name recorded in snapshots. Defaults to the compose project name.
+        self.restic_host = os.environ.get("RESTIC_HOST") or ""
+
+        # restic performance options. Empty values are picked from the
+        # repository backend and the number of CPUs.
+        self.restic_read_concurrency = os.environ.get("RESTIC_READ_CONCURRENCY") or ""
+        self.restic_pack_size = os.environ.get("RESTIC_PACK_SIZE") or ""
+        self.restic_connections = os.environ.get("RESTIC_CONNECTIONS") or ""
+        self.restic_no_scan = os.environ.get("RESTIC_NO_SCAN") or False
+        self.restic_compression = os.environ.get("RESTIC_COMPRESSION") or ""
+
+        # Priority and bandwidth limits of backup workloads
+        self.backup_nice = os.environ.get("BACKUP_NICE") or ""
+        self.backup_ionice = os.environ.get("BACKUP_IONICE") or ""
+        self.restic_limit_upload = os.environ.get("RESTIC_LIMIT_UPLOAD") or ""
+        self.restic_limit_download = os.environ.get("RESTIC_LIMIT_DOWNLOAD") or ""
+
+        # Adaptive throttling driven by host pressure (PSI)
+        self.pressure_target = os.environ.get("PRESSURE_TARGET") or ""
+        self.pressure_interval = os.environ.get("PRESSURE_INTERVAL") or "5"
+        self.pressure_max_pause = os.environ.get("PRESSURE_MAX_PAUSE") or "300"
+        self.pressure_limit_upload = os.environ.get("PRESSURE_LIMIT_UPLOAD") or "10240"
+
+        # Concurrency budget shared by the instances on a host
+        self.host_budget_dir = os.environ.get("HOST_BUDGET_DIR") or ""
+        self.host_budget = os.environ.get("HOST_BUDGET") or "1"
+
+        # Minutes over which scheduled starts are spread by host and project
+        self.schedule_spread = os.environ.get("SCHEDULE_SPREAD") or "0"
+        self.schedule_jitter_key = os.environ.get("SCHEDULE_JITTER_KEY") or ""
+
+        # Built-in scheduler (rcb scheduler)
+        self.scheduler_overlap = (os.environ.get("SCHEDULER_OVERLAP") or "skip").lower()
+        self.scheduler_catch_up = os.environ.get("SCHEDULER_CATCH_UP") or "true"
+
+        # Persistent state between runs
+        self.state_dir = os.environ.get("STATE_DIR") or "/cache/stack-back"
+        self.fingerprint_max_age_days = (
+            os.environ.get("FINGERPRINT_MAX_AGE_DAYS") or "7"
+        )
+
+        # Sizing pass with ETA before each backup run
+        self.backup_sizing = os.environ.get("BACKUP_SIZING") or False
+        self.sizing_workers = os.environ.get("SIZING_WORKERS") or "8"
+
+        # Discovery of cache directories in volumes: "off", "report" or "exclude"
+        self.cache_discovery = (os.environ.get("CACHE_DISCOVERY") or "off").lower()
+
+        # Change-triggered backups
+        self.watch_enabled = os.environ.get("WATCH_ENABLED") or False
+        self.watch_debounce = os.environ.get("WATCH_DEBOUNCE") or "60"
+        self.watch_max_delay = os.environ.get("WATCH_MAX_DELAY") or "900"
+
         # Log
         self.log_level = os.environ.get("LOG_LEVEL")
 
@@ -74,5 +144,49 @@ class Config:
         if not self.password:
             raise ValueError("RESTIC_REPOSITORY env var not set")
 
+        if self.cache_discovery not in self.cache_discovery_modes:
+            raise ValueError(
+                f"CACHE_DISCOVERY must be one of {', '.join(self.cache_discovery_modes)}"
+            )
+
+        if self.scheduler_overlap not in self.scheduler_overlap_modes:
+            raise ValueError(
+                f"SCHEDULER_OVERLAP must be one of {', '.join(self.scheduler_overlap_modes)}"
+            )
+
+        positive_integers = {
+            "BACKUP_CONCURRENCY": self.backup_concurrency,
+            "DATABASE_CONCURRENCY": self.database_concurrency,
+            "SIZING_WORKERS": self.sizing_workers,
+            "PRESSURE_INTERVAL": self.pressure_interval,
+            "PRESSURE_MAX_PAUSE": self.pressure_max_pause,
+            "PRESSURE_LIMIT_UPLOAD": self.pressure_limit_upload,
+        }
+        for name, value in positive_integers.items():
+            if not str(value).isdigit() or int(value) < 1:
+                raise ValueError(f"{name} must be a positive integer")
+
+        if not self.schedule_spread.isdigit():
+            raise ValueError("SCHEDULE_SPREAD must be a number of minutes")
+
+        for name, value in {
+            "WATCH_DEBOUNCE": self.watch_debounce,
+            "WATCH_MAX_DELAY": self.watch_max_delay,
+        }.items():
+            if not str(value).isdigit():
+                raise ValueError(f"{name} must be a number of seconds")
+
+        try:
+            max_age = float(self.fingerprint_max_age_days)
+        except ValueError:
+            max_age = -1.0
+        if not max_age >= 0:
+            raise ValueError("FINGERPRINT_MAX_AGE_DAYS must be a number of days")
+
+        if self.volume_backup_mode not in self.volume_backup_modes:
+            raise ValueError(
+                f"VOLUME_BACKUP_MODE must be one of {', '.join(self.volume_backup_modes)}"
+            )
+
 
 config = Config()
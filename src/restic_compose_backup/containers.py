@@ -1,9 +1,11 @@
+import fnmatch
 import logging
 from pathlib import Path
+import re
 import socket
-from typing import List
+from typing import List, Tuple
 
-from restic_compose_backup import enums, utils
+from restic_compose_backup import cron, enums, fingerprint, throttle, utils
 from restic_compose_backup.config import config
 
 logger = logging.getLogger(__name__)
@@ -11,6 +13,46 @@ logger = logging.getLogger(__name__)
 VOLUME_TYPE_BIND = "bind"
 VOLUME_TYPE_VOLUME = "volume"
 
+SHARD_BY_HASH = "hash"
+SHARD_BY_DIRECTORY = "directory"
+
+# Labels relaxing or disabling restic's change detection per mount
+CHANGE_DETECTION_LABELS = {
+    "ignore-inode": enums.LABEL_VOLUMES_IGNORE_INODE,
+    "ignore-ctime": enums.LABEL_VOLUMES_IGNORE_CTIME,
+    "force": enums.LABEL_VOLUMES_FORCE,
+}
+
+# restic --compression levels
+COMPRESSION_LEVELS = ["off", "auto", "max"]
+
+# Job priorities. High priority jobs are never deferred.
+PRIORITY_HIGH = "high"
+PRIORITY_NORMAL = "normal"
+PRIORITY_LOW = "low"
+PRIORITIES = [PRIORITY_HIGH, PRIORITY_NORMAL, PRIORITY_LOW]
+
+# Sizes accepted by restic --exclude-larger-than
+SIZE_PATTERN = re.compile(r"^\d+[kmgt]?$", re.IGNORECASE)
+
+
+def compile_patterns(patterns: List[str]):
+    """
+    Compile mount source patterns into a single regex. Plain patterns match
+    anywhere in the source. Patterns with glob characters (``*?[``) have to
+    match the whole source. Returns None if there are no patterns.
+    """
+    if not patterns:
+        return None
+
+    parts = []
+    for pattern in patterns:
+        if any(char in pattern for char in "*?["):
+            parts.append("^" + fnmatch.translate(pattern))
+        else:
+            parts.append(re.escape(pattern))
+    return re.compile("|".join(parts))
+
 
 class Container:
     """Represents a docker container"""
@@ -32,8 +74,12 @@ class Container:
         if self._labels is None:
             raise ValueError("Container meta missing Config->Labels")
 
-        self._include = self._parse_pattern(self.get_label(enums.LABEL_VOLUMES_INCLUDE))
-        self._exclude = self._parse_pattern(self.get_label(enums.LABEL_VOLUMES_EXCLUDE))
+        self._include = compile_patterns(
+            self._parse_pattern(self.get_label(enums.LABEL_VOLUMES_INCLUDE))
+        )
+        self._exclude = compile_patterns(
+            self._parse_pattern(self.get_label(enums.LABEL_VOLUMES_EXCLUDE))
+        )
 
     @property
     def instance(self) -> "Container":
@@ -78,6 +124,11 @@ class Container:
         """str: The unique backup process label for this project"""
         return f"{enums.LABEL_BACKUP_PROCESS}-{self.project_name}"
 
+    @property
+    def watch_process_label(self) -> str:
+        """str: The unique watch process label for this project"""
+        return f"{enums.LABEL_WATCH_PROCESS}-{self.project_name}"
+
     @property
     def project_name(self) -> str:
         """str: Name of the compose setup"""
@@ -204,11 +255,103 @@ class Container:
             and not self.database_backup_enabled
         )
 
+    @property
+    def pause_during_backup(self) -> bool:
+        """
+        bool: If the ``stack-back.volumes.pause-during-backup`` label is set.
+        Stopping during backup takes precedence.
+        """
+        return (
+            utils.is_true(self.get_label(enums.LABEL_PAUSE_DURING_BACKUP))
+            and not self.database_backup_enabled
+            and not self.stop_during_backup
+        )
+
+    @property
+    def volume_sharding(self) -> Tuple[str, int]:
+        """
+        tuple: How each mount is split into restic backups from the
+        ``stack-back.volumes.shards`` label. Either ``("hash", <count>)``,
+        ``("directory", 0)`` or ``(None, 0)`` when not sharded.
+        """
+        value = self.get_label(enums.LABEL_VOLUMES_SHARDS)
+        if not value:
+            return None, 0
+
+        value = str(value).strip().lower()
+        if value == SHARD_BY_DIRECTORY:
+            return SHARD_BY_DIRECTORY, 0
+
+        try:
+            count = int(value)
+        except ValueError:
+            logger.warning(
+                "Invalid %s label in service %s: %s",
+                enums.LABEL_VOLUMES_SHARDS,
+                self.service_name,
+                value,
+            )
+            return None, 0
+
+        if count < 2:
+            return None, 0
+        return SHARD_BY_HASH, count
+
+    @property
+    def volume_skip_unchanged(self) -> str:
+        """
+        str: Fingerprint mode used to skip unchanged mounts from the
+        ``stack-back.volumes.skip-unchanged`` label or None if disabled
+        """
+        value = self.get_label(enums.LABEL_VOLUMES_SKIP_UNCHANGED)
+        if value is None or utils.is_false(value):
+            return None
+        if utils.is_true(value):
+            return fingerprint.MODE_STAT
+
+        value = str(value).strip().lower()
+        if value not in fingerprint.MODES:
+            logger.warning(
+                "Invalid %s label in service %s: %s",
+                enums.LABEL_VOLUMES_SKIP_UNCHANGED,
+                self.service_name,
+                value,
+            )
+            return None
+        return value
+
+    def change_detection(self, mount) -> List[str]:
+        """
+        list: restic change detection options for a mount. Each option label
+        is either ``true`` for all mounts or a comma separated list of
+        patterns matched against the mount source like the include label.
+        """
+        options = []
+        for option, label in CHANGE_DETECTION_LABELS.items():
+            value = self.get_label(label)
+            if value is None or utils.is_false(value):
+                continue
+            if utils.is_true(value):
+                options.append(option)
+                continue
+
+            patterns = [p.strip() for p in self._parse_pattern(value) or []]
+            matcher = compile_patterns([p for p in patterns if p])
+            if matcher and matcher.search(mount.source):
+                options.append(option)
+
+        return options
+
     @property
     def is_backup_process_container(self) -> bool:
         """Is this container the running backup process?"""
         return self.get_label(self.backup_process_label) == "True"
 
+    @property
+    def is_watch_process_container(self) -> bool:
+        """Is this container the watch process?"""
+        return self.get_label(self.watch_process_label) == "True"
+
     @property
     def is_running(self) -> bool:
         """bool: Is the container running?"""
@@ -243,22 +386,10 @@ class Container:
             return filtered
 
         if self._include:
-            for mount in mounts:
-                for pattern in self._include:
-                    if pattern in mount.source:
-                        break
-                else:
-                    continue
-
-                filtered.append(mount)
+            filtered = [m for m in mounts if self._include.search(m.source)]
 
         elif self._exclude:
-            for mount in mounts:
-                for pattern in self._exclude:
-                    if pattern in mount.source:
-                        break
-                else:
-                    filtered.append(mount)
+            filtered = [m for m in mounts if not self._exclude.search(m.source)]
         else:
             for mount in mounts:
                 if (
@@ -282,8 +413,8 @@ class Container:
 
         return volumes
 
-    def get_volume_backup_destination(self, mount, source_prefix) -> str:
-        """Get the destination path for backups of the given mount"""
+    def get_volume_backup_root(self, source_prefix) -> Path:
+        """Path: The directory all mounts of this service are backed up under"""
         destination = Path(source_prefix)
 
         if utils.is_true(config.include_project_name):
@@ -291,15 +422,178 @@ class Container:
             if project_name != "":
                 destination /= project_name
 
-        destination /= self.service_name
+        return destination / self.service_name
+
+    def get_volume_backup_destination(self, mount, source_prefix) -> str:
+        """Get the destination path for backups of the given mount"""
+        destination = self.get_volume_backup_root(source_prefix)
         destination /= Path(utils.strip_root(mount.destination))
 
         return str(destination)
 
+    def volume_excludes(self, source_prefix) -> List[str]:
+        """
+        list: restic exclude patterns from the ``stack-back.volumes.exclude-paths``
+        label. Absolute patterns are paths inside the container. Other patterns
+        match anywhere in the mounts. Both are anchored to this service so they
+        never affect other services backed up in the same restic run.
+        """
+        root = self.get_volume_backup_root(source_prefix)
+        excludes = []
+        for pattern in (
+            self._parse_pattern(self.get_label(enums.LABEL_VOLUMES_EXCLUDE_PATHS)) or []
+        ):
+            pattern = pattern.strip()
+            if not pattern:
+                continue
+            if pattern.startswith("/"):
+                excludes.append(str(root / utils.strip_root(pattern)))
+            else:
+                excludes.append(str(root / "**" / pattern))
+        return excludes
+
+    @property
+    def volume_exclude_larger_than(self) -> str:
+        """str: Size from the ``stack-back.volumes.exclude-larger-than`` label"""
+        value = self.get_label(enums.LABEL_VOLUMES_EXCLUDE_LARGER_THAN)
+        if not value:
+            return None
+
+        value = str(value).strip()
+        if not SIZE_PATTERN.match(value):
+            logger.warning(
+                "Invalid %s label in service %s: %s",
+                enums.LABEL_VOLUMES_EXCLUDE_LARGER_THAN,
+                self.service_name,
+                value,
+            )
+            return None
+        return value
+
+    @property
+    def volume_exclude_if_present(self) -> List[str]:
+        """list: File names from the ``stack-back.volumes.exclude-if-present`` label"""
+        names = self._parse_pattern(
+            self.get_label(enums.LABEL_VOLUMES_EXCLUDE_IF_PRESENT)
+        )
+        return [name.strip() for name in names or [] if name.strip()]
+
+    @property
+    def compression(self) -> str:
+        """str: Compression level from the ``stack-back.compression`` label"""
+        value = self.get_label(enums.LABEL_COMPRESSION)
+        if not value:
+            return None
+
+        value = str(value).strip().lower()
+        if value not in COMPRESSION_LEVELS:
+            logger.warning(
+                "Invalid %s label in service %s: %s",
+                enums.LABEL_COMPRESSION,
+                self.service_name,
+                value,
+            )
+            return None
+        return value
+
+    @property
+    def priority(self) -> str:
+        """str: Job priority from the ``stack-back.priority`` label"""
+        value = self.get_label(enums.LABEL_PRIORITY)
+        if not value:
+            return None
+
+        value = str(value).strip().lower()
+        if value not in PRIORITIES:
+            logger.warning(
+                "Invalid %s label in service %s: %s",
+                enums.LABEL_PRIORITY,
+                self.service_name,
+                value,
+            )
+            return None
+        return value
+
+    @property
+    def schedule(self) -> str:
+        """str: Cron schedule from the ``stack-back.schedule`` label"""
+        value = self.get_label(enums.LABEL_SCHEDULE)
+        if not value:
+            return None
+
+        try:
+            return str(cron.parse(value))
+        except ValueError as ex:
+            logger.warning(
+                "Invalid %s label in service %s: %s",
+                enums.LABEL_SCHEDULE,
+                self.service_name,
+                ex,
+            )
+            return None
+
+    @property
+    def throttle(self) -> dict:
+        """
+        dict: Priority and bandwidth overrides from the ``stack-back.nice``,
+        ``stack-back.ionice`` and ``stack-back.limit-*`` labels
+        """
+        labels = {
+            "nice": enums.LABEL_NICE,
+            "ionice": enums.LABEL_IONICE,
+            "limit_upload": enums.LABEL_LIMIT_UPLOAD,
+            "limit_download": enums.LABEL_LIMIT_DOWNLOAD,
+        }
+        overrides = {}
+        for key, label in labels.items():
+            value = self.get_label(label)
+            if value is None:
+                continue
+            try:
+                overrides[key] = throttle.PARSERS[key](value)
+            except ValueError as ex:
+                logger.warning(
+                    "Invalid %s label in service %s: %s",
+                    label,
+                    self.service_name,
+                    ex,
+                )
+        return overrides
+
+    @property
+    def retention(self) -> dict:
+        """dict: Keep policy overrides from the ``stack-back.keep-*`` labels"""
+        labels = {
+            "daily": enums.LABEL_KEEP_DAILY,
+            "weekly": enums.LABEL_KEEP_WEEKLY,
+            "monthly": enums.LABEL_KEEP_MONTHLY,
+            "yearly": enums.LABEL_KEEP_YEARLY,
+        }
+        keep = {}
+        for period, label in labels.items():
+            value = self.get_label(label)
+            if value is None:
+                continue
+            value = str(value).strip()
+            if not value.isdigit():
+                logger.warning(
+                    "Invalid %s label in service %s: %s",
+                    label,
+                    self.service_name,
+                    value,
+                )
+                continue
+            keep[period] = value
+        return keep
+
     def get_credentials(self) -> dict:
         """dict: get credentials for the service"""
         raise NotImplementedError("Base container class don't implement this")
 
+    def credential_env_references(self) -> dict:
+        """dict: Map dump exec env vars to the container env vars holding the secret"""
+        return {}
+
     def ping(self) -> bool:
         """Check the availability of the service"""
         raise NotImplementedError("Base container class don't implement this")
@@ -316,6 +610,10 @@ class Container:
         """list: create a dump command restic and use to send data through stdin"""
         raise NotImplementedError("Base container class don't implement this")
 
+    def size_command(self) -> list:
+        """list: create a command printing the size of the data in bytes"""
+        raise NotImplementedError("Base container class don't implement this")
+
     def _parse_pattern(self, value: str) -> List[str]:
         """list: Safely parse include/exclude pattern from user"""
         if not value:
@@ -402,7 +700,9 @@ class RunningContainers:
         self.this_container = None
         self.backup_process_container = None
         self.stale_backup_process_containers = []
+        self.watch_process_containers = []
         self.stop_during_backup_containers = []
+        self.pause_during_backup_containers = []
 
         # Find the container we are running in.
         # If we don't have this information we cannot continue
@@ -425,6 +725,13 @@ class RunningContainers:
             ):
                 self.stale_backup_process_containers.append(container)
 
+            # Gather watch process containers in any state
+            if (
+                self.this_container.image == container.image
+                and container.is_watch_process_container
+            ):
+                self.watch_process_containers.append(container)
+
             # We only care about running containers after this point
             if not container.is_running:
                 continue
@@ -437,9 +744,11 @@ class RunningContainers:
             ):
                 continue
 
-            # Gather stop during backup containers
+            # Gather stop and pause during backup containers
             if container.stop_during_backup:
                 self.stop_during_backup_containers.append(container)
+            if container.pause_during_backup:
+                self.pause_during_backup_containers.append(container)
 
             # Detect running backup process container
             if container.is_backup_process_container:
@@ -465,6 +774,11 @@ class RunningContainers:
         """str: The backup process label for this project"""
         return self.this_container.backup_process_label
 
+    @property
+    def watch_process_label(self) -> str:
+        """str: The watch process label for this project"""
+        return self.this_container.watch_process_label
+
     @property
     def backup_process_running(self) -> bool:
         """Is the backup process container running?"""
@@ -476,14 +790,12 @@ class RunningContainers:
 
     def generate_backup_mounts(self, dest_prefix="/volumes") -> dict:
         """Generate mounts for backup for the entire compose setup"""
-        mounts = {}
-        for container in self.containers_for_backup():
-            if container.volume_backup_enabled:
-                mounts.update(
-                    container.volumes_for_backup(source_prefix=dest_prefix, mode="ro")
-                )
+        from restic_compose_backup.plan import BackupPlan
 
-        return mounts
+        # The plan backs up shared and nested sources once
+        return BackupPlan.from_containers(self, source_prefix=dest_prefix).mounts(
+            mode="ro"
+        )
 
     def get_service(self, name) -> Container:
         """Container: Get a service by name"""
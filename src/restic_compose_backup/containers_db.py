@@ -27,6 +27,12 @@ class MariadbContainer(Container):
             "port": "3306",
         }
 
+    def credential_env_references(self) -> dict:
+        """dict: Map dump exec env vars to the container env vars holding the secret"""
+        if self.get_config_env("MARIADB_ROOT_PASSWORD") is not None:
+            return {"MYSQL_PWD": "MARIADB_ROOT_PASSWORD"}
+        return {"MYSQL_PWD": "MARIADB_PASSWORD"}
+
     def ping(self) -> bool:
         """Check the availability of the service"""
         creds = self.get_credentials()
@@ -56,6 +62,19 @@ class MariadbContainer(Container):
             "--force",
         ]
 
+    def size_command(self) -> list:
+        """list: create a command printing the size of the data in bytes"""
+        creds = self.get_credentials()
+        return [
+            "mariadb",
+            f"--user={creds['username']}",
+            "--skip-column-names",
+            "--batch",
+            "--execute",
+            "SELECT COALESCE(SUM(data_length + index_length), 0) "
+            "FROM information_schema.tables",
+        ]
+
     def backup(self):
         config = Config()
         creds = self.get_credentials()
@@ -100,6 +119,12 @@ class MysqlContainer(Container):
             "port": "3306",
         }
 
+    def credential_env_references(self) -> dict:
+        """dict: Map dump exec env vars to the container env vars holding the secret"""
+        if self.get_config_env("MYSQL_ROOT_PASSWORD") is not None:
+            return {"MYSQL_PWD": "MYSQL_ROOT_PASSWORD"}
+        return {"MYSQL_PWD": "MYSQL_PASSWORD"}
+
     def ping(self) -> bool:
         """Check the availability of the service"""
         creds = self.get_credentials()
@@ -129,6 +154,19 @@ class MysqlContainer(Container):
             "--force",
         ]
 
+    def size_command(self) -> list:
+        """list: create a command printing the size of the data in bytes"""
+        creds = self.get_credentials()
+        return [
+            "mysql",
+            f"--user={creds['username']}",
+            "--skip-column-names",
+            "--batch",
+            "--execute",
+            "SELECT COALESCE(SUM(data_length + index_length), 0) "
+            "FROM information_schema.tables",
+        ]
+
     def backup(self):
         config = Config()
         creds = self.get_credentials()
@@ -192,6 +230,19 @@ class PostgresContainer(Container):
             creds["database"],
         ]
 
+    def size_command(self) -> list:
+        """list: create a command printing the size of the data in bytes"""
+        creds = self.get_credentials()
+        return [
+            "psql",
+            f"--username={creds['username']}",
+            f"--dbname={creds['database']}",
+            "--tuples-only",
+            "--no-align",
+            "--command",
+            "SELECT pg_database_size(current_database())",
+        ]
+
     def backup(self):
         config = Config()
         creds = self.get_credentials()
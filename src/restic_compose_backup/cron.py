@@ -10,22 +10,60 @@
 # * * * * * command to execute
 """
 
-QUOTE_CHARS = ['"', "'"]
+import hashlib
+from datetime import datetime, timedelta
+from typing import List, Set
 
+QUOTE_CHARS = ['"', "'"]
 
-def generate_crontab(config):
-    """Generate a crontab entry for running backup job"""
+# (name, lowest value, highest value)
+FIELDS = [
+    ("minute", 0, 59),
+    ("hour", 0, 23),
+    ("day", 1, 31),
+    ("month", 1, 12),
+    ("weekday", 0, 6),
+]
+MONTH_NAMES = "jan feb mar apr may jun jul aug sep oct nov dec".split()
+WEEKDAY_NAMES = "sun mon tue wed thu fri sat".split()
+MACROS = {
+    "@yearly": "0 0 1 1 *",
+    "@annually": "0 0 1 1 *",
+    "@monthly": "0 0 1 * *",
+    "@weekly": "0 0 * * 0",
+    "@daily": "0 0 * * *",
+    "@midnight": "0 0 * * *",
+    "@hourly": "0 * * * *",
+}
+
+
+def generate_crontab(config, scheduled: bool = False, delay: int = 0):
+    """
+    Generate a crontab entry for running backup job. With ``scheduled``
+    services have their own schedules and a dispatcher runs every minute
+    to back up the services that are due. Backups and maintenance start
+    ``delay`` seconds after their scheduled time. The dispatcher applies
+    the delay itself once it knows which services are due.
+    """
     backup_command = config.cron_command.strip()
     backup_schedule = config.cron_schedule
 
-    if backup_schedule:
+    if scheduled:
+        backup_schedule = "* * * * *"
+        backup_command = config.default_dispatch_command
+    elif backup_schedule:
         backup_schedule = backup_schedule.strip()
         backup_schedule = strip_quotes(backup_schedule)
-        if not validate_schedule(backup_schedule):
+        if validate_schedule(backup_schedule):
+            backup_schedule = Schedule(backup_schedule).crontab
+        else:
             backup_schedule = config.default_crontab_schedule
     else:
         backup_schedule = config.default_crontab_schedule
 
+    if delay and not scheduled:
+        backup_command = f"sleep {delay} && {backup_command}"
+
     crontab = f"{backup_schedule} {backup_command}\n"
 
     maintenance_command = config.maintenance_command.strip()
@@ -35,42 +73,36 @@ def generate_crontab(config):
         maintenance_schedule = maintenance_schedule.strip()
         maintenance_schedule = strip_quotes(maintenance_schedule)
         if validate_schedule(maintenance_schedule):
+            maintenance_schedule = Schedule(maintenance_schedule).crontab
+            if delay:
+                maintenance_command = f"sleep {delay} && {maintenance_command}"
             crontab += f"{maintenance_schedule} {maintenance_command}\n"
 
     return crontab
 
 
-def validate_schedule(schedule: str):
-    """Validate crontab format"""
-    parts = schedule.split()
-    if len(parts) != 5:
-        return False
+def jitter_offset(key: str, spread: int) -> int:
+    """
+    int: Seconds within a window of ``spread`` minutes picked from a key
+    such as the host and project name. The same key always gets the same
+    offset while different keys are spread evenly over the window.
+    """
+    if spread <= 0:
+        return 0
+    digest = hashlib.sha256(key.encode()).digest()
+    return int.from_bytes(digest[:8], "big") % (spread * 60)
 
-    for p in parts:
-        if p != "*" and not p.isdigit():
-            return False
 
-    minute, hour, day, month, weekday = parts
+def validate_schedule(schedule: str):
+    """Validate crontab format"""
     try:
-        validate_field(minute, 0, 59)
-        validate_field(hour, 0, 23)
-        validate_field(day, 1, 31)
-        validate_field(month, 1, 12)
-        validate_field(weekday, 0, 6)
+        Schedule(schedule)
     except ValueError:
         return False
 
     return True
 
 
-def validate_field(value, min, max):
-    if value == "*":
-        return
-
-    i = int(value)
-    return min <= i <= max
-
-
 def strip_quotes(value: str):
     """Strip enclosing single or double quotes if present"""
     if value[0] in QUOTE_CHARS:
@@ -79,3 +111,105 @@ def strip_quotes(value: str):
         value = value[:-1]
 
     return value
+
+
+class Schedule:
+    """A parsed cron schedule"""
+
+    def __init__(self, expression: str):
+        self.expression = expression.strip()
+        parts = MACROS.get(self.expression.lower(), self.expression).split()
+        # The five fields with macros expanded for crond
+        self.crontab = " ".join(parts)
+        if len(parts) != 5:
+            raise ValueError(f"Expected 5 fields in schedule: {expression}")
+
+        self.fields: List[Set[int]] = [
+            parse_field(part, name, low, high)
+            for part, (name, low, high) in zip(parts, FIELDS)
+        ]
+        # Standard cron: when both day fields are restricted either may match
+        self.any_day = not parts[2].startswith("*") and not parts[4].startswith("*")
+
+    def matches(self, when: datetime) -> bool:
+        """bool: Does the schedule fire in the minute of ``when``?"""
+        minutes, hours, _, months, _ = self.fields
+        if when.minute not in minutes or when.hour not in hours:
+            return False
+        return when.month in months and self._day_matches(when)
+
+    def _day_matches(self, when: datetime) -> bool:
+        _, _, days, _, weekdays = self.fields
+        day = when.day in days
+        weekday = (when.weekday() + 1) % 7 in weekdays
+        return (day or weekday) if self.any_day else (day and weekday)
+
+    def next_fire(self, after: datetime) -> datetime:
+        """datetime: The first minute after ``after`` the schedule fires in"""
+        minutes, hours, _, months, _ = self.fields
+        when = after.replace(second=0, microsecond=0) + timedelta(minutes=1)
+        # Leap days on a given weekday can take years to come around
+        limit = when + timedelta(days=366 * 8)
+        while when < limit:
+            if when.month not in months:
+                when = (when.replace(day=1) + timedelta(days=32)).replace(
+                    day=1, hour=0, minute=0
+                )
+            elif not self._day_matches(when):
+                when = when.replace(hour=0, minute=0) + timedelta(days=1)
+            elif when.hour not in hours:
+                when = when.replace(minute=0) + timedelta(hours=1)
+            elif when.minute not in minutes:
+                when += timedelta(minutes=1)
+            else:
+                return when
+
+        raise ValueError(f"Schedule never fires: {self.expression}")
+
+    def __str__(self):
+        return self.expression
+
+
+def parse_field(value: str, name: str, low: int, high: int) -> Set[int]:
+    """set: Values of a cron field with lists, ranges, steps and names"""
+    values = set()
+    for item in value.lower().split(","):
+        item, _, step = item.partition("/")
+        step = int(step) if step else 1
+        if step < 1:
+            raise ValueError(f"Invalid step in {name} field: {value}")
+
+        if item == "*":
+            start, end = low, high
+        else:
+            first, _, last = item.partition("-")
+            start = _parse_value(first, name)
+            # "5/15" means every 15 starting at 5
+            end = _parse_value(last, name) if last else (high if step > 1 else start)
+
+        if name == "weekday" and end == 7:
+            # 7 is also Sunday
+            values.add(0)
+            if start == 7:
+                continue
+            end = 6
+        if not (low <= start <= high and low <= end <= high) or start > end:
+            raise ValueError(f"Value out of range in {name} field: {value}")
+        values.update(range(start, end + 1, step))
+
+    return values
+
+
+def _parse_value(value: str, name: str) -> int:
+    if name == "month" and value in MONTH_NAMES:
+        return MONTH_NAMES.index(value) + 1
+    if name == "weekday" and value in WEEKDAY_NAMES:
+        return WEEKDAY_NAMES.index(value)
+    if not value.isdigit():
+        raise ValueError(f"Invalid value in {name} field: {value}")
+    return int(value)
+
+
+def parse(expression: str) -> Schedule:
+    """Schedule: A parsed schedule. Raises ValueError if it is invalid."""
+    return Schedule(strip_quotes(expression.strip()))
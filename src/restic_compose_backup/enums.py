@@ -3,9 +3,32 @@ LABEL_VOLUMES_ENABLED = "stack-back.volumes"
 LABEL_VOLUMES_INCLUDE = "stack-back.volumes.include"
 LABEL_VOLUMES_EXCLUDE = "stack-back.volumes.exclude"
 LABEL_STOP_DURING_BACKUP = "stack-back.volumes.stop-during-backup"
+LABEL_PAUSE_DURING_BACKUP = "stack-back.volumes.pause-during-backup"
+LABEL_VOLUMES_SHARDS = "stack-back.volumes.shards"
+LABEL_VOLUMES_SKIP_UNCHANGED = "stack-back.volumes.skip-unchanged"
+LABEL_VOLUMES_IGNORE_INODE = "stack-back.volumes.ignore-inode"
+LABEL_VOLUMES_IGNORE_CTIME = "stack-back.volumes.ignore-ctime"
+LABEL_VOLUMES_FORCE = "stack-back.volumes.force"
+LABEL_VOLUMES_EXCLUDE_PATHS = "stack-back.volumes.exclude-paths"
+LABEL_VOLUMES_EXCLUDE_LARGER_THAN = "stack-back.volumes.exclude-larger-than"
+LABEL_VOLUMES_EXCLUDE_IF_PRESENT = "stack-back.volumes.exclude-if-present"
+
+LABEL_COMPRESSION = "stack-back.compression"
+LABEL_NICE = "stack-back.nice"
+LABEL_IONICE = "stack-back.ionice"
+LABEL_LIMIT_UPLOAD = "stack-back.limit-upload"
+LABEL_LIMIT_DOWNLOAD = "stack-back.limit-download"
+LABEL_PRIORITY = "stack-back.priority"
+LABEL_SCHEDULE = "stack-back.schedule"
+
+LABEL_KEEP_DAILY = "stack-back.keep-daily"
+LABEL_KEEP_WEEKLY = "stack-back.keep-weekly"
+LABEL_KEEP_MONTHLY = "stack-back.keep-monthly"
+LABEL_KEEP_YEARLY = "stack-back.keep-yearly"
 
 LABEL_MYSQL_ENABLED = "stack-back.mysql"
 LABEL_POSTGRES_ENABLED = "stack-back.postgres"
 LABEL_MARIADB_ENABLED = "stack-back.mariadb"
 
 LABEL_BACKUP_PROCESS = "stack-back.process"
+LABEL_WATCH_PROCESS = "stack-back.watch"
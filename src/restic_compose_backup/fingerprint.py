@@ -0,0 +1,94 @@
+"""
+Cheap volume fingerprints used to skip restic scans of unchanged volumes.
+
+Two modes are supported:
+
+- ``dirs``: Modification times of all directories. Catches files being
+  created, deleted or renamed, but not files modified in place.
+- ``stat``: Size and modification time of every file and directory.
+  Catches all regular changes but has to stat every file.
+
+A volume is rescanned by restic at least every ``FINGERPRINT_MAX_AGE_DAYS``
+no matter what the fingerprint says.
+"""
+
+import hashlib
+import logging
+import os
+import time
+from typing import List
+
+from restic_compose_backup import state
+
+logger = logging.getLogger(__name__)
+
+MODE_DIRS = "dirs"
+MODE_STAT = "stat"
+MODES = [MODE_DIRS, MODE_STAT]
+
+STATE_NAME = "fingerprints"
+
+
+def fingerprint(paths: List[str], mode: str) -> str:
+    """str: Fingerprint of the given directory trees"""
+    digest = hashlib.sha256()
+    for path in sorted(paths):
+        stack = [path]
+        while stack:
+            directory = stack.pop()
+            try:
+                st = os.stat(directory, follow_symlinks=False)
+                with os.scandir(directory) as it:
+                    entries = sorted(it, key=lambda e: e.name)
+            except OSError as ex:
+                digest.update(f"{directory}\0error\0{ex.errno}\n".encode())
+                continue
+
+            digest.update(
+                f"{directory}\0{st.st_mtime_ns}\0{len(entries)}\n".encode(
+                    errors="surrogateescape"
+                )
+            )
+            for entry in entries:
+                if entry.is_dir(follow_symlinks=False):
+                    stack.append(entry.path)
+                elif mode == MODE_STAT:
+                    try:
+                        est = entry.stat(follow_symlinks=False)
+                    except OSError:
+                        continue
+                    digest.update(
+                        f"{entry.path}\0{est.st_size}\0{est.st_mtime_ns}\n".encode(
+                            errors="surrogateescape"
+                        )
+                    )
+
+    return f"{mode}:{digest.hexdigest()}"
+
+
+class Fingerprints:
+    """Fingerprints of the last successful backup per job"""
+
+    def __init__(self, config):
+        self.config = config
+        self.max_age = float(config.fingerprint_max_age_days) * 86400
+
+    def unchanged(self, key: str, value: str) -> bool:
+        """bool: Does the fingerprint match the last backup that is recent enough?"""
+        entry = state.load(self.config, STATE_NAME).get(key)
+        if not entry or entry.get("fingerprint") != value:
+            return False
+
+        if time.time() - entry.get("time", 0) > self.max_age:
+            logger.info("Forcing rescan of %s. Last scan is too old.", key)
+            return False
+
+        return True
+
+    def commit(self, key: str, value: str):
+        """Record the fingerprint after a successful backup"""
+
+        def _set(data):
+            data[key] = {"fingerprint": value, "time": time.time()}
+
+        state.update(self.config, STATE_NAME, _set)
@@ -0,0 +1,906 @@
+"""
+Backup jobs
+
+The backup process container breaks the backup plan down into jobs.
+Each job is a single restic invocation. Jobs are run concurrently
+with a configurable limit and report their own result.
+
+Services labelled to stop or pause during backup get their volumes
+backed up by their own jobs. A service is stopped when its first job
+starts and started again as soon as its last job is done while the
+other jobs keep running.
+"""
+
+import logging
+import os
+import threading
+import time
+import zlib
+from contextlib import ExitStack, contextmanager
+from datetime import datetime, timedelta
+from concurrent.futures import ThreadPoolExecutor
+from dataclasses import dataclass, field
+from typing import Dict, List
+
+from restic_compose_backup import budget, restic, retention, sizing, state, utils
+from restic_compose_backup.containers import (
+    PRIORITIES,
+    PRIORITY_LOW,
+    PRIORITY_NORMAL,
+    SHARD_BY_DIRECTORY,
+)
+from restic_compose_backup.fingerprint import (
+    MODE_DIRS,
+    MODE_STAT,
+    Fingerprints,
+    fingerprint,
+)
+from restic_compose_backup.plan import (
+    BackupPlan,
+    DatabaseTarget,
+    StopTarget,
+    VolumeTarget,
+)
+from restic_compose_backup.throttle import Throttle
+
+logger = logging.getLogger(__name__)
+
+DURATIONS_STATE = "durations"
+# Keys of the jobs deferred by the backup window
+DEFERRED_STATE = "deferred"
+# Weight of the latest run in the moving average duration of a job
+DURATION_WEIGHT = 0.3
+
+
+@dataclass
+class JobResult:
+    """The outcome of a single job"""
+
+    name: str
+    kind: str
+    service: str
+    exit_code: int
+    duration: float
+    skipped: bool = False
+    # The restic backup summary
+    summary: dict = field(default_factory=dict)
+    # Seconds spent waiting for a host budget slot
+    waited: float = 0.0
+    # Duration predicted from earlier runs or None if unknown
+    predicted: float = None
+    # Not started because it would not finish within the backup window
+    deferred: bool = False
+
+    @property
+    def ok(self) -> bool:
+        return self.exit_code == 0
+
+
+class ServiceStop:
+    """
+    Keeps the containers of a service stopped while the jobs backing up its
+    volumes run. The containers are stopped when the first of these jobs
+    starts and started again as soon as the last one is done. Containers
+    labelled to pause are frozen with ``docker pause`` instead.
+    """
+
+    def __init__(self, service: str, containers: List[StopTarget]):
+        self.service = service
+        self.containers = containers
+        # Jobs that have not finished yet
+        self.jobs = 0
+        self.stopped_at = None
+        self.downtime = None
+        self._lock = threading.Lock()
+
+    def stop(self):
+        """Stop the containers unless they are stopped already"""
+        with self._lock:
+            if self.stopped_at is None:
+                paused, stopped = self._split()
+                if stopped:
+                    utils.stop_containers(stopped)
+                if paused:
+                    utils.pause_containers(paused)
+                self.stopped_at = time.monotonic()
+
+    def start(self):
+        """Start the containers again if they were stopped"""
+        with self._lock:
+            if self.stopped_at is None:
+                return
+            paused, stopped = self._split()
+            if paused:
+                utils.unpause_containers(paused)
+            if stopped:
+                utils.start_containers(stopped)
+            self.downtime = (self.downtime or 0.0) + time.monotonic() - self.stopped_at
+            self.stopped_at = None
+        logger.info(
+            "Service %s is back after %s of downtime",
+            self.service,
+            sizing.format_duration(self.downtime),
+        )
+
+    def _split(self):
+        """tuple: The containers to pause and the containers to stop"""
+        paused = [c for c in self.containers if c.pause]
+        return paused, [c for c in self.containers if not c.pause]
+
+    def done(self):
+        """Count a job of the service as done. The last one starts it again."""
+        with self._lock:
+            self.jobs -= 1
+            last = self.jobs <= 0
+        if last:
+            self.start()
+
+    @contextmanager
+    def stopped(self):
+        """Keep the service stopped while a job of it runs"""
+        self.stop()
+        try:
+            yield
+        finally:
+            self.done()
+
+
+def service_stops(plan: BackupPlan) -> Dict[str, ServiceStop]:
+    """dict: The containers to stop during backup grouped by service"""
+    stops = {}
+    for target in plan.stop:
+        service = _service_key(plan, target.project, target.service)
+        stops.setdefault(service, ServiceStop(service, [])).containers.append(target)
+    return stops
+
+
+class Job:
+    """A unit of backup work"""
+
+    kind = None
+    # Kind of host budget slot the job needs
+    budget_kind = None
+
+    def __init__(self, name: str, service: str = None, priority: str = None):
+        self.name = name
+        self.service = service
+        self.priority = priority or PRIORITY_NORMAL
+        self.skipped = False
+        self.summary = {}
+        self.predicted = None
+        # Services kept stopped while the job runs
+        self.stops: List[ServiceStop] = []
+
+    @property
+    def key(self) -> str:
+        """str: Identifies the job in the duration history"""
+        return f"{self.kind}:{self.name}"
+
+    def run(self) -> int:
+        """Run the job and return the exit code"""
+        raise NotImplementedError("Base job class don't implement this")
+
+    def __repr__(self):
+        return str(self)
+
+    def __str__(self):
+        return "<{} {}>".format(self.__class__.__name__, self.name)
+
+
+class VolumeJob(Job):
+    """Back up one or more paths under /volumes in a single snapshot"""
+
+    kind = "volume"
+    budget_kind = budget.KIND_BACKUP
+
+    def __init__(
+        self,
+        name: str,
+        repository: str,
+        paths: List[str],
+        service: str = None,
+        tags: List[str] = None,
+        parent: str = None,
+        excludes: List[str] = None,
+        fingerprint_mode: str = None,
+        fingerprints: Fingerprints = None,
+        host: str = None,
+        change_detection: List[str] = None,
+        exclude_larger_than: str = None,
+        exclude_if_present: List[str] = None,
+        compression: str = None,
+        throttle: Throttle = None,
+        monitor=None,
+        priority: str = None,
+    ):
+        super().__init__(name, service=service, priority=priority)
+        self.repository = repository
+        self.paths = paths
+        self.tags = tags or []
+        self.parent = parent
+        self.excludes = excludes or []
+        self.host = host
+        self.change_detection = change_detection or []
+        self.exclude_larger_than = exclude_larger_than
+        self.exclude_if_present = exclude_if_present or []
+        self.compression = compression
+        self.throttle = throttle
+        # Pressure monitor adjusting the limits when the run starts
+        self.monitor = monitor
+        self.fingerprint_mode = fingerprint_mode
+        self.fingerprints = fingerprints
+
+    def run(self) -> int:
+        value = None
+        if self.fingerprint_mode and self.fingerprints:
+            # Taken before the backup so changes made during it are seen next time
+            value = fingerprint(self.paths, self.fingerprint_mode)
+            if self.fingerprints.unchanged(self.name, value):
+                logger.info("Skipping %s: no changes since last backup", self.name)
+                self.skipped = True
+                return 0
+
+        if "force" in self.change_detection:
+            logger.info("Forced full re-read of all files in %s", self.name)
+        elif not self.parent:
+            logger.info(
+                "No parent snapshot for %s. All files will be read in full.",
+                self.name,
+            )
+
+        throttle = self.throttle
+        if self.monitor is not None:
+            throttle = self.monitor.adjust(throttle)
+
+        exit_code = restic.backup_files(
+            self.repository,
+            source=self.paths,
+            tags=self.tags,
+            parent=self.parent,
+            excludes=self.excludes,
+            host=self.host,
+            change_detection=self.change_detection,
+            exclude_larger_than=self.exclude_larger_than,
+            exclude_if_present=self.exclude_if_present,
+            compression=self.compression,
+            summary=self.summary,
+            throttle=throttle,
+        )
+        if exit_code == 0 and value:
+            self.fingerprints.commit(self.name, value)
+        return exit_code
+
+
+class DatabaseJob(Job):
+    """Stream a database dump into restic"""
+
+    kind = "database"
+    budget_kind = budget.KIND_DUMP
+
+    def __init__(
+        self,
+        repository: str,
+        database: DatabaseTarget,
+        host: str = None,
+        throttle: Throttle = None,
+        monitor=None,
+    ):
+        super().__init__(
+            database.destination, service=database.service, priority=database.priority
+        )
+        self.repository = repository
+        self.database = database
+        self.host = host
+        self.throttle = throttle
+        self.monitor = monitor
+
+    def run(self) -> int:
+        database = self.database
+        logger.debug(
+            "Backing up %s in service %s from project %s",
+            database.container_type,
+            database.service,
+            database.project,
+        )
+        return restic.backup_from_stdin(
+            self.repository,
+            database.destination,
+            database.container_id,
+            database.dump_command,
+            environment=database.resolve_environment(),
+            host=self.host,
+            tags=retention.tags_for(database.project, database.service),
+            compression=database.compression,
+            summary=self.summary,
+            throttle=self.throttle,
+            monitor=self.monitor,
+        )
+
+
+def database_jobs(config, plan: BackupPlan, monitor=None) -> List[DatabaseJob]:
+    """Create one job per database dump in the plan"""
+    host = restic_host(config, plan)
+    return [
+        DatabaseJob(
+            config.repository,
+            database,
+            host=host,
+            throttle=Throttle.from_config(config, database.throttle),
+            monitor=monitor,
+        )
+        for database in plan.databases
+    ]
+
+
+def shard_paths(volume: VolumeTarget) -> Dict[str, List[str]]:
+    """
+    Split the top level entries of a mounted volume into shards.
+    The shard an entry belongs to only depends on its name so entries
+    stay in the same shard from run to run.
+    """
+    shards = {}
+    with os.scandir(volume.destination) as it:
+        entries = sorted(it, key=lambda e: e.name)
+
+    for entry in entries:
+        if volume.shard_by == SHARD_BY_DIRECTORY:
+            # Each directory is a shard. Loose files share one.
+            key = entry.name if entry.is_dir(follow_symlinks=False) else "_files"
+        else:
+            index = zlib.crc32(entry.name.encode(errors="surrogateescape"))
+            key = f"{index % volume.shards}of{volume.shards}"
+        shards.setdefault(key, []).append(entry.path)
+
+    return shards
+
+
+def fingerprint_mode(volumes: List[VolumeTarget]) -> str:
+    """str: Fingerprint mode for a job or None if any volume did not opt in"""
+    modes = {volume.skip_unchanged for volume in volumes}
+    if not volumes or None in modes:
+        return None
+    return MODE_STAT if MODE_STAT in modes else MODE_DIRS
+
+
+def restic_host(config, plan: BackupPlan) -> str:
+    """
+    str: The host name recorded in snapshots. It is pinned to the project
+    so snapshots keep matching when the backup process container changes.
+    """
+    return config.restic_host or plan.project_name or "stack-back"
+
+
+def shard_jobs(
+    config,
+    volume: VolumeTarget,
+    service: str,
+    fingerprints: Fingerprints = None,
+    snapshots: List[dict] = None,
+    host: str = None,
+    monitor=None,
+) -> List[VolumeJob]:
+    """
+    Create one job per shard of a volume. Each shard is tagged so its own
+    latest snapshot can be used as parent even when its paths change.
+    """
+    shards = shard_paths(volume)
+    if not shards:
+        logger.info("Sharded volume %s is empty", volume.destination)
+        return []
+
+    tags = {key: f"{retention.SHARD_TAG}{volume.destination}#{key}" for key in shards}
+    parents = restic.latest_by_tag(snapshots or [], list(tags.values()))
+    return [
+        VolumeJob(
+            f"{volume.destination}#{key}",
+            config.repository,
+            paths,
+            service=service,
+            tags=[tags[key]] + retention.tags_for(volume.project, volume.service),
+            parent=parents.get(tags[key]),
+            fingerprint_mode=volume.skip_unchanged,
+            fingerprints=fingerprints,
+            excludes=volume.excludes,
+            host=host,
+            change_detection=volume.change_detection,
+            exclude_larger_than=volume.exclude_larger_than,
+            exclude_if_present=volume.exclude_if_present,
+            compression=volume.compression,
+            throttle=Throttle.from_config(config, volume.throttle),
+            monitor=monitor,
+            priority=volume.priority,
+        )
+        for key, paths in shards.items()
+    ]
+
+
+def volume_jobs(
+    config,
+    plan: BackupPlan,
+    source="/volumes",
+    monitor=None,
+    stops: Dict[str, ServiceStop] = None,
+) -> List[VolumeJob]:
+    """
+    Create the volume jobs for the plan according to ``VOLUME_BACKUP_MODE``.
+    Partial runs of some services back up per service in the ``all`` mode.
+    The jobs take their upload limit from the pressure ``monitor`` if given.
+    Volumes of the services in ``stops`` are backed up by their own jobs
+    which keep the service stopped while they run.
+    """
+    jobs = []
+    fingerprints = Fingerprints(config)
+    host = restic_host(config, plan)
+    stops = stops or {}
+
+    def stops_for(volumes: List[VolumeTarget]) -> List[ServiceStop]:
+        """list: The stopped services having data in the volumes"""
+        services = set().union(*(_data_services(plan, v) for v in volumes))
+        return [stops[service] for service in sorted(services) if service in stops]
+
+    # A single listing serves the parent lookup of every job
+    snapshots = restic.snapshots_json(config.repository)
+    parents = restic.latest_by_paths(snapshots, host=host)
+
+    # Only directories can be sharded. File mounts are backed up as a whole.
+    for volume in plan.volumes:
+        if volume.shard_by and _is_file_mount(volume):
+            logger.warning(
+                "Cannot shard %s: not a directory. It is backed up as a whole.",
+                volume.destination,
+            )
+    shardable = [bool(v.shard_by) and not _is_file_mount(v) for v in plan.volumes]
+    sharded = [v for v, ok in zip(plan.volumes, shardable) if ok]
+    unsharded = [v for v, ok in zip(plan.volumes, shardable) if not ok]
+
+    mode = config.volume_backup_mode
+    if mode == "all" and plan.is_partial:
+        # A /volumes snapshot of some services would be the parent of the
+        # next full run and take the place of the full one in retention
+        mode = "service"
+    for volume in sharded:
+        if not os.path.exists(volume.destination):
+            logger.warning("Planned volume %s is not mounted", volume.destination)
+            continue
+        volume_shards = shard_jobs(
+            config,
+            volume,
+            _service_name(plan, volume),
+            fingerprints=fingerprints,
+            snapshots=snapshots,
+            host=host,
+            monitor=monitor,
+        )
+        for job in volume_shards:
+            job.stops = stops_for([volume])
+        jobs += volume_shards
+
+    def grouped_jobs(volumes: List[VolumeTarget], mode: str) -> List[VolumeJob]:
+        """Group the mounted paths per service or per mount"""
+        groups = {}
+        for volume in volumes:
+            if not os.path.exists(volume.destination):
+                logger.warning("Planned volume %s is not mounted", volume.destination)
+                continue
+
+            service = _service_name(plan, volume)
+            if mode == "mount":
+                name = volume.destination
+            elif volume.change_detection:
+                # Mounts with another change detection need their own restic run.
+                # Exclude options are set per service so they group by service.
+                name = f"{service} [{', '.join(volume.change_detection)}]"
+            else:
+                name = service
+            groups.setdefault(name, (service, []))[1].append(volume)
+
+        grouped = []
+        for name, (service, volumes) in groups.items():
+            paths = sorted(volume.destination for volume in volumes)
+            grouped.append(
+                VolumeJob(
+                    name,
+                    config.repository,
+                    paths,
+                    service=service,
+                    tags=retention.tags_for(volumes[0].project, volumes[0].service),
+                    parent=parents.get(tuple(paths)),
+                    fingerprint_mode=fingerprint_mode(volumes),
+                    fingerprints=fingerprints,
+                    excludes=_excludes(volumes),
+                    host=host,
+                    change_detection=volumes[0].change_detection,
+                    exclude_larger_than=volumes[0].exclude_larger_than,
+                    exclude_if_present=volumes[0].exclude_if_present,
+                    compression=volumes[0].compression,
+                    throttle=Throttle.from_config(config, volumes[0].throttle),
+                    monitor=monitor,
+                    priority=_highest_priority(volumes),
+                )
+            )
+            grouped[-1].stops = stops_for(volumes)
+        return grouped
+
+    if mode == "all":
+        # Sharded volumes, volumes with their own restic options and
+        # volumes of stopped services are backed up by their own jobs.
+        # The combined job is left out when no volume is left for it.
+        separate = [v for v in unsharded if _needs_own_run(v) or stops_for([v])]
+        rest = [v for v in unsharded if not (_needs_own_run(v) or stops_for([v]))]
+        jobs = grouped_jobs(separate, "service") + jobs
+        if rest:
+            job = VolumeJob(
+                source,
+                config.repository,
+                [source],
+                tags=retention.tags_for(plan.project_name, retention.ALL_SERVICES),
+                parent=parents.get((source,)),
+                excludes=[volume.destination for volume in sharded + separate]
+                + _excludes(rest),
+                fingerprint_mode=fingerprint_mode(rest),
+                fingerprints=fingerprints,
+                host=host,
+                throttle=Throttle.from_config(config),
+                monitor=monitor,
+                priority=_highest_priority(rest),
+            )
+            jobs = [job] + jobs
+    else:
+        jobs = grouped_jobs(unsharded, mode) + jobs
+
+    for job in jobs:
+        for stop in job.stops:
+            stop.jobs += 1
+    return jobs
+
+
+def _is_file_mount(volume: VolumeTarget) -> bool:
+    """bool: Is the mounted volume something else than a directory?"""
+    return os.path.exists(volume.destination) and not os.path.isdir(volume.destination)
+
+
+def _needs_own_run(volume: VolumeTarget) -> bool:
+    """bool: Does the volume use restic options that apply to a whole run?"""
+    return bool(
+        volume.change_detection
+        or volume.exclude_larger_than
+        or volume.exclude_if_present
+        or volume.compression
+        or volume.throttle
+    )
+
+
+def _highest_priority(targets) -> str:
+    """str: The highest priority of the volumes or databases"""
+    priorities = [target.priority or PRIORITY_NORMAL for target in targets]
+    return min(priorities, key=PRIORITIES.index, default=PRIORITY_NORMAL)
+
+
+def _excludes(volumes: List[VolumeTarget]) -> List[str]:
+    """list: The exclude patterns of the volumes without duplicates"""
+    return sorted({pattern for volume in volumes for pattern in volume.excludes})
+
+
+def _service_name(plan: BackupPlan, volume: VolumeTarget) -> str:
+    """Service name prefixed with the project if it is from another project"""
+    return _service_key(plan, volume.project, volume.service)
+
+
+def _service_key(plan: BackupPlan, project: str, service: str) -> str:
+    if project and project != plan.project_name:
+        return f"{project}/{service}"
+    return service
+
+
+def _data_services(plan: BackupPlan, volume: VolumeTarget) -> set:
+    """set: The service owning the volume and the services sharing it"""
+    services = {_service_name(plan, volume)}
+    for name in volume.shared_with:
+        # Services of the owner's project are shared without a project
+        project, _, service = name.rpartition("/")
+        services.add(_service_key(plan, project or volume.project, service))
+    return services
+
+
+def run_job(
+    job: Job, host_budget: budget.HostBudget = None, deadline: float = None
+) -> JobResult:
+    """
+    Run a single job, timing it and turning exceptions into a failure.
+    The time spent waiting for a host budget slot is not part of the duration.
+    Jobs that would end after the ``deadline`` (epoch seconds) are deferred.
+    The services in ``job.stops`` are kept stopped while the job runs.
+    """
+    with budget.slot(host_budget, job.budget_kind, job.name) as waited:
+        if should_defer(job, deadline):
+            for stop in job.stops:
+                stop.done()
+            logger.warning(
+                "Deferring %s job %s: predicted %s would end after the backup window",
+                job.kind,
+                job.name,
+                sizing.format_duration(job.predicted),
+            )
+            return JobResult(
+                name=job.name,
+                kind=job.kind,
+                service=job.service,
+                exit_code=0,
+                duration=0.0,
+                waited=waited,
+                predicted=job.predicted,
+                deferred=True,
+            )
+
+        logger.info("Starting %s job: %s", job.kind, job.name)
+        # Services are stopped once the slot is taken so they are not
+        # down while waiting for other instances
+        with ExitStack() as stack:
+            for stop in job.stops:
+                stack.enter_context(stop.stopped())
+            start = time.monotonic()
+            try:
+                exit_code = job.run()
+            except Exception as ex:
+                logger.error("Exception raised in %s job %s", job.kind, job.name)
+                logger.exception(ex)
+                exit_code = 1
+
+            duration = time.monotonic() - start
+    log_func = logger.info if exit_code == 0 else logger.error
+    log_func(
+        "Finished %s job: %s (exit code %s, %.1fs)",
+        job.kind,
+        job.name,
+        exit_code,
+        duration,
+    )
+    return JobResult(
+        name=job.name,
+        kind=job.kind,
+        service=job.service,
+        exit_code=exit_code,
+        duration=duration,
+        skipped=job.skipped,
+        summary=job.summary,
+        waited=waited,
+        predicted=job.predicted,
+    )
+
+
+def run_jobs(
+    jobs: List[Job],
+    concurrency: int = 1,
+    host_budget: budget.HostBudget = None,
+    deadline: float = None,
+) -> List[JobResult]:
+    """
+    Run jobs with at most ``concurrency`` running at the same time. Jobs
+    also wait for a slot of the ``host_budget`` shared with other instances.
+    """
+    if not jobs:
+        return []
+
+    def _run(job):
+        return run_job(job, host_budget=host_budget, deadline=deadline)
+
+    concurrency = max(1, min(concurrency, len(jobs)))
+    with ThreadPoolExecutor(max_workers=concurrency) as executor:
+        return list(executor.map(_run, jobs))
+
+
+def should_defer(job: Job, deadline: float, now: float = None) -> bool:
+    """
+    bool: Would a low priority job end after the deadline? Other jobs
+    and jobs without a predicted duration always run.
+    """
+    if deadline is None or job.priority != PRIORITY_LOW or job.predicted is None:
+        return False
+    now = time.time() if now is None else now
+    return now + job.predicted > deadline
+
+
+def window_deadline(config, start: datetime = None) -> float:
+    """
+    float: End of the backup window as epoch seconds or None if no window
+    is configured. The window ends at the next ``BACKUP_WINDOW_END`` after
+    the run started.
+    """
+    if not config.backup_window_end:
+        return None
+
+    start = start or datetime.now()
+    try:
+        end = datetime.strptime(config.backup_window_end.strip(), "%H:%M").time()
+    except ValueError:
+        logger.warning("Invalid BACKUP_WINDOW_END: %s", config.backup_window_end)
+        return None
+
+    deadline = datetime.combine(start.date(), end)
+    if deadline <= start:
+        deadline += timedelta(days=1)
+    return deadline.timestamp()
+
+
+def load_durations(config) -> Dict[str, float]:
+    """dict: Moving average duration in seconds per job key"""
+    return state.load(config, DURATIONS_STATE)
+
+
+def record_durations(config, results: List[JobResult]):
+    """Update the duration history with the jobs that ran successfully"""
+
+    def _update(data):
+        for result in results:
+            if not result.ok or result.skipped or result.deferred:
+                continue
+            key = f"{result.kind}:{result.name}"
+            previous = data.get(key)
+            data[key] = (
+                result.duration
+                if previous is None
+                else previous + DURATION_WEIGHT * (result.duration - previous)
+            )
+
+    state.update(config, DURATIONS_STATE, _update)
+
+
+def schedule(
+    jobs: List[Job],
+    durations: Dict[str, float],
+    deferred: List[str] = None,
+    by_priority: bool = False,
+) -> List[Job]:
+    """
+    list: The jobs ordered longest first (LPT) by their historical duration.
+    Jobs without history go first since they could be the longest.
+    Jobs deferred by the last run go before all others, followed by the
+    jobs of stopped services so they are back soon. With ``by_priority``
+    higher priority jobs go before lower ones. The order of jobs that
+    compare equal is kept.
+    """
+    deferred = deferred or []
+    for job in jobs:
+        job.predicted = durations.get(job.key)
+    return sorted(
+        jobs,
+        key=lambda job: (
+            job.key not in deferred,
+            not job.stops,
+            PRIORITIES.index(job.priority) if by_priority else 0,
+            job.predicted is not None,
+            -(job.predicted or 0),
+        ),
+    )
+
+
+def record_deferred(config, jobs: List[Job], results: List[JobResult]):
+    """Remember the deferred jobs so they go first in the next run"""
+    ran = {job.key for job in jobs}
+    deferred = [f"{r.kind}:{r.name}" for r in results if r.deferred]
+
+    def _update(data):
+        keys = [key for key in data.get("jobs", []) if key not in ran]
+        data["jobs"] = keys + deferred
+
+    state.update(config, DEFERRED_STATE, _update)
+
+
+def predict_makespan(jobs: List[Job], concurrency: int) -> float:
+    """
+    float: Predicted wall time of running the jobs in order on
+    ``concurrency`` workers. Jobs without history count with the average
+    of the others. None if no job has history.
+    """
+    known = [job.predicted for job in jobs if job.predicted is not None]
+    if not known:
+        return None
+
+    average = sum(known) / len(known)
+    workers = [0.0] * max(1, min(concurrency, len(jobs)))
+    for job in jobs:
+        # The next job starts on the worker that becomes free first
+        index = workers.index(min(workers))
+        workers[index] += job.predicted if job.predicted is not None else average
+    return max(workers)
+
+
+def run_scheduled(
+    config,
+    jobs: List[Job],
+    concurrency: int = 1,
+    host_budget: budget.HostBudget = None,
+    deadline: float = None,
+) -> List[JobResult]:
+    """
+    Run the jobs longest first, record their durations and compare the
+    predicted with the actual wall time of the run. Jobs that would not
+    end before the ``deadline`` are deferred to the next run.
+    """
+    if not jobs:
+        return []
+
+    jobs = schedule(
+        jobs,
+        load_durations(config),
+        deferred=state.load(config, DEFERRED_STATE).get("jobs", []),
+        by_priority=deadline is not None,
+    )
+    predicted = predict_makespan(jobs, concurrency)
+    start = time.monotonic()
+    results = run_jobs(
+        jobs, concurrency=concurrency, host_budget=host_budget, deadline=deadline
+    )
+    actual = time.monotonic() - start
+    record_durations(config, results)
+    record_deferred(config, jobs, results)
+
+    if predicted is None:
+        logger.info(
+            "Ran %s %s jobs in %s, no duration history yet",
+            len(results),
+            jobs[0].kind,
+            sizing.format_duration(actual),
+        )
+    else:
+        logger.info(
+            "Ran %s %s jobs in %s, predicted %s (%+.0f%%)",
+            len(results),
+            jobs[0].kind,
+            sizing.format_duration(actual),
+            sizing.format_duration(predicted),
+            (actual - predicted) / predicted * 100 if predicted else 0,
+        )
+    return results
+
+
+def log_results(results: List[JobResult]):
+    """Summarize the job results in the log"""
+    if not results:
+        return
+
+    logger.info("%s Job Results %s", "-" * 27, "-" * 27)
+    for result in results:
+        log_func = logger.info if result.ok else logger.error
+        if result.skipped:
+            log_func(" - %s %s: skipped, unchanged", result.kind, result.name)
+            continue
+        if result.deferred:
+            logger.warning(
+                " - %s %s: deferred to the next run", result.kind, result.name
+            )
+            continue
+        log_func(
+            " - %s %s: exit code %s in %.1fs%s%s%s",
+            result.kind,
+            result.name,
+            result.exit_code,
+            result.duration,
+            f" (predicted {result.predicted:.1f}s)"
+            if result.predicted is not None
+            else "",
+            f" after waiting {result.waited:.1f}s" if result.waited else "",
+            f", {format_summary(result.summary)}" if result.summary else "",
+        )
+    logger.info("-" * 67)
+
+
+def log_downtime(stops: List[ServiceStop]):
+    """Report how long each stopped service was down"""
+    stopped = [stop for stop in stops if stop.downtime is not None]
+    if not stopped:
+        return
+
+    logger.info("Downtime of services stopped during backup:")
+    for stop in stopped:
+        logger.info(" - %s: %s", stop.service, sizing.format_duration(stop.downtime))
+
+
+def format_summary(summary: dict) -> str:
+    """str: New data and the compression achieved from a restic summary"""
+    added = summary.get("data_added", 0)
+    packed = summary.get("data_added_packed")
+    text = f"added {sizing.format_bytes(added)}"
+    if packed:
+        text += f", stored {sizing.format_bytes(packed)} ({added / packed:.1f}x)"
+    return text
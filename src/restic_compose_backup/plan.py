@@ -0,0 +1,295 @@
+"""
+Backup plan
+
+The plan is everything the backup process container needs to know to do its
+job: the mounts to back up, the databases to dump and the containers to stop.
+It is resolved once by ``rcb backup`` and handed to the backup process
+container as JSON so the child does not have to repeat container discovery.
+"""
+
+import json
+import logging
+import os
+from dataclasses import asdict, dataclass, field
+from typing import List
+
+from restic_compose_backup import retention, utils
+
+logger = logging.getLogger(__name__)
+
+# Environment variable used to hand the plan to the backup process container
+PLAN_ENV = "BACKUP_PLAN"
+
+
+@dataclass
+class VolumeTarget:
+    """A mount to back up from the backup process container"""
+
+    service: str
+    project: str
+    source: str
+    destination: str
+    # Split the mount into several restic backups: "hash" or "directory"
+    shard_by: str = None
+    shards: int = 0
+    # Fingerprint mode used to skip the mount when unchanged
+    skip_unchanged: str = None
+    # restic change detection options: "ignore-inode", "ignore-ctime", "force"
+    change_detection: List[str] = field(default_factory=list)
+    # restic exclude patterns anchored to the service and per run exclude options
+    excludes: List[str] = field(default_factory=list)
+    exclude_larger_than: str = None
+    exclude_if_present: List[str] = field(default_factory=list)
+    # restic compression level overriding the configured one
+    compression: str = None
+    # Priority and bandwidth overrides, see throttle.Throttle
+    throttle: dict = field(default_factory=dict)
+    # Job priority when the backup window runs out
+    priority: str = None
+    # Other services mounting the same source or a path inside it
+    shared_with: List[str] = field(default_factory=list)
+
+
+@dataclass
+class DatabaseTarget:
+    """A database dump to stream into restic"""
+
+    service: str
+    project: str
+    container_id: str
+    container_type: str
+    destination: str
+    dump_command: List[str]
+    # Environment for the dump exec. Values are the *names* of env vars in the
+    # database container holding the secret so no credentials end up in the plan.
+    environment: dict = field(default_factory=dict)
+    # Command printing the size of the database in bytes
+    size_command: List[str] = field(default_factory=list)
+    # restic compression level overriding the configured one
+    compression: str = None
+    # Priority and bandwidth overrides, see throttle.Throttle
+    throttle: dict = field(default_factory=dict)
+    # Job priority when the backup window runs out
+    priority: str = None
+
+    def resolve_environment(self) -> dict:
+        """dict: The dump exec environment with credential references resolved"""
+        if not self.environment:
+            return {}
+
+        container_env = utils.get_container_env(self.container_id)
+        return {
+            name: container_env.get(reference)
+            for name, reference in self.environment.items()
+        }
+
+
+@dataclass
+class StopTarget:
+    """A container to stop while its volumes are backed up"""
+
+    service: str
+    project: str
+    id: str
+    name: str
+    # Freeze the container with docker pause instead of stopping it
+    pause: bool = False
+
+
+def _covers(parent: str, child: str) -> bool:
+    """bool: Is ``child`` the same path as ``parent`` or inside it?"""
+    parent = parent.rstrip("/")
+    return child == parent or child.startswith(parent + "/")
+
+
+def dedupe_volumes(volumes: List[VolumeTarget]) -> List[VolumeTarget]:
+    """
+    Back up every host path once. When several mounts have the same source
+    or a source inside another mount, only the outermost mount is kept.
+    For identical sources the first volume in the given order owns it.
+    The services of the dropped mounts are recorded in ``shared_with``.
+    """
+    owners = []
+    # Outer paths first. The sort is stable so the given order breaks ties.
+    for volume in sorted(volumes, key=lambda v: v.source.rstrip("/").count("/")):
+        owner = next((o for o in owners if _covers(o.source, volume.source)), None)
+        if owner is None:
+            owners.append(volume)
+            continue
+
+        name = volume.service
+        if volume.project != owner.project:
+            name = f"{volume.project}/{volume.service}"
+        if name != owner.service and name not in owner.shared_with:
+            owner.shared_with.append(name)
+        logger.debug(
+            "Source %s of service %s is backed up by service %s at %s",
+            volume.source,
+            name,
+            owner.service,
+            owner.destination,
+        )
+
+    # Keep the original order
+    kept = {id(volume) for volume in owners}
+    return [volume for volume in volumes if id(volume) in kept]
+
+
+@dataclass
+class BackupPlan:
+    """The resolved work for a single backup run"""
+
+    project_name: str
+    volumes: List[VolumeTarget] = field(default_factory=list)
+    databases: List[DatabaseTarget] = field(default_factory=list)
+    stop: List[StopTarget] = field(default_factory=list)
+    # Keep policy overrides by "<project>/<service>"
+    retention: dict = field(default_factory=dict)
+    # Services of a partial run or None if all services are included
+    services: List[str] = None
+
+    @classmethod
+    def from_containers(
+        cls, containers, source_prefix="/volumes", services: List[str] = None
+    ) -> "BackupPlan":
+        """
+        Resolve the plan from the running containers.
+        If ``services`` is given only those services are included.
+        """
+        plan = cls(project_name=containers.project_name)
+        volumes = []
+
+        def selected(container):
+            return services is None or container.service_name in services
+
+        if not all(map(selected, containers.containers_for_backup())):
+            plan.services = sorted(services)
+
+        # Sorted so the owner of a shared source is the same on every run
+        backup_containers = sorted(
+            filter(selected, containers.containers_for_backup()),
+            key=lambda c: (c.project_name, c.service_name, c.name),
+        )
+        for container in backup_containers:
+            if container.retention:
+                key = retention.retention_key(
+                    container.project_name, container.service_name
+                )
+                plan.retention[key] = container.retention
+
+            if container.volume_backup_enabled:
+                for mount in container.filter_mounts():
+                    volumes.append(
+                        VolumeTarget(
+                            service=container.service_name,
+                            project=container.project_name,
+                            source=mount.source,
+                            destination=container.get_volume_backup_destination(
+                                mount, source_prefix
+                            ),
+                            shard_by=container.volume_sharding[0],
+                            shards=container.volume_sharding[1],
+                            skip_unchanged=container.volume_skip_unchanged,
+                            change_detection=container.change_detection(mount),
+                            excludes=container.volume_excludes(source_prefix),
+                            exclude_larger_than=container.volume_exclude_larger_than,
+                            exclude_if_present=container.volume_exclude_if_present,
+                            compression=container.compression,
+                            throttle=container.throttle,
+                            priority=container.priority,
+                        )
+                    )
+
+            if container.database_backup_enabled:
+                instance = container.instance
+                plan.databases.append(
+                    DatabaseTarget(
+                        service=instance.service_name,
+                        project=instance.project_name,
+                        container_id=instance.id,
+                        container_type=instance.container_type,
+                        destination=str(instance.backup_destination_path()),
+                        dump_command=instance.dump_command(),
+                        environment=instance.credential_env_references(),
+                        size_command=instance.size_command(),
+                        compression=instance.compression,
+                        throttle=instance.throttle,
+                        priority=instance.priority,
+                    )
+                )
+
+        plan.volumes = dedupe_volumes(volumes)
+        plan.stop = [
+            StopTarget(
+                service=container.service_name,
+                project=container.project_name,
+                id=container.id,
+                name=container.name,
+            )
+            for container in filter(selected, containers.stop_during_backup_containers)
+        ]
+        plan.stop += [
+            StopTarget(
+                service=container.service_name,
+                project=container.project_name,
+                id=container.id,
+                name=container.name,
+                pause=True,
+            )
+            for container in filter(selected, containers.pause_during_backup_containers)
+        ]
+        return plan
+
+    @classmethod
+    def from_dict(cls, data: dict) -> "BackupPlan":
+        return cls(
+            project_name=data["project_name"],
+            volumes=[VolumeTarget(**v) for v in data.get("volumes", [])],
+            databases=[DatabaseTarget(**d) for d in data.get("databases", [])],
+            stop=[StopTarget(**s) for s in data.get("stop", [])],
+            retention=data.get("retention", {}),
+            services=data.get("services"),
+        )
+
+    @classmethod
+    def from_json(cls, data: str) -> "BackupPlan":
+        return cls.from_dict(json.loads(data))
+
+    @classmethod
+    def from_env(cls) -> "BackupPlan":
+        """BackupPlan: The plan handed over by the parent or None if not present"""
+        data = os.environ.get(PLAN_ENV)
+        if not data:
+            return None
+
+        return cls.from_json(data)
+
+    def to_dict(self) -> dict:
+        return asdict(self)
+
+    def to_json(self, indent=None) -> str:
+        return json.dumps(self.to_dict(), indent=indent)
+
+    @property
+    def is_empty(self) -> bool:
+        """bool: Is there nothing to back up?"""
+        return len(self.volumes) == 0 and len(self.databases) == 0
+
+    @property
+    def is_partial(self) -> bool:
+        """bool: Does the plan only include some of the services?"""
+        return self.services is not None
+
+    @property
+    def projects(self) -> List[str]:
+        """list: The compose projects the snapshots of the plan are tagged with"""
+        targets = self.volumes + self.databases + self.stop
+        projects = {self.project_name} | {target.project for target in targets}
+        return sorted(project for project in projects if project)
+
+    def mounts(self, mode="ro") -> dict:
+        """dict: Volumes to map into the backup process container"""
+        return {
+            volume.source: {"bind": volume.destination, "mode": mode}
+            for volume in self.volumes
+        }
@@ -0,0 +1,201 @@
+"""
+Adaptive throttling driven by host pressure stall information (PSI)
+
+While the backup process runs a monitor samples the ``some avg10`` value
+of ``/proc/pressure/{cpu,io,memory}``. PSI is not namespaced so the values
+describe the whole host. When pressure is above ``PRESSURE_TARGET``
+
+- restic runs started from then on get a lower upload limit. Each sample
+  above target halves it down to 1/16 of the base limit.
+- the relay of database dumps into restic is paused when pressure is
+  twice the target. The dump blocks on its full pipe until pressure is
+  back under target or ``PRESSURE_MAX_PAUSE`` seconds have passed.
+
+Limits are relaxed one step per sample under half the target. Every
+decision is logged and the decisions of the last run are kept in the
+``pressure`` state for tuning.
+"""
+
+import asyncio
+import dataclasses
+import logging
+import threading
+import time
+from datetime import datetime, timezone
+from typing import Dict
+
+from restic_compose_backup import state
+from restic_compose_backup.throttle import Throttle
+
+logger = logging.getLogger(__name__)
+
+PRESSURE_ROOT = "/proc/pressure"
+RESOURCES = ["cpu", "io", "memory"]
+
+MAX_LEVEL = 4
+PAUSE_RATIO = 2.0
+RELAX_RATIO = 0.5
+
+PRESSURE_STATE = "pressure"
+MAX_DECISIONS = 500
+
+
+def read_pressure(resource: str, root: str = PRESSURE_ROOT) -> float:
+    """float: The ``some avg10`` percentage of a resource or None if unavailable"""
+    try:
+        with open(f"{root}/{resource}") as fd:
+            for line in fd:
+                kind, *fields = line.split()
+                if kind != "some":
+                    continue
+                values = dict(field.split("=", 1) for field in fields)
+                return float(values["avg10"])
+    except (OSError, KeyError, ValueError):
+        pass
+    return None
+
+
+def sample(root: str = PRESSURE_ROOT) -> Dict[str, float]:
+    """dict: Current pressure of the available resources"""
+    values = {resource: read_pressure(resource, root) for resource in RESOURCES}
+    return {k: v for k, v in values.items() if v is not None}
+
+
+def parse_target(value: str) -> Dict[str, float]:
+    """
+    dict: Target percentage per resource from a single number for all
+    resources or a list like ``io=20,cpu=60``
+    """
+    value = str(value or "").strip()
+    if not value:
+        return {}
+    if "=" not in value:
+        return {resource: float(value) for resource in RESOURCES}
+
+    targets = {}
+    for item in value.split(","):
+        resource, _, percent = item.partition("=")
+        resource = resource.strip().lower()
+        if resource not in RESOURCES:
+            raise ValueError(f"Unknown pressure resource: {resource}")
+        targets[resource] = float(percent)
+    return targets
+
+
+class PressureMonitor(threading.Thread):
+    """Samples host pressure and decides how hard backups may run"""
+
+    def __init__(self, config, root: str = PRESSURE_ROOT):
+        super().__init__(name="pressure-monitor", daemon=True)
+        self.config = config
+        self.root = root
+        self.targets = parse_target(config.pressure_target)
+        self.interval = float(config.pressure_interval)
+        self.max_pause = float(config.pressure_max_pause)
+        self.base_upload = config.pressure_limit_upload
+        self.level = 0
+        self.paused = False
+        self.paused_at = None
+        # A pause that ran into max_pause is not repeated until pressure drops
+        self.hold_off = False
+        self.decisions = []
+        self._stop_event = threading.Event()
+        self._lock = threading.Lock()
+
+    @property
+    def available(self) -> bool:
+        """bool: Can pressure be read on this host?"""
+        return bool(sample(self.root))
+
+    def run(self):
+        while not self._stop_event.wait(self.interval):
+            self.update(sample(self.root))
+
+    def stop(self):
+        """Stop sampling, resume paused relays and save the decisions"""
+        self._stop_event.set()
+        if self.is_alive():
+            self.join()
+        with self._lock:
+            if self.paused:
+                self._decide({}, "resume relay (backup finished)")
+                self.paused = False
+        state.save(self.config, PRESSURE_STATE, {"decisions": self.decisions})
+
+    def ratio(self, values: Dict[str, float]) -> float:
+        """float: Highest pressure relative to its target"""
+        ratios = [
+            values[resource] / target
+            for resource, target in self.targets.items()
+            if resource in values and target > 0
+        ]
+        return max(ratios, default=0.0)
+
+    def update(self, values: Dict[str, float]):
+        """Adjust the level and the relay pause to a pressure sample"""
+        ratio = self.ratio(values)
+        with self._lock:
+            if self.paused and ratio <= 1:
+                self.paused = False
+                self._decide(values, "resume relay")
+            elif self.paused and time.monotonic() - self.paused_at > self.max_pause:
+                self.paused = False
+                self.hold_off = True
+                self._decide(values, "resume relay (max pause reached)")
+            elif not self.paused and not self.hold_off and ratio >= PAUSE_RATIO:
+                self.paused = True
+                self.paused_at = time.monotonic()
+                self._decide(values, "pause relay")
+
+            if ratio > 1 and self.level < MAX_LEVEL:
+                self.level += 1
+                self._decide(values, f"tighten upload limit to level {self.level}")
+            elif ratio < RELAX_RATIO and self.level > 0:
+                self.level -= 1
+                self._decide(values, f"relax upload limit to level {self.level}")
+
+            if ratio <= 1:
+                self.hold_off = False
+
+    def _decide(self, values: Dict[str, float], action: str):
+        timestamp = datetime.now(timezone.utc).isoformat(timespec="seconds")
+        pressure = ", ".join(f"{k}={v:.1f}" for k, v in sorted(values.items()))
+        logger.info("Pressure [%s] %s: %s", timestamp, pressure or "-", action)
+        self.decisions.append({"time": timestamp, "pressure": values, "action": action})
+        del self.decisions[:-MAX_DECISIONS]
+
+    def adjust(self, throttle: Throttle = None) -> Throttle:
+        """Throttle: The limits for a restic run starting now"""
+        throttle = throttle or Throttle()
+        base = throttle.limit_upload or self.base_upload
+        if not self.level or not base:
+            return throttle
+        limit = max(1, int(base) >> self.level)
+        return dataclasses.replace(throttle, limit_upload=str(limit))
+
+    async def wait_resumed(self):
+        """Wait while the relay is paused"""
+        while self.paused:
+            await asyncio.sleep(min(self.interval, 1.0))
+
+
+def start_monitor(config) -> PressureMonitor:
+    """PressureMonitor: A started monitor or None if disabled or unavailable"""
+    if not config.pressure_target:
+        return None
+
+    try:
+        monitor = PressureMonitor(config)
+    except ValueError as ex:
+        logger.warning("Invalid pressure setting. Adaptive throttling is off: %s", ex)
+        return None
+    if not monitor.available:
+        logger.warning("Host pressure is not available. Adaptive throttling is off.")
+        return None
+
+    logger.info(
+        "Adaptive throttling with pressure targets %s",
+        ", ".join(f"{k}={v:g}%" for k, v in monitor.targets.items()),
+    )
+    monitor.start()
+    return monitor
@@ -2,13 +2,24 @@
 Restic commands
 """
 
+import asyncio
+import json
 import logging
+import os
+import tempfile
+from contextlib import contextmanager
 from typing import List, Tuple, Union
-from subprocess import Popen, PIPE
-from restic_compose_backup import commands, utils
+from subprocess import PIPE
+from restic_compose_backup import commands, sizing, utils
+from restic_compose_backup.async_docker import AsyncDockerClient
+from restic_compose_backup.config import config
+from restic_compose_backup.throttle import Throttle
 
 logger = logging.getLogger(__name__)
 
+# Backends taking the "-o <backend>.connections" option
+REMOTE_BACKENDS = ["s3", "b2", "azure", "gs", "swift", "rest", "rclone", "sftp"]
+
 
 def init_repo(repository: str):
     """
@@ -25,17 +36,135 @@ def init_repo(repository: str):
     )
 
 
-def backup_files(repository: str, source="/volumes"):
-    return commands.run(
-        restic(
-            repository,
-            [
-                "--verbose",
-                "backup",
-                source,
-            ],
+def backup_files(
+    repository: str,
+    source: Union[str, List[str]] = "/volumes",
+    tags: List[str] = None,
+    parent: str = None,
+    excludes: List[str] = None,
+    host: str = None,
+    change_detection: List[str] = None,
+    exclude_larger_than: str = None,
+    exclude_if_present: List[str] = None,
+    compression: str = None,
+    summary: dict = None,
+    throttle: Throttle = None,
+):
+    """
+    Back up one or more paths in a single snapshot. ``change_detection``
+    takes the names of restic's ``--ignore-inode``, ``--ignore-ctime`` and
+    ``--force`` options without the dashes. ``compression`` overrides the
+    configured compression level. The restic summary of the run is added
+    to ``summary`` if given. ``throttle`` sets the priority and bandwidth.
+    """
+    throttle = throttle or Throttle()
+    sources = [source] if isinstance(source, str) else list(source)
+    args = ["backup", "--json", "--quiet"] + backup_options(config)
+    if host:
+        args += ["--host", host]
+    for option in change_detection or []:
+        args.append(f"--{option}")
+    for tag in tags or []:
+        args += ["--tag", tag]
+    if parent:
+        args += ["--parent", parent]
+    for pattern in excludes or []:
+        args += ["--exclude", pattern]
+    if exclude_larger_than:
+        args += ["--exclude-larger-than", exclude_larger_than]
+    for name in exclude_if_present or []:
+        args += ["--exclude-if-present", name]
+    args += throttle.restic_args()
+
+    with source_args(sources) as paths:
+        exit_code, stdout, stderr = commands.run_capture(
+            throttle.wrap(
+                restic(
+                    repository,
+                    args + paths,
+                    options=global_options(config, repository, compression),
+                )
+            )
         )
-    )
+    if exit_code == 0:
+        commands.log_std("stdout", text_output(stdout), logging.INFO)
+    else:
+        commands.log_std("stdout", stdout, logging.ERROR)
+    commands.log_std("stderr", stderr, logging.ERROR)
+    if summary is not None:
+        summary.update(parse_summary(stdout))
+    return exit_code
+
+
+@contextmanager
+def source_args(sources: List[str]):
+    """
+    Arguments passing the paths to back up. Several paths are passed in a
+    file so long lists such as the entries of a shard never exceed the
+    argument size limit.
+    """
+    if len(sources) == 1:
+        yield sources
+        return
+
+    with tempfile.NamedTemporaryFile(prefix="restic-paths-") as fd:
+        fd.write(b"".join(os.fsencode(path) + b"\n" for path in sources))
+        fd.flush()
+        yield ["--files-from-verbatim", fd.name]
+
+
+def text_output(stdout: bytes) -> str:
+    """
+    str: The output of ``restic backup --json`` as restic prints it in text
+    mode. The summary is written out. Backups run with ``--quiet`` so
+    restic does not print progress messages, which are dropped as well.
+    """
+    lines = []
+    for line in stdout.decode(errors="replace").splitlines():
+        try:
+            message = json.loads(line)
+        except ValueError:
+            lines.append(line)
+            continue
+        if not isinstance(message, dict) or message.get("message_type") != "summary":
+            continue
+
+        lines += [
+            "Files: {} new, {} changed, {} unmodified".format(
+                message.get("files_new", 0),
+                message.get("files_changed", 0),
+                message.get("files_unmodified", 0),
+            ),
+            "Dirs: {} new, {} changed, {} unmodified".format(
+                message.get("dirs_new", 0),
+                message.get("dirs_changed", 0),
+                message.get("dirs_unmodified", 0),
+            ),
+            "Added to the repository: {} ({} stored)".format(
+                sizing.format_bytes(message.get("data_added", 0)),
+                sizing.format_bytes(message.get("data_added_packed", 0)),
+            ),
+            "processed {} files, {} in {}".format(
+                message.get("total_files_processed", 0),
+                sizing.format_bytes(message.get("total_bytes_processed", 0)),
+                sizing.format_duration(message.get("total_duration")),
+            ),
+        ]
+        if message.get("snapshot_id"):
+            lines.append(f"snapshot {message['snapshot_id'][:8]} saved")
+    return "\n".join(lines)
+
+
+def parse_summary(stdout: bytes) -> dict:
+    """dict: The summary message of ``restic backup --json`` or empty if missing"""
+    for line in reversed(stdout.decode(errors="replace").splitlines()):
+        try:
+            message = json.loads(line)
+        except ValueError:
+            continue
+        if isinstance(message, dict) and message.get("message_type") == "summary":
+            return message
+    return {}
 
 
 def backup_from_stdin(
@@ -44,53 +173,134 @@ def backup_from_stdin(
     container_id: str,
     source_command: List[str],
     environment: Union[dict, list] = None,
+    host: str = None,
+    tags: List[str] = None,
+    compression: str = None,
+    summary: dict = None,
+    throttle: Throttle = None,
+    monitor=None,
 ):
     """
     Backs up from stdin running the source_command passed in within the given container.
     It will appear in restic with the filename (including path) passed in.
+    The relay is paused while the pressure ``monitor`` asks for it.
     """
-    dest_command = restic(
-        repository,
-        [
-            "backup",
-            "--stdin",
-            "--stdin-filename",
+    return asyncio.run(
+        backup_from_stdin_async(
+            repository,
             filename,
-        ],
+            container_id,
+            source_command,
+            environment=environment,
+            host=host,
+            tags=tags,
+            compression=compression,
+            summary=summary,
+            throttle=throttle,
+            monitor=monitor,
+        )
     )
 
-    client = utils.docker_client()
+
+async def backup_from_stdin_async(
+    repository: str,
+    filename: str,
+    container_id: str,
+    source_command: List[str],
+    environment: Union[dict, list] = None,
+    client: AsyncDockerClient = None,
+    host: str = None,
+    tags: List[str] = None,
+    compression: str = None,
+    summary: dict = None,
+    throttle: Throttle = None,
+    monitor=None,
+):
+    """
+    Coroutine version of :func:`backup_from_stdin`. Several relays can run
+    concurrently in the same event loop, optionally sharing a client.
+    """
+    if client is None:
+        async with AsyncDockerClient.from_env() as client:
+            return await backup_from_stdin_async(
+                repository,
+                filename,
+                container_id,
+                source_command,
+                environment=environment,
+                client=client,
+                host=host,
+                tags=tags,
+                compression=compression,
+                summary=summary,
+                throttle=throttle,
+                monitor=monitor,
+            )
+
+    throttle = throttle or Throttle()
+    if monitor is not None:
+        throttle = monitor.adjust(throttle)
+    args = ["backup", "--json", "--quiet", "--stdin", "--stdin-filename", filename]
+    if host:
+        args += ["--host", host]
+    for tag in tags or []:
+        args += ["--tag", tag]
+    args += throttle.restic_args()
+    dest_command = throttle.wrap(
+        restic(
+            repository, args, options=global_options(config, repository, compression)
+        )
+    )
+    exec_command = throttle.wrap(source_command)
 
     logger.debug(
-        f"docker exec inside container {container_id} command: {' '.join(source_command)}"
+        f"docker exec inside container {container_id} command: {' '.join(exec_command)}"
     )
 
-    # Create and start  source command inside the given container
-    handle = client.api.exec_create(
-        container_id, source_command, environment=environment
+    # Create the source command inside the given container
+    exec_id = await client.exec_create(
+        container_id, exec_command, environment=environment
     )
-    exec_id = handle.get("Id")
-    stream = client.api.exec_start(exec_id, stream=True, demux=True)
     source_stderr = ""
 
     # Create the restic process to receive the output of the source command
-    dest_process = Popen(
-        dest_command, stdin=PIPE, stdout=PIPE, stderr=PIPE, bufsize=65536
+    dest_process = await asyncio.create_subprocess_exec(
+        *dest_command,
+        stdin=PIPE,
+        stdout=PIPE,
+        stderr=PIPE,
     )
+    # Drain restic output while relaying so neither side can block the other
+    dest_output = asyncio.gather(dest_process.stdout.read(), dest_process.stderr.read())
 
     # Send the output of the source command over to restic in the chunks received
-    for stdout_chunk, stderr_chunk in stream:
-        if stdout_chunk:
-            dest_process.stdin.write(stdout_chunk)
-        if stderr_chunk:
-            source_stderr += stderr_chunk.decode()
+    try:
+        async for stdout_chunk, stderr_chunk in client.exec_start(exec_id):
+            if monitor is not None:
+                await monitor.wait_resumed()
+            if stdout_chunk:
+                dest_process.stdin.write(stdout_chunk)
+                await dest_process.stdin.drain()
+            if stderr_chunk:
+                source_stderr += stderr_chunk.decode()
+    except BaseException:
+        # Killed before stdin is closed so a partial dump is never saved
+        if dest_process.returncode is None:
+            dest_process.kill()
+        dest_process.stdin.close()
+        await dest_output
+        await dest_process.wait()
+        raise
+    dest_process.stdin.close()
 
     # Wait for restic to finish
-    stdout, stderr = dest_process.communicate()
+    stdout, stderr = await dest_output
+    dest_exit = await dest_process.wait()
+    if summary is not None:
+        summary.update(parse_summary(stdout))
 
     # Ensure both processes exited with code 0
-    source_exit = client.api.exec_inspect(exec_id).get("ExitCode")
-    dest_exit = dest_process.poll()
+    source_exit = (await client.exec_inspect(exec_id)).get("ExitCode")
     exit_code = source_exit or dest_exit
 
     if stdout:
@@ -116,6 +326,54 @@ def snapshots(repository: str, last=True) -> Tuple[str, str]:
     return commands.run_capture_std(restic(repository, args))
 
 
+def snapshots_json(repository: str, tags: List[str] = None) -> List[dict]:
+    """
+    List snapshots as parsed json. Snapshots having any of the given tags
+    are returned. An empty list is returned if the listing fails.
+    """
+    args = ["snapshots", "--json"]
+    for tag in tags or []:
+        args += ["--tag", tag]
+
+    stdout, stderr = commands.run_capture_std(restic(repository, args))
+    try:
+        return json.loads(stdout) or []
+    except ValueError:
+        commands.log_std("stderr (restic)", stderr, logging.ERROR)
+        return []
+
+
+def latest_by_tag(snapshots: List[dict], tags: List[str]) -> dict:
+    """dict: Map each of the given tags to the id of its latest snapshot"""
+    latest = {}
+    # restic lists snapshots oldest first
+    for snapshot in snapshots:
+        for tag in snapshot.get("tags") or []:
+            if tag in tags:
+                latest[tag] = snapshot["id"]
+
+    return latest
+
+
+def latest_by_paths(snapshots: List[dict], host: str = None) -> dict:
+    """
+    dict: Map each set of backed up paths (a sorted tuple) to the id of its
+    latest snapshot. Snapshots made by ``host`` are preferred. Snapshots of
+    other hosts are only used for paths the host has not backed up yet,
+    for example right after the host name was pinned.
+    """
+    own, other = {}, {}
+    # restic lists snapshots oldest first
+    for snapshot in snapshots:
+        key = tuple(sorted(snapshot.get("paths") or []))
+        if host is None or snapshot.get("hostname") == host:
+            own[key] = snapshot["id"]
+        else:
+            other[key] = snapshot["id"]
+
+    return {**other, **own}
+
+
 def is_initialized(repository: str) -> bool:
     """
     Checks if a repository is initialized with restic cat config.
@@ -131,25 +389,35 @@ def is_initialized(repository: str) -> bool:
         exit(1)
 
 
-def forget(repository: str, daily: str, weekly: str, monthly: str, yearly: str):
-    return commands.run(
-        restic(
-            repository,
-            [
-                "forget",
-                "--group-by",
-                "paths",
-                "--keep-daily",
-                daily,
-                "--keep-weekly",
-                weekly,
-                "--keep-monthly",
-                monthly,
-                "--keep-yearly",
-                yearly,
-            ],
-        )
-    )
+def forget(
+    repository: str,
+    daily: str,
+    weekly: str,
+    monthly: str,
+    yearly: str,
+    tags: str = None,
+    group_by: str = "paths",
+):
+    """
+    Forget outdated snapshots. ``tags`` limits forget to snapshots with all
+    the comma separated tags. An empty string matches untagged snapshots.
+    """
+    args = [
+        "forget",
+        "--group-by",
+        group_by,
+        "--keep-daily",
+        daily,
+        "--keep-weekly",
+        weekly,
+        "--keep-monthly",
+        monthly,
+        "--keep-yearly",
+        yearly,
+    ]
+    if tags is not None:
+        args += ["--tag", tags]
+    return commands.run(restic(repository, args))
 
 
 def prune(repository: str):
@@ -159,6 +427,7 @@ def prune(repository: str):
             [
                 "prune",
             ],
+            options=global_options(config, repository),
         )
     )
 
@@ -170,10 +439,59 @@ def check(repository: str, with_cache: bool = False):
     return commands.run(restic(repository, check_args))
 
 
-def restic(repository: str, args: List[str]):
-    """Generate restic command"""
-    return [
-        "restic",
-        "-r",
-        repository,
-    ] + args
+def backend(repository: str) -> str:
+    """str: The restic backend of a repository. Plain paths are ``local``."""
+    scheme = repository.split(":", 1)[0] if ":" in repository else ""
+    return scheme if scheme in REMOTE_BACKENDS + ["local"] else "local"
+
+
+def global_options(config, repository: str, compression: str = None) -> List[str]:
+    """
+    list: Performance options for the commands writing to the repository,
+    backup and prune. ``compression`` overrides the configured compression
+    level.
+    """
+    name = backend(repository)
+    options = []
+
+    connections = config.restic_connections
+    if not connections and name in REMOTE_BACKENDS:
+        # Remote backends are latency bound and need more parallel requests
+        connections = str(min(32, max(8, 2 * (os.cpu_count() or 1))))
+    if connections:
+        options += ["-o", f"{name}.connections={connections}"]
+
+    # Left to restic unless configured so existing repositories keep theirs
+    pack_size = config.restic_pack_size
+    if pack_size:
+        options += ["--pack-size", pack_size]
+
+    compression = compression or config.restic_compression
+    if compression:
+        options += ["--compression", compression]
+
+    return options
+
+
+def backup_options(config) -> List[str]:
+    """list: Performance options for file backups"""
+    read_concurrency = config.restic_read_concurrency or str(
+        max(2, min(8, os.cpu_count() or 1))
+    )
+    options = ["--read-concurrency", read_concurrency]
+    if utils.is_true(config.restic_no_scan):
+        options.append("--no-scan")
+    return options
+
+
+def restic(repository: str, args: List[str], options: List[str] = None):
+    """Generate restic command. ``options`` go before the command arguments."""
+    return (
+        [
+            "restic",
+            "-r",
+            repository,
+        ]
+        + (options or [])
+        + args
+    )
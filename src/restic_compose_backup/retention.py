@@ -0,0 +1,133 @@
+"""
+Snapshot tags and retention
+
+Every snapshot is tagged with ``project:<name>`` and ``service:<name>``.
+The combined ``/volumes`` snapshot uses the service tag ``service:_all``.
+Forget runs once per project and service tag group so each service can
+have its own keep policy from the ``stack-back.keep-*`` labels. Shard
+snapshots are forgotten per ``shard:`` tag because their paths change.
+Groups of other projects in a shared repository are left alone.
+"""
+
+import logging
+from typing import List
+
+from restic_compose_backup import restic
+
+logger = logging.getLogger(__name__)
+
+PROJECT_TAG = "project:"
+SERVICE_TAG = "service:"
+SHARD_TAG = "shard:"
+
+# Service tag of the snapshot holding the volumes of all services
+ALL_SERVICES = "_all"
+
+KEEP_PERIODS = ["daily", "weekly", "monthly", "yearly"]
+
+
+def tags_for(project: str, service: str) -> List[str]:
+    """list: The tags of a snapshot made for a service"""
+    tags = []
+    if project:
+        tags.append(f"{PROJECT_TAG}{project}")
+    if service:
+        tags.append(f"{SERVICE_TAG}{service}")
+    return tags
+
+
+def retention_key(project: str, service: str) -> str:
+    """str: Key of a service in the plan retention"""
+    return f"{project}/{service}"
+
+
+def forget_groups(snapshots: List[dict], projects: List[str] = None) -> List[str]:
+    """
+    list: restic ``--tag`` filters covering the snapshots. Snapshots with a
+    service tag are grouped by project and service and shard snapshots by
+    their shard tag as well. Other snapshots are grouped by their full tag
+    list. An empty filter matches untagged snapshots. If ``projects`` is
+    given, snapshots tagged with another project are left out.
+    """
+    groups = []
+    for snapshot in snapshots:
+        tags = snapshot.get("tags") or []
+        project = [t for t in tags if t.startswith(PROJECT_TAG)]
+        service = [t for t in tags if t.startswith(SERVICE_TAG)]
+        shard = [t for t in tags if t.startswith(SHARD_TAG)]
+        if projects is not None and project:
+            if project[0][len(PROJECT_TAG) :] not in projects:
+                continue
+        if service:
+            group = ",".join(project[:1] + service[:1] + shard[:1])
+        else:
+            group = ",".join(sorted(tags))
+        if group not in groups:
+            groups.append(group)
+
+    return groups
+
+
+def group_by(group: str) -> str:
+    """
+    str: restic ``--group-by`` of a tag group. The paths of a shard change
+    when entries are added so its snapshots are grouped by the shard tag.
+    """
+    if any(tag.startswith(SHARD_TAG) for tag in group.split(",")):
+        return "host,tags"
+    return "paths"
+
+
+def _parse_group(group: str):
+    """tuple: The project and service of a tag group or None"""
+    project, service = "", None
+    for tag in group.split(","):
+        if tag.startswith(PROJECT_TAG):
+            project = tag[len(PROJECT_TAG) :]
+        elif tag.startswith(SERVICE_TAG):
+            service = tag[len(SERVICE_TAG) :]
+    return project, service
+
+
+def policy(config, retention: dict, group: str) -> dict:
+    """dict: The keep policy of a tag group. Labels override the config."""
+    keep = {
+        "daily": config.keep_daily,
+        "weekly": config.keep_weekly,
+        "monthly": config.keep_monthly,
+        "yearly": config.keep_yearly,
+    }
+    project, service = _parse_group(group)
+    if service:
+        keep.update(retention.get(retention_key(project, service), {}))
+    return keep
+
+
+def forget(config, retention: dict = None, projects: List[str] = None) -> int:
+    """
+    Forget outdated snapshots per tag group of the given projects and of
+    untagged snapshots. Returns the first non-zero exit code or 0 if all
+    groups succeeded.
+    """
+    retention = retention or {}
+    result = 0
+    snapshots = restic.snapshots_json(config.repository)
+    for group in forget_groups(snapshots, projects):
+        keep = policy(config, retention, group)
+        logger.info(
+            "Forget snapshots tagged '%s' keeping %s",
+            group,
+            ", ".join(f"{k}={v}" for k, v in keep.items()),
+        )
+        exit_code = restic.forget(
+            config.repository,
+            keep["daily"],
+            keep["weekly"],
+            keep["monthly"],
+            keep["yearly"],
+            tags=group,
+            group_by=group_by(group),
+        )
+        result = result or exit_code
+
+    return result
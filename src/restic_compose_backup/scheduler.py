@@ -0,0 +1,225 @@
+"""
+Built-in scheduler
+
+An alternative to crond started with ``rcb scheduler``. It fires the
+backups and maintenance of the cron schedules itself, which allows
+
+- handling ticks while the previous run of the same kind is still going.
+  With ``SCHEDULER_OVERLAP=skip`` the tick is dropped. With ``queue`` it
+  runs once the previous run is done. Queued ticks are merged.
+- catching up after downtime. The last minute handled is kept in the
+  ``scheduler`` state. On start every schedule that fired in between runs
+  once instead of waiting for its next time.
+
+Jobs due in the same minute are merged into one run per group so each
+service is backed up once even if several of its schedules fire. Runs
+start ``delay`` seconds after the schedule fired (``SCHEDULE_SPREAD``).
+"""
+
+import logging
+import threading
+import time
+from dataclasses import dataclass
+from datetime import datetime, timedelta
+from typing import Callable, Dict, List
+
+from restic_compose_backup import cron, state, utils
+
+logger = logging.getLogger(__name__)
+
+GROUP_BACKUP = "backup"
+GROUP_MAINTENANCE = "maintenance"
+
+OVERLAP_SKIP = "skip"
+OVERLAP_QUEUE = "queue"
+OVERLAP_MODES = [OVERLAP_SKIP, OVERLAP_QUEUE]
+
+SCHEDULER_STATE = "scheduler"
+# Longest sleep so schedule label changes and clock jumps are noticed
+MAX_SLEEP = 60
+
+
+@dataclass
+class ScheduledJob:
+    """A cron schedule firing a run of a group"""
+
+    name: str
+    schedule: cron.Schedule
+    group: str = GROUP_BACKUP
+    # Services to back up or None for all
+    services: List[str] = None
+
+
+def union(first: List[str], second: List[str]) -> List[str]:
+    """list: Services in either list. None stands for all services."""
+    if first is None or second is None:
+        return None
+    return first + [service for service in second if service not in first]
+
+
+def merge_services(jobs: List[ScheduledJob]) -> List[str]:
+    """list: The services of all jobs or None if any job covers all services"""
+    merged = []
+    for job in jobs:
+        merged = union(merged, job.services)
+    return merged
+
+
+class Scheduler:
+    """Fires scheduled jobs with overlap handling and catch-up"""
+
+    def __init__(
+        self,
+        config,
+        load_jobs: Callable[[], List[ScheduledJob]],
+        run_group: Callable[[str, List[str]], None],
+        overlap: str = OVERLAP_SKIP,
+        clock: Callable[[], datetime] = datetime.now,
+        delay: int = 0,
+    ):
+        self.config = config
+        self.load_jobs = load_jobs
+        self.run_group = run_group
+        self.overlap = overlap
+        self.clock = clock
+        self.delay = delay
+        self.running: Dict[str, threading.Thread] = {}
+        # Services of queued runs per group. None means all services.
+        self.pending: Dict[str, List[str]] = {}
+        self.checked = None
+        self._lock = threading.Lock()
+        self._stop_event = threading.Event()
+
+    def start(self, catch_up: bool = True):
+        """Resume from the last minute handled or start from now"""
+        now = self._minute(self.clock())
+        last = state.load(self.config, SCHEDULER_STATE).get("checked")
+        # The current minute is handled by the first tick
+        self.checked = now - timedelta(minutes=1)
+        if catch_up and last:
+            try:
+                last = datetime.fromisoformat(last)
+            except ValueError:
+                last = None
+            if last and last < self.checked:
+                logger.info("Catching up on schedules missed since %s", last)
+                self.checked = last
+
+    def run(self):
+        """Run until stopped"""
+        self.start(catch_up=utils.is_true(self.config.scheduler_catch_up))
+        now = self.clock()
+        if self.delay:
+            logger.info("Runs start %ss after their scheduled time", self.delay)
+        try:
+            for name, when in self.next_runs(self.load_jobs(), now).items():
+                logger.info("Next %s run at %s", name, when.strftime("%Y-%m-%d %H:%M"))
+        except Exception as ex:
+            logger.error("Cannot load the schedules: %s", ex)
+
+        while not self._stop_event.is_set():
+            now = self.clock()
+            try:
+                jobs = self.load_jobs()
+                self.tick(jobs, now)
+                sleep = self.sleep_time(jobs, now)
+            except Exception as ex:
+                logger.error("Cannot load the schedules: %s", ex)
+                sleep = MAX_SLEEP
+            self._stop_event.wait(sleep)
+
+    def stop(self):
+        self._stop_event.set()
+
+    def tick(self, jobs: List[ScheduledJob], now: datetime):
+        """Fire the jobs that were due since the last tick once"""
+        now = self._minute(now)
+        due = [job for job in jobs if job.schedule.next_fire(self.checked) <= now]
+        self.checked = now
+        state.save(self.config, SCHEDULER_STATE, {"checked": now.isoformat()})
+
+        groups = {}
+        for job in due:
+            groups.setdefault(job.group, []).append(job)
+        for group, group_jobs in groups.items():
+            logger.info(
+                "Schedules due at %s: %s",
+                now.strftime("%Y-%m-%d %H:%M"),
+                ", ".join(job.name for job in group_jobs),
+            )
+            self.fire(group, merge_services(group_jobs))
+
+    def fire(self, group: str, services: List[str]):
+        """Start a run of the group or handle the overlap with a running one"""
+        with self._lock:
+            thread = self.running.get(group)
+            if thread is None or not thread.is_alive():
+                self._start(group, services, self.delay)
+            elif self.overlap == OVERLAP_QUEUE:
+                if group in self.pending:
+                    services = union(self.pending[group], services)
+                self.pending[group] = services
+                logger.info("Queued %s run until the running one is done", group)
+            else:
+                logger.warning(
+                    "Skipped %s run: the previous one is still running", group
+                )
+
+    def _start(self, group: str, services: List[str], delay: int = 0):
+        thread = threading.Thread(
+            target=self._run,
+            args=(group, services, delay),
+            name=f"scheduler-{group}",
+        )
+        self.running[group] = thread
+        thread.start()
+
+    def _run(self, group: str, services: List[str], delay: int = 0):
+        # Stopping while waiting for the delay drops the run. Queued runs
+        # are late already and start right away.
+        if delay and self._stop_event.wait(delay):
+            with self._lock:
+                self.running.pop(group, None)
+                self.pending.pop(group, None)
+            return
+
+        start = time.monotonic()
+        try:
+            self.run_group(group, services)
+        except (Exception, SystemExit) as ex:
+            logger.error("Scheduled %s run failed: %s", group, ex)
+        logger.info(
+            "Scheduled %s run finished in %.1fs", group, time.monotonic() - start
+        )
+
+        with self._lock:
+            if group in self.pending:
+                self._start(group, self.pending.pop(group))
+            else:
+                self.running.pop(group, None)
+
+    def sleep_time(self, jobs: List[ScheduledJob], now: datetime) -> float:
+        """float: Seconds until the next schedule fires, at most MAX_SLEEP"""
+        fires = [job.schedule.next_fire(now) for job in jobs]
+        if not fires:
+            return MAX_SLEEP
+        return max(1.0, min(MAX_SLEEP, (min(fires) - now).total_seconds()))
+
+    def next_runs(self, jobs: List[ScheduledJob], now: datetime) -> Dict[str, datetime]:
+        """dict: The next start time of each job including the delay"""
+        delay = timedelta(seconds=self.delay)
+        return {job.name: job.schedule.next_fire(now) + delay for job in jobs}
+
+    @staticmethod
+    def _minute(when: datetime) -> datetime:
+        return when.replace(second=0, microsecond=0)
+
+    def join(self):
+        """Wait for the running and queued runs to finish"""
+        while True:
+            with self._lock:
+                threads = list(self.running.values())
+            if not threads:
+                return
+            for thread in threads:
+                thread.join()
@@ -0,0 +1,237 @@
+"""
+Sizing of the data a backup run is about to move.
+
+Volumes are measured with parallel directory walkers in the backup
+process container. Databases are asked for their size with a query in
+the database container. Combined with the throughput of earlier runs
+this gives an ETA for each service and the whole run.
+"""
+
+import asyncio
+import logging
+import os
+from concurrent.futures import ThreadPoolExecutor
+from dataclasses import dataclass
+from typing import Dict, List, Tuple
+
+from restic_compose_backup import state
+from restic_compose_backup.async_docker import AsyncDockerClient
+from restic_compose_backup.plan import BackupPlan
+
+logger = logging.getLogger(__name__)
+
+SIZES_STATE = "sizes"
+THROUGHPUT_STATE = "throughput"
+
+# Weight of the latest run in the throughput moving average
+THROUGHPUT_WEIGHT = 0.3
+
+KIND_VOLUME = "volume"
+KIND_DATABASE = "database"
+
+
+@dataclass
+class Size:
+    bytes: int = 0
+    files: int = 0
+
+    def __add__(self, other: "Size") -> "Size":
+        return Size(self.bytes + other.bytes, self.files + other.files)
+
+
+def walk(path: str) -> Size:
+    """Size: Total size and file count of a directory tree"""
+    size = Size()
+    stack = [path]
+    while stack:
+        try:
+            with os.scandir(stack.pop()) as it:
+                for entry in it:
+                    try:
+                        if entry.is_dir(follow_symlinks=False):
+                            stack.append(entry.path)
+                        else:
+                            size.bytes += entry.stat(follow_symlinks=False).st_size
+                            size.files += 1
+                    except OSError:
+                        continue
+        except OSError:
+            continue
+    return size
+
+
+def _split(path: str) -> Tuple[Size, List[str]]:
+    """Size of the files directly in a directory and its sub directories"""
+    size = Size()
+    directories = []
+    try:
+        with os.scandir(path) as it:
+            for entry in it:
+                try:
+                    if entry.is_dir(follow_symlinks=False):
+                        directories.append(entry.path)
+                    else:
+                        size.bytes += entry.stat(follow_symlinks=False).st_size
+                        size.files += 1
+                except OSError:
+                    continue
+    except OSError:
+        pass
+    return size, directories
+
+
+def size_paths(paths: List[str], workers: int = 8) -> Dict[str, Size]:
+    """
+    Measure several directory trees. The top level directories of every
+    tree are walked in parallel so a single huge volume is spread over
+    all workers too.
+    """
+    sizes = {}
+    tasks = []
+    with ThreadPoolExecutor(max_workers=max(1, workers)) as executor:
+        for path in paths:
+            size, directories = _split(path)
+            sizes[path] = size
+            tasks += [(path, executor.submit(walk, d)) for d in directories]
+
+        for path, future in tasks:
+            sizes[path] += future.result()
+
+    return sizes
+
+
+def size_volumes(plan: BackupPlan, workers: int = 8) -> Dict[str, Size]:
+    """dict: Size of the mounted volumes per service"""
+    volumes = [v for v in plan.volumes if os.path.isdir(v.destination)]
+    sizes = size_paths([v.destination for v in volumes], workers=workers)
+
+    services = {}
+    for volume in volumes:
+        services[volume.service] = (
+            services.get(volume.service, Size()) + sizes[volume.destination]
+        )
+    return services
+
+
+def size_databases(plan: BackupPlan) -> Dict[str, Size]:
+    """dict: Size of the databases per service. Failed queries are left out."""
+
+    async def _query(client, database):
+        try:
+            exit_code, stdout, stderr = await client.exec_run(
+                database.container_id,
+                database.size_command,
+                environment=database.resolve_environment(),
+            )
+            if exit_code != 0:
+                logger.debug("Size query failed: %s", stderr.decode().strip())
+                return None
+            return database.service, Size(bytes=int(stdout.decode().split()[0]))
+        except Exception as ex:
+            logger.debug("Size query failed for %s: %s", database.service, ex)
+            return None
+
+    async def _query_all():
+        async with AsyncDockerClient.from_env() as client:
+            return await asyncio.gather(
+                *[_query(client, d) for d in plan.databases if d.size_command]
+            )
+
+    return dict(r for r in asyncio.run(_query_all()) if r is not None)
+
+
+def throughput(config, kind: str) -> float:
+    """float: Historical throughput in bytes per second or None if unknown"""
+    return state.load(config, THROUGHPUT_STATE).get(kind)
+
+
+def record_throughput(config, kind: str, size: int, seconds: float):
+    """Update the moving average throughput with the result of a run"""
+    if size <= 0 or seconds <= 0:
+        return
+
+    def _update(data):
+        latest = size / seconds
+        previous = data.get(kind)
+        data[kind] = (
+            latest
+            if previous is None
+            else previous + THROUGHPUT_WEIGHT * (latest - previous)
+        )
+
+    state.update(config, THROUGHPUT_STATE, _update)
+
+
+def save_sizes(config, volumes: Dict[str, Size], databases: Dict[str, Size]):
+    """Remember the latest sizes so ``status`` can show them"""
+    state.save(
+        config,
+        SIZES_STATE,
+        {
+            KIND_VOLUME: {k: v.__dict__ for k, v in volumes.items()},
+            KIND_DATABASE: {k: v.__dict__ for k, v in databases.items()},
+        },
+    )
+
+
+def load_sizes(config) -> Tuple[Dict[str, Size], Dict[str, Size]]:
+    data = state.load(config, SIZES_STATE)
+    return (
+        {k: Size(**v) for k, v in data.get(KIND_VOLUME, {}).items()},
+        {k: Size(**v) for k, v in data.get(KIND_DATABASE, {}).items()},
+    )
+
+
+def eta(config, kind: str, size: int) -> float:
+    """float: Estimated seconds to back up the given bytes or None if unknown"""
+    rate = throughput(config, kind)
+    if not rate:
+        return None
+    return size / rate
+
+
+def format_bytes(value: int) -> str:
+    for unit in ["B", "KiB", "MiB", "GiB", "TiB"]:
+        if abs(value) < 1024 or unit == "TiB":
+            return f"{value:.1f} {unit}" if unit != "B" else f"{value} B"
+        value /= 1024
+
+
+def format_duration(seconds: float) -> str:
+    if seconds is None:
+        return "unknown"
+    minutes, seconds = divmod(int(seconds), 60)
+    hours, minutes = divmod(minutes, 60)
+    return f"{hours}h{minutes:02d}m{seconds:02d}s"
+
+
+def log_report(config, volumes: Dict[str, Size], databases: Dict[str, Size]):
+    """Log the size and ETA of every service and the whole run"""
+    logger.info("%s Sizing %s", "-" * 30, "-" * 29)
+    for kind, sizes in [(KIND_VOLUME, volumes), (KIND_DATABASE, databases)]:
+        for service, size in sorted(sizes.items()):
+            logger.info(
+                " - %s %s: %s%s, ETA %s",
+                kind,
+                service,
+                format_bytes(size.bytes),
+                f" in {size.files} files" if size.files else "",
+                format_duration(eta(config, kind, size.bytes)),
+            )
+
+    volume_total = sum(s.bytes for s in volumes.values())
+    database_total = sum(s.bytes for s in databases.values())
+    volume_eta = eta(config, KIND_VOLUME, volume_total)
+    database_eta = eta(config, KIND_DATABASE, database_total)
+    total_eta = (
+        None
+        if (volume_total and volume_eta is None)
+        or (database_total and database_eta is None)
+        else (volume_eta or 0) + (database_eta or 0)
+    )
+    logger.info(
+        "Total: %s, ETA %s",
+        format_bytes(volume_total + database_total),
+        format_duration(total_eta),
+    )
+    logger.info("-" * 67)
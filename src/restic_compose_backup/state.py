@@ -0,0 +1,54 @@
+"""
+Persistent state between backup runs.
+
+State is kept as small json files in ``STATE_DIR``. The default is
+inside the ``/cache`` volume which is also mapped into the backup
+process container.
+"""
+
+import json
+import logging
+import os
+import tempfile
+import threading
+
+logger = logging.getLogger(__name__)
+
+_lock = threading.RLock()
+
+
+def _path(config, name: str) -> str:
+    return os.path.join(config.state_dir, f"{name}.json")
+
+
+def load(config, name: str) -> dict:
+    """dict: Load a named state. Missing or unreadable state is empty."""
+    try:
+        with open(_path(config, name)) as fd:
+            return json.load(fd)
+    except FileNotFoundError:
+        return {}
+    except (OSError, ValueError) as ex:
+        logger.warning("Ignoring unreadable state '%s': %s", name, ex)
+        return {}
+
+
+def save(config, name: str, data: dict):
+    """Atomically replace a named state"""
+    with _lock:
+        try:
+            os.makedirs(config.state_dir, exist_ok=True)
+            fd, tmp = tempfile.mkstemp(dir=config.state_dir, prefix=f".{name}.")
+            with os.fdopen(fd, "w") as f:
+                json.dump(data, f, indent=2, sort_keys=True)
+            os.replace(tmp, _path(config, name))
+        except OSError as ex:
+            logger.warning("Cannot save state '%s': %s", name, ex)
+
+
+def update(config, name: str, func):
+    """Load, modify and save a named state under a lock"""
+    with _lock:
+        data = load(config, name)
+        func(data)
+        save(config, name, data)
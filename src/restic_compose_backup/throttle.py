@@ -0,0 +1,125 @@
+"""
+CPU, I/O and bandwidth limits for backup workloads
+
+restic and the dump commands in the database containers are started
+through ``nice`` and ``ionice``. The priority is never set from a forked
+child of the threaded backup process. A priority that is not permitted
+is skipped, and so is ``ionice`` when the image does not have it.
+Bandwidth is limited with restic ``--limit-upload`` and
+``--limit-download``.
+"""
+
+import logging
+from dataclasses import dataclass
+from typing import List
+
+logger = logging.getLogger(__name__)
+
+IONICE_CLASSES = {"realtime": 1, "best-effort": 2, "idle": 3}
+
+# Runs "$@" with nice "$1" and ionice options "$2" if they are permitted
+WRAPPER = (
+    'n="$1"; io="$2"; shift 2; '
+    'nice -n "$n" true 2>/dev/null || n=0; '
+    'if [ -n "$io" ] && ionice $io true >/dev/null 2>&1; '
+    'then exec nice -n "$n" ionice $io "$@"; '
+    'else exec nice -n "$n" "$@"; fi'
+)
+
+
+def parse_nice(value) -> int:
+    """int: Validated nice value"""
+    nice = int(str(value).strip())
+    if not -20 <= nice <= 19:
+        raise ValueError(f"nice must be between -20 and 19: {nice}")
+    return nice
+
+
+def parse_ionice(value) -> tuple:
+    """tuple: ``(class, level)`` from ``<class>`` or ``<class>:<level>``"""
+    name, _, level = str(value).strip().lower().partition(":")
+    if name not in IONICE_CLASSES:
+        raise ValueError(f"ionice class must be one of {', '.join(IONICE_CLASSES)}")
+    if name == "idle" or not level:
+        return name, None
+    level = int(level)
+    if not 0 <= level <= 7:
+        raise ValueError(f"ionice level must be between 0 and 7: {level}")
+    return name, level
+
+
+def normalize_ionice(value) -> str:
+    """str: Validated ionice setting"""
+    name, level = parse_ionice(value)
+    return name if level is None else f"{name}:{level}"
+
+
+def parse_limit(value) -> str:
+    """str: Validated bandwidth limit in KiB/s"""
+    value = str(value).strip()
+    if not value.isdigit():
+        raise ValueError(f"limit must be a number of KiB/s: {value}")
+    return value
+
+
+PARSERS = {
+    "nice": parse_nice,
+    "ionice": normalize_ionice,
+    "limit_upload": parse_limit,
+    "limit_download": parse_limit,
+}
+
+
+@dataclass
+class Throttle:
+    """Priority and bandwidth limits of a restic run or dump"""
+
+    nice: int = None
+    ionice: str = None
+    limit_upload: str = None
+    limit_download: str = None
+
+    @classmethod
+    def from_config(cls, config, overrides: dict = None) -> "Throttle":
+        """Throttle: The configured limits with per service overrides applied"""
+        values = {
+            "nice": config.backup_nice,
+            "ionice": config.backup_ionice,
+            "limit_upload": config.restic_limit_upload,
+            "limit_download": config.restic_limit_download,
+        }
+        values.update(overrides or {})
+
+        throttle = cls()
+        for key, value in values.items():
+            if value in (None, ""):
+                continue
+            try:
+                setattr(throttle, key, PARSERS[key](value))
+            except ValueError as ex:
+                logger.warning("Ignoring invalid %s setting: %s", key, ex)
+        return throttle
+
+    def restic_args(self) -> List[str]:
+        """list: restic bandwidth limit options"""
+        args = []
+        if self.limit_upload:
+            args += ["--limit-upload", self.limit_upload]
+        if self.limit_download:
+            args += ["--limit-download", self.limit_download]
+        return args
+
+    def wrap(self, cmd: List[str]) -> List[str]:
+        """list: The command run with this priority"""
+        if self.nice is None and self.ionice is None:
+            return cmd
+
+        ionice = ""
+        if self.ionice is not None:
+            name, level = parse_ionice(self.ionice)
+            ionice = f"-c {IONICE_CLASSES[name]}"
+            if level is not None:
+                ionice += f" -n {level}"
+
+        nice = str(self.nice if self.nice is not None else 0)
+        return ["sh", "-c", WRAPPER, "sh", nice, ionice] + cmd
@@ -1,10 +1,14 @@
+import asyncio
 import os
 import logging
+import socket
 from typing import List, TYPE_CHECKING
 from contextlib import contextmanager
 import docker
 from docker import DockerClient
 
+from restic_compose_backup.async_docker import AsyncDockerClient, DockerAPIError
+
 if TYPE_CHECKING:
     from restic_compose_backup.containers import Container
 
@@ -36,10 +40,55 @@ def list_containers() -> List[dict]:
     Returns:
         List of raw container json data from the api
     """
-    client = docker_client()
-    all_containers = client.containers.list(all=True)
-    client.close()
-    return [c.attrs for c in all_containers]
+
+    async def _list():
+        async with AsyncDockerClient.from_env() as client:
+            return await client.list_containers(all=True)
+
+    return asyncio.run(_list())
+
+
+def get_container_env(container_id: str) -> dict:
+    """dict: The configured environment variables of a single container"""
+
+    async def _inspect():
+        async with AsyncDockerClient.from_env() as client:
+            return await client.inspect_container(container_id)
+
+    env = asyncio.run(_inspect())["Config"]["Env"] or []
+    return {i[0 : i.find("=")]: i[i.find("=") + 1 :] for i in env}
+
+
+def is_container_running(container_id: str) -> bool:
+    """bool: Is the given container running? False if it no longer exists."""
+
+    async def _inspect():
+        async with AsyncDockerClient.from_env() as client:
+            return await client.inspect_container(container_id)
+
+    try:
+        return asyncio.run(_inspect())["State"]["Running"]
+    except DockerAPIError as ex:
+        if ex.status == 404:
+            return False
+        raise
+
+
+def get_host_name() -> str:
+    """
+    str: Name of the docker host. Falls back to the host name of this
+    container if the daemon cannot be reached.
+    """
+
+    async def _info():
+        async with AsyncDockerClient.from_env() as client:
+            return await client.system_info()
+
+    try:
+        return asyncio.run(_info())["Name"]
+    except (DockerAPIError, OSError, KeyError) as ex:
+        logger.debug("Cannot get the docker host name: %s", ex)
+        return socket.gethostname()
 
 
 def get_swarm_nodes():
@@ -54,40 +103,49 @@ def get_swarm_nodes():
         return []
 
 
-def remove_containers(containers: List["Container"]):
-    client = docker_client()
-    logger.info("Attempting to delete stale backup process containers")
-    for container in containers:
-        logger.info(" -> deleting %s", container.name)
+def container_operation(operation: str, verb: str, containers: List["Container"]):
+    """
+    Run a lifecycle operation such as ``stop`` or ``start`` on all the given
+    containers concurrently. Failures are logged per container.
+    """
+
+    async def _run(client, container):
+        logger.info(" -> %s %s", verb, container.name)
         try:
-            c = client.containers.get(container.name)
-            c.remove()
+            await getattr(client, f"{operation}_container")(container.name)
         except Exception as ex:
             logger.exception(ex)
 
+    async def _run_all():
+        async with AsyncDockerClient.from_env() as client:
+            await asyncio.gather(*[_run(client, c) for c in containers])
+
+    asyncio.run(_run_all())
+
+
+def remove_containers(containers: List["Container"]):
+    logger.info("Attempting to delete stale backup process containers")
+    container_operation("remove", "deleting", containers)
+
 
 def stop_containers(containers: List["Container"]):
-    client = docker_client()
     logger.info("Attempting to stop containers labeled to stop during backup")
-    for container in containers:
-        logger.info(" -> stopping %s", container.name)
-        try:
-            c = client.containers.get(container.name)
-            c.stop()
-        except Exception as ex:
-            logger.exception(ex)
+    container_operation("stop", "stopping", containers)
 
 
 def start_containers(containers: List["Container"]):
-    client = docker_client()
     logger.info("Attempting to restart containers that were stopped during backup")
-    for container in containers:
-        logger.info(" -> starting %s", container.name)
-        try:
-            c = client.containers.get(container.name)
-            c.start()
-        except Exception as ex:
-            logger.exception(ex)
+    container_operation("start", "starting", containers)
+
+
+def pause_containers(containers: List["Container"]):
+    logger.info("Attempting to pause containers labeled to pause during backup")
+    container_operation("pause", "pausing", containers)
+
+
+def unpause_containers(containers: List["Container"]):
+    logger.info("Attempting to unpause containers that were paused during backup")
+    container_operation("unpause", "unpausing", containers)
 
 
 def is_true(value):
@@ -0,0 +1,267 @@
+"""
+Change-triggered backups
+
+The watch process container has the planned volumes mounted read-only
+and watches them with inotify. Changes are recorded per mount and
+debounced so a burst of writes results in a single backup of only the
+services whose volumes changed.
+"""
+
+import ctypes
+import errno
+import logging
+import os
+import select
+import struct
+import threading
+import time
+from typing import Callable, Dict, List, Set
+
+from restic_compose_backup.plan import BackupPlan
+
+logger = logging.getLogger(__name__)
+
+# inotify(7) flags
+IN_MODIFY = 0x00000002
+IN_ATTRIB = 0x00000004
+IN_CLOSE_WRITE = 0x00000008
+IN_MOVED_FROM = 0x00000040
+IN_MOVED_TO = 0x00000080
+IN_CREATE = 0x00000100
+IN_DELETE = 0x00000200
+IN_DELETE_SELF = 0x00000400
+IN_Q_OVERFLOW = 0x00004000
+IN_IGNORED = 0x00008000
+IN_ONLYDIR = 0x01000000
+IN_DONT_FOLLOW = 0x02000000
+IN_ISDIR = 0x40000000
+IN_CLOEXEC = 0o2000000
+
+WATCH_MASK = (
+    IN_MODIFY
+    | IN_ATTRIB
+    | IN_CLOSE_WRITE
+    | IN_MOVED_FROM
+    | IN_MOVED_TO
+    | IN_CREATE
+    | IN_DELETE
+    | IN_DELETE_SELF
+)
+EVENT_HEADER = struct.Struct("iIII")
+
+
+class DirtyTracker:
+    """
+    Records changed paths per service and decides when a service is due.
+    A service is due when it has been quiet for ``debounce`` seconds or
+    when its first unsaved change is older than ``max_delay`` seconds.
+    """
+
+    def __init__(self, debounce: float, max_delay: float):
+        self.debounce = debounce
+        self.max_delay = max_delay
+        self._first: Dict[str, float] = {}
+        self._last: Dict[str, float] = {}
+        self._paths: Dict[str, Set[str]] = {}
+
+    def record(self, service: str, path: str, now: float):
+        self._first.setdefault(service, now)
+        self._last[service] = now
+        self._paths.setdefault(service, set()).add(path)
+
+    @property
+    def dirty(self) -> Dict[str, Set[str]]:
+        """dict: Dirty mount paths per service"""
+        return self._paths
+
+    def pop_due(self, now: float) -> Dict[str, Set[str]]:
+        """Remove and return the dirty paths of all services that are due"""
+        due = {}
+        for service in list(self._paths):
+            quiet = now - self._last[service] >= self.debounce
+            overdue = now - self._first[service] >= self.max_delay
+            if quiet or overdue:
+                due[service] = self._paths.pop(service)
+                del self._first[service]
+                del self._last[service]
+        return due
+
+
+class InotifyWatcher:
+    """Recursive inotify watch of directory trees"""
+
+    def __init__(self):
+        self._libc = ctypes.CDLL(None, use_errno=True)
+        self.fd = self._libc.inotify_init1(IN_CLOEXEC)
+        if self.fd < 0:
+            err = ctypes.get_errno()
+            raise OSError(err, os.strerror(err))
+        # watch descriptor -> (key, directory)
+        self._watches: Dict[int, tuple] = {}
+
+    def close(self):
+        os.close(self.fd)
+
+    def add_tree(self, path: str, key: str) -> int:
+        """Watch a directory and all directories below it. Returns the watch count."""
+        count = 0
+        for root, dirs, _ in os.walk(path):
+            if not self._add(root, key):
+                dirs.clear()
+                continue
+            count += 1
+        return count
+
+    def _add(self, path: str, key: str) -> bool:
+        wd = self._libc.inotify_add_watch(
+            self.fd, os.fsencode(path), WATCH_MASK | IN_ONLYDIR | IN_DONT_FOLLOW
+        )
+        if wd < 0:
+            err = ctypes.get_errno()
+            if err == errno.ENOSPC:
+                logger.error(
+                    "inotify watch limit reached at %s. "
+                    "Raise fs.inotify.max_user_watches on the host.",
+                    path,
+                )
+            elif err not in (errno.ENOENT, errno.ENOTDIR):
+                logger.warning("Cannot watch %s: %s", path, os.strerror(err))
+            return False
+
+        self._watches[wd] = (key, path)
+        return True
+
+    def read(self, timeout: float) -> List[tuple]:
+        """
+        Wait up to ``timeout`` seconds for events.
+        Returns a list of ``(key, path)`` for changed paths. On queue
+        overflow ``(None, None)`` is returned meaning everything may have changed.
+        """
+        readable, _, _ = select.select([self.fd], [], [], timeout)
+        if not readable:
+            return []
+
+        data = os.read(self.fd, 1024 * 1024)
+        changes = []
+        offset = 0
+        while offset + EVENT_HEADER.size <= len(data):
+            wd, mask, _, length = EVENT_HEADER.unpack_from(data, offset)
+            offset += EVENT_HEADER.size
+            name = data[offset : offset + length].rstrip(b"\0")
+            offset += length
+
+            if mask & IN_Q_OVERFLOW:
+                changes.append((None, None))
+                continue
+
+            if mask & IN_IGNORED:
+                self._watches.pop(wd, None)
+                continue
+
+            if wd not in self._watches:
+                continue
+
+            key, directory = self._watches[wd]
+            path = os.path.join(directory, os.fsdecode(name)) if name else directory
+            changes.append((key, path))
+
+            # Watch new directories so changes further down are seen
+            if mask & IN_ISDIR and mask & (IN_CREATE | IN_MOVED_TO):
+                self.add_tree(path, key)
+
+        return changes
+
+
+class _TriggerThread(threading.Thread):
+    """Runs the backup trigger for the due services in the background"""
+
+    def __init__(self, trigger: Callable[[List[str]], bool], due: Dict[str, Set[str]]):
+        super().__init__(daemon=True)
+        self.trigger = trigger
+        self.due = due
+        self.ok = False
+
+    def run(self):
+        try:
+            self.ok = self.trigger(sorted(self.due))
+        except Exception as ex:
+            logger.exception(ex)
+            self.ok = False
+
+
+def watch(
+    config,
+    plan: BackupPlan,
+    trigger: Callable[[List[str]], bool],
+    keep_running: Callable[[], bool] = lambda: True,
+    poll_interval: float = 5,
+):
+    """
+    Watch the planned volumes and call ``trigger`` with the list of due
+    services. ``trigger`` returns False if the backup could not be started
+    and the services should stay dirty.
+    """
+    tracker = DirtyTracker(int(config.watch_debounce), int(config.watch_max_delay))
+    watcher = InotifyWatcher()
+    mounts = {}
+    try:
+        for volume in plan.volumes:
+            if not os.path.isdir(volume.destination):
+                logger.warning("Planned volume %s is not mounted", volume.destination)
+                continue
+            mounts[volume.destination] = volume.service
+            count = watcher.add_tree(volume.destination, volume.destination)
+            logger.info(
+                "Watching %s (%s) with %s directories",
+                volume.destination,
+                volume.service,
+                count,
+            )
+
+        if not mounts:
+            logger.error("No volumes to watch")
+            return
+
+        backup = None
+        last_check = time.monotonic()
+        while True:
+            for mount, _ in watcher.read(timeout=poll_interval):
+                now = time.monotonic()
+                if mount is None:
+                    logger.warning("inotify queue overflow. Marking all volumes dirty.")
+                    for destination, service in mounts.items():
+                        tracker.record(service, destination, now)
+                else:
+                    tracker.record(mounts[mount], mount, now)
+
+            # Keep consuming events while a backup is running so the kernel
+            # queue does not overflow. Changes seen meanwhile stay dirty.
+            if backup is not None and not backup.is_alive():
+                backup.join()
+                if not backup.ok:
+                    # Try again later without losing the dirty state
+                    now = time.monotonic()
+                    for service, paths in backup.due.items():
+                        for path in paths:
+                            tracker.record(service, path, now)
+                backup = None
+
+            if backup is None:
+                due = tracker.pop_due(time.monotonic())
+                if due:
+                    for service, paths in due.items():
+                        logger.info(
+                            "Changes in service %s: %s",
+                            service,
+                            ", ".join(sorted(paths)),
+                        )
+                    backup = _TriggerThread(trigger, due)
+                    backup.start()
+
+            if time.monotonic() - last_check > 60:
+                last_check = time.monotonic()
+                if not keep_running():
+                    logger.info("Stopping watcher")
+                    return
+    finally:
+        watcher.close()
@@ -23,6 +23,7 @@ def containers(project="default", containers=[]):
                     'id': 'something'
                     'service': 'service_name',
                     'image': 'image:tag',
+                    'env': ['NAME=value'],
                     'mounts: [{
                         'Source': '/home/user/stuff',
                         'Destination': '/srv/stuff',
@@ -41,6 +42,7 @@ def containers(project="default", containers=[]):
                 + "".join(random.choice(string.ascii_lowercase) for i in range(16)),
                 "Config": {
                     "Image": container.get("image", "image:latest"),
+                    "Env": container.get("env", []),
                     "Labels": {
                         "com.docker.compose.oneoff": "False",
                         "com.docker.compose.project": project,
@@ -0,0 +1,156 @@
+"""Unit tests for the asyncio docker client against a fake daemon"""
+
+import asyncio
+import json
+import os
+import struct
+import tempfile
+import unittest
+import pytest
+
+from restic_compose_backup.async_docker import AsyncDockerClient, DockerAPIError
+
+pytestmark = pytest.mark.unit
+
+
+class FakeDaemon:
+    """Answers a few docker API endpoints over a unix socket"""
+
+    def __init__(self, path):
+        self.path = path
+        self.connections = 0
+        self.requests = []
+
+    async def start(self):
+        self.server = await asyncio.start_unix_server(self.handle, self.path)
+
+    async def stop(self):
+        self.server.close()
+        await self.server.wait_closed()
+
+    async def handle(self, reader, writer):
+        self.connections += 1
+        while True:
+            request_line = await reader.readline()
+            if not request_line:
+                break
+            method, path, _ = request_line.decode().split()
+            length = 0
+            while True:
+                line = await reader.readline()
+                if line == b"\r\n":
+                    break
+                name, _, value = line.decode().partition(":")
+                if name.lower() == "content-length":
+                    length = int(value)
+            if length:
+                await reader.readexactly(length)
+            self.requests.append((method, path))
+
+            if path.startswith("/v1.41/containers/json"):
+                self.send_json(writer, [{"Id": "aaa"}, {"Id": "gone"}])
+            elif path == "/v1.41/containers/aaa/json":
+                # Chunked body
+                body = json.dumps({"Id": "aaa", "Config": {"Env": ["A=1"]}}).encode()
+                writer.write(
+                    b"HTTP/1.1 200 OK\r\nTransfer-Encoding: chunked\r\n\r\n"
+                    + b"%x\r\n" % 5
+                    + body[:5]
+                    + b"\r\n"
+                    + b"%x\r\n" % (len(body) - 5)
+                    + body[5:]
+                    + b"\r\n0\r\n\r\n"
+                )
+            elif path == "/v1.41/containers/gone/json":
+                self.send_json(writer, {"message": "No such container"}, status=404)
+            elif path == "/v1.41/containers/aaa/exec":
+                self.send_json(writer, {"Id": "exec1"}, status=201)
+            elif path == "/v1.41/exec/exec1/start":
+                # Hijacked multiplexed raw stream closed by the daemon
+                writer.write(
+                    b"HTTP/1.1 200 OK\r\n"
+                    b"Content-Type: application/vnd.docker.multiplexed-stream\r\n\r\n"
+                )
+                for stream, data in [(1, b"hello "), (2, b"oops"), (1, b"world")]:
+                    writer.write(struct.pack(">BxxxL", stream, len(data)) + data)
+                await writer.drain()
+                writer.close()
+                return
+            elif path == "/v1.41/exec/exec1/json":
+                self.send_json(writer, {"ExitCode": 3})
+            elif path.startswith("/v1.41/containers/aaa/stop"):
+                writer.write(b"HTTP/1.1 204 No Content\r\n\r\n")
+            else:
+                self.send_json(writer, {"message": "not found"}, status=404)
+            await writer.drain()
+        writer.close()
+
+    def send_json(self, writer, data, status=200):
+        body = json.dumps(data).encode()
+        writer.write(
+            b"HTTP/1.1 %d X\r\nContent-Type: application/json\r\n"
+            b"Content-Length: %d\r\n\r\n" % (status, len(body)) + body
+        )
+
+
+class AsyncDockerClientTests(unittest.TestCase):
+    """Tests for the asyncio docker client"""
+
+    def run_with_daemon(self, func):
+        async def _run():
+            with tempfile.TemporaryDirectory() as tmp:
+                daemon = FakeDaemon(os.path.join(tmp, "docker.sock"))
+                await daemon.start()
+                try:
+                    async with AsyncDockerClient(f"unix://{daemon.path}") as client:
+                        return daemon, await func(client)
+                finally:
+                    await daemon.stop()
+
+        return asyncio.run(_run())
+
+    def test_list_containers_inspects_and_skips_removed(self):
+        """Listing inspects each container and ignores removed ones"""
+        daemon, result = self.run_with_daemon(lambda c: c.list_containers())
+        self.assertEqual(result, [{"Id": "aaa", "Config": {"Env": ["A=1"]}}])
+
+    def test_connections_are_reused(self):
+        """Sequential requests share one keep-alive connection"""
+
+        async def requests(client):
+            await client.inspect_container("aaa")
+            await client.inspect_container("aaa")
+            await client.stop_container("aaa")
+
+        daemon, _ = self.run_with_daemon(requests)
+        self.assertEqual(daemon.connections, 1)
+        self.assertEqual(
+            daemon.requests[-1], ("POST", "/v1.41/containers/aaa/stop?t=10")
+        )
+
+    def test_exec_run_demuxes_output(self):
+        """Exec output is demultiplexed into stdout and stderr"""
+        daemon, result = self.run_with_daemon(
+            lambda c: c.exec_run("aaa", ["echo"], environment={"A": "1"})
+        )
+        self.assertEqual(result, (3, b"hello world", b"oops"))
+
+    def test_error_response(self):
+        """Error responses raise DockerAPIError"""
+
+        async def inspect(client):
+            with self.assertRaises(DockerAPIError) as ctx:
+                await client.inspect_container("gone")
+            return ctx.exception.status
+
+        daemon, status = self.run_with_daemon(inspect)
+        self.assertEqual(status, 404)
+
+    def test_unix_host_formats(self):
+        """Both unix host formats point to the same socket"""
+        self.assertEqual(
+            AsyncDockerClient("unix://tmp/docker.sock")._path, "/tmp/docker.sock"
+        )
+        self.assertEqual(
+            AsyncDockerClient("unix:///tmp/docker.sock")._path, "/tmp/docker.sock"
+        )
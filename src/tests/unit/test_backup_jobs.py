@@ -0,0 +1,504 @@
+"""Unit tests for splitting the backup plan into jobs"""
+
+import os
+import tempfile
+import time
+import unittest
+from datetime import datetime
+from unittest import mock
+import pytest
+
+from restic_compose_backup import jobs, retention, state
+from restic_compose_backup.config import Config
+from restic_compose_backup.plan import (
+    BackupPlan,
+    DatabaseTarget,
+    StopTarget,
+    VolumeTarget,
+)
+
+pytestmark = pytest.mark.unit
+
+
+def make_plan():
+    return BackupPlan(
+        project_name="default",
+        volumes=[
+            VolumeTarget("web", "default", "/srv/media", "/volumes/web/srv/media"),
+            VolumeTarget("web", "default", "/srv/files", "/volumes/web/srv/files"),
+            VolumeTarget("wiki", "default", "/srv/wiki", "/volumes/wiki/srv/wiki"),
+            VolumeTarget("app", "other", "/srv/app", "/volumes/app/srv/app"),
+        ],
+    )
+
+
+class FakeJob(jobs.Job):
+    kind = "volume"
+
+    def __init__(self, name, exit_code):
+        super().__init__(name)
+        self.exit_code = exit_code
+
+    def run(self):
+        if self.exit_code is None:
+            raise RuntimeError("boom")
+        return self.exit_code
+
+
+class VolumeJobTests(unittest.TestCase):
+    """Tests for volume job creation and execution"""
+
+    def setUp(self):
+        patcher = mock.patch(
+            "restic_compose_backup.restic.snapshots_json", return_value=[]
+        )
+        self.snapshots_json = patcher.start()
+        self.addCleanup(patcher.stop)
+
+    def make_config(self, mode):
+        config = Config(check=False)
+        config.volume_backup_mode = mode
+        return config
+
+    def test_single_job_by_default(self):
+        """The default mode backs up /volumes in one job"""
+        result = jobs.volume_jobs(self.make_config("all"), make_plan())
+        self.assertEqual(len(result), 1)
+        self.assertEqual(result[0].paths, ["/volumes"])
+
+    @mock.patch("os.path.exists", return_value=True)
+    def test_jobs_per_service(self, _):
+        """One job per service with all its mounts"""
+        result = jobs.volume_jobs(self.make_config("service"), make_plan())
+        self.assertEqual(
+            {job.name: job.paths for job in result},
+            {
+                "web": ["/volumes/web/srv/files", "/volumes/web/srv/media"],
+                "wiki": ["/volumes/wiki/srv/wiki"],
+                "other/app": ["/volumes/app/srv/app"],
+            },
+        )
+
+    @mock.patch("os.path.exists", return_value=True)
+    def test_jobs_per_mount(self, _):
+        """One job per mount"""
+        result = jobs.volume_jobs(self.make_config("mount"), make_plan())
+        self.assertEqual(len(result), 4)
+        self.assertEqual(result[0].service, "web")
+
+    @mock.patch("os.path.exists", return_value=True)
+    def test_parent_per_path_set(self, _):
+        """Each job gets the latest snapshot of its paths, preferring the pinned host"""
+        self.snapshots_json.return_value = [
+            {"id": "a1", "hostname": "default", "paths": ["/volumes/wiki/srv/wiki"]},
+            {"id": "a2", "hostname": "f00ba4", "paths": ["/volumes/wiki/srv/wiki"]},
+            {
+                "id": "b1",
+                "hostname": "f00ba4",
+                "paths": ["/volumes/web/srv/media", "/volumes/web/srv/files"],
+            },
+        ]
+        result = jobs.volume_jobs(self.make_config("service"), make_plan())
+        self.assertEqual(
+            {job.name: job.parent for job in result},
+            {"web": "b1", "wiki": "a1", "other/app": None},
+        )
+        self.assertEqual({job.host for job in result}, {"default"})
+
+    @mock.patch("os.path.exists", return_value=True)
+    def test_change_detection_runs_separately(self, _):
+        """Mounts with their own change detection are left out of /volumes"""
+        plan = make_plan()
+        plan.volumes[1].change_detection = ["ignore-inode"]
+        result = jobs.volume_jobs(self.make_config("all"), plan)
+        self.assertEqual(result[0].excludes, ["/volumes/web/srv/files"])
+        self.assertEqual(result[1].name, "web [ignore-inode]")
+        self.assertEqual(result[1].paths, ["/volumes/web/srv/files"])
+        self.assertEqual(result[1].change_detection, ["ignore-inode"])
+
+        result = jobs.volume_jobs(self.make_config("service"), plan)
+        self.assertEqual(
+            {job.name: job.paths for job in result if job.service == "web"},
+            {
+                "web": ["/volumes/web/srv/media"],
+                "web [ignore-inode]": ["/volumes/web/srv/files"],
+            },
+        )
+
+    @mock.patch("os.path.exists", return_value=True)
+    def test_exclude_options(self, _):
+        """Exclude patterns stay in /volumes, per run options split the service out"""
+        plan = make_plan()
+        plan.volumes[0].excludes = ["/volumes/web/**/*.log"]
+        plan.volumes[1].excludes = ["/volumes/web/**/*.log"]
+        plan.volumes[2].exclude_larger_than = "1G"
+        result = jobs.volume_jobs(self.make_config("all"), plan)
+        self.assertEqual(
+            result[0].excludes, ["/volumes/wiki/srv/wiki", "/volumes/web/**/*.log"]
+        )
+        self.assertEqual(result[1].name, "wiki")
+        self.assertEqual(result[1].exclude_larger_than, "1G")
+
+    @mock.patch("os.path.exists", return_value=True)
+    def test_compression_runs_separately(self, _):
+        """Services with their own compression level get their own run"""
+        plan = make_plan()
+        plan.volumes[2].compression = "off"
+        result = jobs.volume_jobs(self.make_config("all"), plan)
+        self.assertEqual(result[0].excludes, ["/volumes/wiki/srv/wiki"])
+        self.assertEqual((result[1].name, result[1].compression), ("wiki", "off"))
+
+    @mock.patch("os.path.exists", return_value=True)
+    def test_no_combined_job_without_volumes(self, _):
+        """No /volumes job is made when every volume runs separately"""
+        plan = BackupPlan(project_name="default", volumes=make_plan().volumes[:1])
+        plan.volumes[0].compression = "max"
+        result = jobs.volume_jobs(self.make_config("all"), plan)
+        self.assertEqual([job.name for job in result], ["web"])
+
+    @mock.patch("os.path.exists", return_value=True)
+    def test_throttle_runs_separately(self, _):
+        """Services with their own limits get their own run"""
+        plan = make_plan()
+        plan.volumes[2].throttle = {"limit_upload": "512"}
+        result = jobs.volume_jobs(self.make_config("all"), plan)
+        self.assertEqual(result[0].excludes, ["/volumes/wiki/srv/wiki"])
+        self.assertEqual(result[1].name, "wiki")
+        self.assertEqual(result[1].throttle.restic_args(), ["--limit-upload", "512"])
+
+    @mock.patch("os.path.exists", return_value=True)
+    def test_partial_run_after_full_run(self, _):
+        """Partial runs neither replace the full parent nor its retention group"""
+        config = self.make_config("all")
+        full = {
+            "id": "full",
+            "paths": ["/volumes"],
+            "tags": ["project:default", "service:_all"],
+            "hostname": "default",
+        }
+        self.snapshots_json.return_value = [full]
+        plan = make_plan()
+        plan.volumes = plan.volumes[:2]
+        plan.services = ["web"]
+        partial = jobs.volume_jobs(config, plan)
+        self.assertEqual(
+            [(job.name, job.tags) for job in partial],
+            [("web", ["project:default", "service:web"])],
+        )
+
+        snapshots = [
+            full,
+            {
+                "id": "web",
+                "paths": partial[0].paths,
+                "tags": partial[0].tags,
+                "hostname": "default",
+            },
+        ]
+        self.snapshots_json.return_value = snapshots
+        result = jobs.volume_jobs(config, make_plan())
+        self.assertEqual((result[0].name, result[0].parent), ("/volumes", "full"))
+        self.assertEqual(
+            retention.forget_groups(snapshots),
+            ["project:default,service:_all", "project:default,service:web"],
+        )
+
+    @mock.patch("os.path.exists", return_value=True)
+    def test_stopped_services_run_separately(self, _):
+        """Volumes of stopped services are backed up by their own jobs"""
+        plan = make_plan()
+        plan.stop = [StopTarget("wiki", "default", "id", "default-wiki-1")]
+        stops = jobs.service_stops(plan)
+        result = jobs.volume_jobs(self.make_config("all"), plan, stops=stops)
+        self.assertEqual(result[0].excludes, ["/volumes/wiki/srv/wiki"])
+        self.assertEqual(result[0].stops, [])
+        self.assertEqual(result[1].name, "wiki")
+        self.assertEqual(result[1].stops, [stops["wiki"]])
+        self.assertEqual(stops["wiki"].jobs, 1)
+
+    def test_format_summary(self):
+        """The achieved compression is shown with the added data"""
+        self.assertEqual(
+            jobs.format_summary({"data_added": 8192, "data_added_packed": 2048}),
+            "added 8.0 KiB, stored 2.0 KiB (4.0x)",
+        )
+        self.assertEqual(jobs.format_summary({"data_added": 10}), "added 10 B")
+
+    def test_run_jobs_reports_each_result(self):
+        """Failures and exceptions are reported per job"""
+        results = jobs.run_jobs(
+            [FakeJob("a", 0), FakeJob("b", 3), FakeJob("c", None)], concurrency=2
+        )
+        self.assertEqual([r.name for r in results], ["a", "b", "c"])
+        self.assertEqual([r.exit_code for r in results], [0, 3, 1])
+        self.assertEqual([r.ok for r in results], [True, False, False])
+
+
+@mock.patch("restic_compose_backup.utils.start_containers")
+@mock.patch("restic_compose_backup.utils.stop_containers")
+class ServiceStopTests(unittest.TestCase):
+    """Tests for stopping services only during their own jobs"""
+
+    def test_restarted_after_last_job(self, stop_containers, start_containers):
+        """The service is stopped once and started after its last job"""
+        stop = jobs.ServiceStop("web", [StopTarget("web", "default", "id", "web")])
+        web = [FakeJob("web-a", 0), FakeJob("web-b", 0)]
+        for job in web:
+            job.stops = [stop]
+        stop.jobs = 2
+
+        jobs.run_job(web[0])
+        stop_containers.assert_called_once_with(stop.containers)
+        start_containers.assert_not_called()
+        jobs.run_job(FakeJob("other", 0))
+        start_containers.assert_not_called()
+        jobs.run_job(web[1])
+        start_containers.assert_called_once_with(stop.containers)
+        stop_containers.assert_called_once()
+        self.assertIsNotNone(stop.downtime)
+
+    def test_deferred_job_is_done(self, stop_containers, start_containers):
+        """A deferred job does not stop the service or keep it down"""
+        stop = jobs.ServiceStop("web", [])
+        job = FakeJob("web", 0)
+        job.stops = [stop]
+        job.priority = "low"
+        job.predicted = 3600.0
+        stop.jobs = 1
+
+        result = jobs.run_job(job, deadline=time.time() + 60)
+        self.assertTrue(result.deferred)
+        stop_containers.assert_not_called()
+        start_containers.assert_not_called()
+        self.assertEqual(stop.jobs, 0)
+
+    @mock.patch("restic_compose_backup.utils.unpause_containers")
+    @mock.patch("restic_compose_backup.utils.pause_containers")
+    def test_paused_containers(
+        self, pause_containers, unpause_containers, stop_containers, start_containers
+    ):
+        """Containers labelled to pause are paused instead of stopped"""
+        paused = StopTarget("web", "default", "a", "web-1", pause=True)
+        stopped = StopTarget("web", "default", "b", "web-2")
+        stop = jobs.ServiceStop("web", [paused, stopped])
+        job = FakeJob("web", 0)
+        job.stops = [stop]
+        stop.jobs = 1
+
+        jobs.run_job(job)
+        pause_containers.assert_called_once_with([paused])
+        unpause_containers.assert_called_once_with([paused])
+        stop_containers.assert_called_once_with([stopped])
+        start_containers.assert_called_once_with([stopped])
+
+    def test_stopped_jobs_go_first(self, *_):
+        """Jobs of stopped services are scheduled before the others"""
+        job = FakeJob("web", 0)
+        job.stops = [jobs.ServiceStop("web", [])]
+        result = jobs.schedule([FakeJob("other", 0), job], {"volume:other": 60.0})
+        self.assertEqual([j.name for j in result], ["web", "other"])
+
+
+class ScheduleTests(unittest.TestCase):
+    """Tests for ordering jobs by their duration history"""
+
+    def setUp(self):
+        self.tmp = tempfile.TemporaryDirectory()
+        self.addCleanup(self.tmp.cleanup)
+        self.config = Config(check=False)
+        self.config.state_dir = self.tmp.name
+
+    def test_longest_first(self):
+        """Jobs without history go first, then the longest"""
+        durations = {"volume:a": 10.0, "volume:b": 300.0, "volume:c": 60.0}
+        ordered = jobs.schedule(
+            [FakeJob(name, 0) for name in ["a", "b", "c", "new"]], durations
+        )
+        self.assertEqual([job.name for job in ordered], ["new", "b", "c", "a"])
+        self.assertEqual(ordered[1].predicted, 300.0)
+
+    def test_predict_makespan(self):
+        """Jobs start on the worker that is free first"""
+        ordered = jobs.schedule(
+            [FakeJob(name, 0) for name in "abcd"],
+            {"volume:a": 30.0, "volume:b": 20.0, "volume:c": 20.0, "volume:d": 10.0},
+        )
+        self.assertEqual(jobs.predict_makespan(ordered, 2), 40.0)
+        self.assertEqual(jobs.predict_makespan(ordered, 1), 80.0)
+        self.assertIsNone(jobs.predict_makespan([FakeJob("x", 0)], 2))
+
+    def test_run_scheduled_records_durations(self):
+        """Durations of successful jobs are kept as a moving average"""
+        results = jobs.run_scheduled(
+            self.config, [FakeJob("a", 0), FakeJob("b", 3)], concurrency=2
+        )
+        self.assertEqual(len(results), 2)
+        self.assertEqual(list(jobs.load_durations(self.config)), ["volume:a"])
+
+        jobs.record_durations(
+            self.config,
+            [jobs.JobResult("a", "volume", None, 0, duration=100.0)],
+        )
+        previous = {r.name: r.duration for r in results}["a"]
+        self.assertAlmostEqual(
+            jobs.load_durations(self.config)["volume:a"],
+            previous + 0.3 * (100.0 - previous),
+        )
+
+    def test_deferred_and_priority_first(self):
+        """Jobs deferred last time go first, then by priority within a window"""
+        new, low, high = FakeJob("new", 0), FakeJob("low", 0), FakeJob("high", 0)
+        low.priority, high.priority = "low", "high"
+        ordered = jobs.schedule(
+            [new, low, high], {}, deferred=["volume:low"], by_priority=True
+        )
+        self.assertEqual([job.name for job in ordered], ["low", "high", "new"])
+        ordered = jobs.schedule([new, low, high], {})
+        self.assertEqual([job.name for job in ordered], ["new", "low", "high"])
+
+    def test_window_deadline(self):
+        """The window ends at the next end time after the start"""
+        self.config.backup_window_end = "06:30"
+        self.assertEqual(
+            jobs.window_deadline(self.config, datetime(2024, 5, 1, 2, 0)),
+            datetime(2024, 5, 1, 6, 30).timestamp(),
+        )
+        self.assertEqual(
+            jobs.window_deadline(self.config, datetime(2024, 5, 1, 23, 0)),
+            datetime(2024, 5, 2, 6, 30).timestamp(),
+        )
+        self.config.backup_window_end = "late"
+        self.assertIsNone(jobs.window_deadline(self.config))
+
+    def test_defer_past_deadline(self):
+        """Only low priority jobs with history that would end late"""
+        job = FakeJob("a", 0)
+        job.priority = "low"
+        self.assertFalse(jobs.should_defer(job, 100.0, now=0.0))
+        job.predicted = 150.0
+        self.assertTrue(jobs.should_defer(job, 100.0, now=0.0))
+        self.assertFalse(jobs.should_defer(job, 200.0, now=0.0))
+        self.assertFalse(jobs.should_defer(job, None, now=0.0))
+        job.priority = "high"
+        self.assertFalse(jobs.should_defer(job, 100.0, now=0.0))
+
+    def test_normal_job_not_deferred(self):
+        """Normal priority jobs run even when they would end late"""
+        job = FakeJob("a", 0)
+        job.predicted = 150.0
+        self.assertEqual(job.priority, "normal")
+        self.assertFalse(jobs.should_defer(job, 100.0, now=0.0))
+
+    def test_run_scheduled_defers(self):
+        """Deferred jobs do not run and are remembered for the next run"""
+        jobs.record_durations(
+            self.config,
+            [jobs.JobResult("slow", "volume", None, 0, duration=3600.0)],
+        )
+        slow = FakeJob("slow", None)
+        slow.priority = "low"
+        results = jobs.run_scheduled(
+            self.config, [slow, FakeJob("fast", 0)], deadline=time.time() + 60
+        )
+        self.assertEqual(
+            [(r.name, r.ok, r.deferred) for r in results],
+            [("fast", True, False), ("slow", True, True)],
+        )
+        self.assertEqual(
+            state.load(self.config, jobs.DEFERRED_STATE), {"jobs": ["volume:slow"]}
+        )
+
+        jobs.run_scheduled(self.config, [FakeJob("slow", 0)])
+        self.assertEqual(state.load(self.config, jobs.DEFERRED_STATE), {"jobs": []})
+
+    @mock.patch("restic_compose_backup.restic.backup_from_stdin", return_value=0)
+    def test_database_jobs(self, backup_from_stdin):
+        """Each database dump is a job streaming into restic"""
+        plan = BackupPlan(
+            project_name="default",
+            databases=[
+                DatabaseTarget(
+                    "db",
+                    "default",
+                    "f00ba4",
+                    "postgres",
+                    "/databases/db/all_databases.sql",
+                    ["pg_dumpall"],
+                )
+            ],
+        )
+        result = jobs.database_jobs(self.config, plan)
+        self.assertEqual(result[0].key, "database:/databases/db/all_databases.sql")
+        self.assertEqual(result[0].run(), 0)
+        args, kwargs = backup_from_stdin.call_args
+        self.assertEqual(
+            args[1:], ("/databases/db/all_databases.sql", "f00ba4", ["pg_dumpall"])
+        )
+        self.assertEqual(kwargs["tags"], ["project:default", "service:db"])
+        self.assertEqual(kwargs["host"], "default")
+
+
+class ShardTests(unittest.TestCase):
+    """Tests for splitting a single volume into shards"""
+
+    def setUp(self):
+        self.tmp = tempfile.TemporaryDirectory()
+        for name in ["a", "b", "c", "d", "e"]:
+            os.mkdir(os.path.join(self.tmp.name, name))
+        open(os.path.join(self.tmp.name, "loose.txt"), "w").close()
+
+    def tearDown(self):
+        self.tmp.cleanup()
+
+    def make_volume(self, shard_by, shards=0):
+        return VolumeTarget(
+            "media", "default", "/srv/media", self.tmp.name, shard_by, shards
+        )
+
+    def test_hash_shards_are_stable(self):
+        """Entries are spread over at most N shards and stay put"""
+        volume = self.make_volume("hash", 3)
+        first = jobs.shard_paths(volume)
+        os.mkdir(os.path.join(self.tmp.name, "f"))
+        second = jobs.shard_paths(volume)
+
+        self.assertLessEqual(len(first), 3)
+        self.assertEqual(sum(len(p) for p in first.values()), 6)
+        for key, paths in first.items():
+            self.assertTrue(set(paths) <= set(second[key]))
+
+    def test_directory_shards(self):
+        """Each directory is a shard and loose files share one"""
+        shards = jobs.shard_paths(self.make_volume("directory"))
+        self.assertEqual(sorted(shards), ["_files", "a", "b", "c", "d", "e"])
+        self.assertEqual(shards["_files"], [os.path.join(self.tmp.name, "loose.txt")])
+
+    @mock.patch("restic_compose_backup.restic.snapshots_json", return_value=[])
+    def test_file_mounts_are_not_sharded(self, _):
+        """A file mount of a sharded service is backed up as a whole"""
+        config = Config(check=False)
+        config.volume_backup_mode = "service"
+        path = os.path.join(self.tmp.name, "loose.txt")
+        volume = VolumeTarget("media", "default", path, path, "hash", 4)
+        result = jobs.volume_jobs(config, BackupPlan("default", volumes=[volume]))
+        self.assertEqual([(job.name, job.paths) for job in result], [("media", [path])])
+
+    def test_sharded_volume_jobs(self):
+        """Sharded volumes get their own tagged jobs with their own parent"""
+        config = Config(check=False)
+        config.volume_backup_mode = "all"
+        plan = BackupPlan("default", volumes=[self.make_volume("directory")])
+        tag = f"shard:{self.tmp.name}#a"
+        with mock.patch(
+            "restic_compose_backup.restic.snapshots_json",
+            return_value=[{"id": "abc123", "tags": [tag], "paths": []}],
+        ):
+            result = jobs.volume_jobs(config, plan)
+
+        # Nothing is left for the combined /volumes job
+        self.assertNotIn(["/volumes"], [job.paths for job in result])
+        self.assertEqual(len(result), 6)
+        shard = [job for job in result if tag in job.tags][0]
+        self.assertEqual(shard.parent, "abc123")
+        self.assertEqual(shard.service, "media")
+        self.assertEqual(shard.tags, [tag, "project:default", "service:media"])
@@ -0,0 +1,282 @@
+"""Unit tests for the backup plan handed to the backup process container"""
+
+import unittest
+from unittest import mock
+import pytest
+
+from restic_compose_backup.containers import RunningContainers
+from restic_compose_backup.plan import BackupPlan
+from . import fixtures
+from .conftest import BaseTestCase
+
+pytestmark = pytest.mark.unit
+
+list_containers_func = "restic_compose_backup.utils.list_containers"
+
+
+class BackupPlanTests(BaseTestCase):
+    """Tests for resolving and serializing the backup plan"""
+
+    def createPlanContainers(self):
+        containers = self.createContainers()
+        containers += [
+            {
+                "service": "web",
+                "labels": {
+                    "stack-back.volumes": True,
+                    "stack-back.volumes.stop-during-backup": True,
+                },
+                "mounts": [
+                    {
+                        "Source": "/srv/web/media",
+                        "Destination": "/srv/media",
+                        "Type": "bind",
+                    }
+                ],
+            },
+            {
+                "service": "mariadb",
+                "labels": {
+                    "stack-back.mariadb": True,
+                },
+                "env": [
+                    "MARIADB_ROOT_PASSWORD=secret",
+                ],
+                "mounts": [
+                    {
+                        "Source": "/srv/mariadb/data",
+                        "Destination": "/var/lib/mysql",
+                        "Type": "bind",
+                    },
+                ],
+            },
+        ]
+        return containers
+
+    def test_plan_from_containers(self):
+        """Test resolving mounts, databases and stop list"""
+        containers = self.createPlanContainers()
+        with mock.patch(
+            list_containers_func, fixtures.containers(containers=containers)
+        ):
+            cnt = RunningContainers()
+            plan = BackupPlan.from_containers(cnt)
+
+        self.assertEqual(plan.project_name, "default")
+        self.assertEqual(len(plan.volumes), 1)
+        self.assertEqual(plan.volumes[0].destination, "/volumes/web/srv/media")
+        self.assertEqual(
+            plan.mounts(),
+            {"/srv/web/media": {"bind": "/volumes/web/srv/media", "mode": "ro"}},
+        )
+        self.assertEqual(len(plan.databases), 1)
+        database = plan.databases[0]
+        self.assertEqual(database.container_type, "mariadb")
+        self.assertEqual(database.destination, "/databases/mariadb/all_databases.sql")
+        self.assertEqual(database.environment, {"MYSQL_PWD": "MARIADB_ROOT_PASSWORD"})
+        self.assertEqual([s.service for s in plan.stop], ["web"])
+
+    def test_plan_json_round_trip(self):
+        """The plan survives serialization and holds no secrets"""
+        containers = self.createPlanContainers()
+        with mock.patch(
+            list_containers_func, fixtures.containers(containers=containers)
+        ):
+            plan = BackupPlan.from_containers(RunningContainers())
+
+        data = plan.to_json()
+        self.assertNotIn("secret", data)
+        self.assertEqual(BackupPlan.from_json(data), plan)
+
+    def test_partial_plan(self):
+        """Plans of some services are marked partial, plans of all are not"""
+        containers = self.createPlanContainers()
+        with mock.patch(
+            list_containers_func, fixtures.containers(containers=containers)
+        ):
+            cnt = RunningContainers()
+            partial = BackupPlan.from_containers(cnt, services=["web"])
+            everything = BackupPlan.from_containers(cnt, services=["web", "mariadb"])
+
+        self.assertEqual(partial.services, ["web"])
+        self.assertTrue(partial.is_partial)
+        self.assertEqual(BackupPlan.from_json(partial.to_json()), partial)
+        self.assertFalse(everything.is_partial)
+
+    def test_resolve_credential_references(self):
+        """Credential references are resolved from the database container"""
+        containers = self.createPlanContainers()
+        with mock.patch(
+            list_containers_func, fixtures.containers(containers=containers)
+        ):
+            plan = BackupPlan.from_containers(RunningContainers())
+
+        with mock.patch(
+            "restic_compose_backup.utils.get_container_env",
+            return_value={"MARIADB_ROOT_PASSWORD": "secret"},
+        ):
+            environment = plan.databases[0].resolve_environment()
+        self.assertEqual(environment, {"MYSQL_PWD": "secret"})
+
+    def test_shared_and_nested_sources(self):
+        """Shared and nested sources are backed up once by a stable owner"""
+        containers = self.createContainers()
+        for service in ["worker", "app", "files"]:
+            containers.append(
+                {
+                    "service": service,
+                    "labels": {"stack-back.volumes": True},
+                    "mounts": [
+                        {
+                            "Source": "/srv/shared/uploads"
+                            if service != "files"
+                            else "/srv/shared",
+                            "Destination": "/data",
+                            "Type": "bind",
+                        },
+                        {
+                            "Source": f"/srv/{service}",
+                            "Destination": "/own",
+                            "Type": "bind",
+                        },
+                    ],
+                }
+            )
+
+        with mock.patch(
+            list_containers_func, fixtures.containers(containers=containers)
+        ):
+            cnt = RunningContainers()
+            plan = BackupPlan.from_containers(cnt)
+
+        volumes = {volume.source: volume for volume in plan.volumes}
+        self.assertEqual(
+            sorted(volumes), ["/srv/app", "/srv/files", "/srv/shared", "/srv/worker"]
+        )
+        self.assertEqual(volumes["/srv/shared"].service, "files")
+        self.assertEqual(volumes["/srv/shared"].shared_with, ["app", "worker"])
+        self.assertEqual(len(plan.mounts()), 4)
+
+    def test_retention_labels(self):
+        """Keep labels end up in the plan retention"""
+        containers = self.createContainers()
+        containers += [
+            {
+                "service": "web",
+                "labels": {
+                    "stack-back.volumes": True,
+                    "stack-back.keep-daily": "2",
+                    "stack-back.keep-yearly": "never",
+                },
+            },
+        ]
+        with mock.patch(
+            list_containers_func, fixtures.containers(containers=containers)
+        ):
+            cnt = RunningContainers()
+            plan = BackupPlan.from_containers(cnt)
+
+        self.assertEqual(plan.retention, {"default/web": {"daily": "2"}})
+        self.assertEqual(BackupPlan.from_json(plan.to_json()).retention, plan.retention)
+
+    def test_priority_label(self):
+        """Priorities end up in the plan. Invalid values are ignored."""
+        containers = self.createContainers()
+        containers += [
+            {
+                "service": "web",
+                "labels": {
+                    "stack-back.volumes": True,
+                    "stack-back.priority": "Low",
+                },
+                "mounts": [
+                    {"Source": "/srv/web", "Destination": "/srv/web", "Type": "bind"},
+                ],
+            },
+            {
+                "service": "wiki",
+                "labels": {
+                    "stack-back.volumes": True,
+                    "stack-back.priority": "urgent",
+                },
+                "mounts": [
+                    {"Source": "/srv/wiki", "Destination": "/srv/wiki", "Type": "bind"},
+                ],
+            },
+        ]
+        with mock.patch(
+            list_containers_func, fixtures.containers(containers=containers)
+        ):
+            plan = BackupPlan.from_containers(RunningContainers())
+
+        self.assertEqual(
+            {volume.service: volume.priority for volume in plan.volumes},
+            {"web": "low", "wiki": None},
+        )
+
+    def test_pause_label(self):
+        """Paused services are in the stop list. Stopping takes precedence."""
+        containers = self.createContainers()
+        containers += [
+            {
+                "service": "web",
+                "labels": {
+                    "stack-back.volumes": True,
+                    "stack-back.volumes.pause-during-backup": True,
+                },
+                "mounts": [
+                    {"Source": "/srv/web", "Destination": "/srv/web", "Type": "bind"},
+                ],
+            },
+            {
+                "service": "wiki",
+                "labels": {
+                    "stack-back.volumes": True,
+                    "stack-back.volumes.stop-during-backup": True,
+                    "stack-back.volumes.pause-during-backup": True,
+                },
+                "mounts": [
+                    {"Source": "/srv/wiki", "Destination": "/srv/wiki", "Type": "bind"},
+                ],
+            },
+        ]
+        with mock.patch(
+            list_containers_func, fixtures.containers(containers=containers)
+        ):
+            plan = BackupPlan.from_containers(RunningContainers())
+
+        self.assertEqual(
+            sorted((target.service, target.pause) for target in plan.stop),
+            [("web", True), ("wiki", False)],
+        )
+        self.assertEqual(BackupPlan.from_json(plan.to_json()).stop, plan.stop)
+
+    def test_skip_unchanged_label(self):
+        """``true`` uses the stat fingerprint, ``dirs`` only when asked for"""
+        containers = self.createContainers()
+        for service, value in [("web", True), ("logs", "dirs"), ("wiki", "off")]:
+            containers.append(
+                {
+                    "service": service,
+                    "labels": {
+                        "stack-back.volumes": True,
+                        "stack-back.volumes.skip-unchanged": value,
+                    },
+                    "mounts": [
+                        {
+                            "Source": f"/srv/{service}",
+                            "Destination": f"/srv/{service}",
+                            "Type": "bind",
+                        },
+                    ],
+                }
+            )
+        with mock.patch(
+            list_containers_func, fixtures.containers(containers=containers)
+        ):
+            plan = BackupPlan.from_containers(RunningContainers())
+
+        self.assertEqual(
+            sorted((target.service, target.skip_unchanged) for target in plan.volumes),
+            [("logs", "dirs"), ("web", "stat"), ("wiki", None)],
+        )
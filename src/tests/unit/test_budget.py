@@ -0,0 +1,101 @@
+"""Unit tests for the host-wide concurrency budget"""
+
+import os
+import tempfile
+import threading
+import time
+import unittest
+import pytest
+
+from restic_compose_backup import budget, jobs
+
+pytestmark = pytest.mark.unit
+
+
+class FakeJob(jobs.Job):
+    kind = "volume"
+    budget_kind = budget.KIND_BACKUP
+
+    def __init__(self, name, started, hold=0.0):
+        super().__init__(name)
+        self.started = started
+        self.hold = hold
+
+    def run(self):
+        self.started.append(self.name)
+        time.sleep(self.hold)
+        return 0
+
+
+class HostBudgetTests(unittest.TestCase):
+    """Tests for slots shared through a directory"""
+
+    def setUp(self):
+        self.tmp = tempfile.TemporaryDirectory()
+        self.addCleanup(self.tmp.cleanup)
+
+    def make_budget(self, value="1"):
+        # Each instance stands in for another stack-back on the host
+        return budget.HostBudget(self.tmp.name, budget.parse_budget(value), poll=0.01)
+
+    def test_parse_budget(self):
+        """A single number limits every kind"""
+        self.assertEqual(budget.parse_budget("2"), {"scan": 2, "dump": 2, "backup": 2})
+        self.assertEqual(budget.parse_budget("dump=1"), {"dump": 1})
+        with self.assertRaises(ValueError):
+            budget.parse_budget("upload=1")
+
+    def test_free_slot(self):
+        """A free slot is taken without waiting"""
+        with self.make_budget("2").slot(budget.KIND_DUMP, "db") as waited:
+            self.assertEqual(waited, 0.0)
+            with self.make_budget("2").slot(budget.KIND_DUMP, "db2") as waited:
+                self.assertEqual(waited, 0.0)
+        with self.make_budget("scan=1").slot(budget.KIND_DUMP, "db") as waited:
+            self.assertEqual(waited, 0.0)
+
+    def test_fifo_order(self):
+        """Waiters get the slot in the order they arrived"""
+        order = []
+        holder = self.make_budget()
+
+        def wait(name):
+            with self.make_budget().slot(budget.KIND_BACKUP, name) as waited:
+                order.append((name, waited > 0))
+
+        with holder.slot(budget.KIND_BACKUP, "first"):
+            threads = []
+            for name in ["a", "b", "c"]:
+                thread = threading.Thread(target=wait, args=(name,))
+                thread.start()
+                threads.append(thread)
+                # Let the thread queue up before the next one arrives
+                while len(self.wait_files()) < len(threads):
+                    time.sleep(0.005)
+
+        for thread in threads:
+            thread.join()
+        self.assertEqual(order, [("a", True), ("b", True), ("c", True)])
+        self.assertEqual(self.wait_files(), [])
+
+    def test_dead_waiter_is_removed(self):
+        """Wait files nobody holds do not block the queue"""
+        open(os.path.join(self.tmp.name, "backup-00000000000000000001-dead.wait"), "w")
+        with self.make_budget().slot(budget.KIND_BACKUP, "job") as waited:
+            self.assertEqual(waited, 0.0)
+        self.assertEqual(self.wait_files(), [])
+
+    def test_jobs_report_wait(self):
+        """Jobs hold a slot while running and report the time they waited"""
+        started = []
+        results = jobs.run_jobs(
+            [FakeJob("a", started, hold=0.05), FakeJob("b", started)],
+            concurrency=2,
+            host_budget=self.make_budget(),
+        )
+        self.assertEqual(len(started), 2)
+        self.assertEqual(sorted(bool(r.waited) for r in results), [False, True])
+        self.assertTrue(all(r.duration < 1 for r in results))
+
+    def wait_files(self):
+        return [n for n in os.listdir(self.tmp.name) if n.endswith(".wait")]
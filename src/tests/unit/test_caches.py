@@ -0,0 +1,63 @@
+"""Unit tests for cache directory discovery"""
+
+import os
+import tempfile
+import unittest
+import pytest
+
+from restic_compose_backup import caches
+from restic_compose_backup.plan import BackupPlan, VolumeTarget
+
+pytestmark = pytest.mark.unit
+
+
+class CacheDiscoveryTests(unittest.TestCase):
+    """Tests for finding and excluding cache directories"""
+
+    def setUp(self):
+        self.tmp = tempfile.TemporaryDirectory()
+        self.root = os.path.join(self.tmp.name, "web")
+        self.write("app/node_modules/pkg/index.js", b"x" * 10)
+        self.write("app/src/main.js", b"x")
+        self.write("data/thumbs/CACHEDIR.TAG", caches.CACHEDIR_SIGNATURE + b"\n")
+        self.write("data/fake/CACHEDIR.TAG", b"not a cache")
+        self.write("data/.stackbackignore", b"# generated\ntranscode*\n")
+        self.write("data/transcoded/a.mp4", b"x" * 100)
+        self.write("data/photos/transcodes/b.mp4", b"x" * 5)
+        self.plan = BackupPlan(
+            "default", volumes=[VolumeTarget("web", "default", "/srv", self.root)]
+        )
+
+    def tearDown(self):
+        self.tmp.cleanup()
+
+    def write(self, path, data):
+        path = os.path.join(self.root, path)
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        with open(path, "wb") as fd:
+            fd.write(data)
+
+    def test_discover(self):
+        """Tagged, well known and ignored directories are found with their size"""
+        candidates = caches.discover(self.plan, workers=2)
+        found = {
+            os.path.relpath(c.path, self.root): (c.reason, c.size.bytes)
+            for c in candidates
+        }
+        self.assertEqual(
+            found,
+            {
+                "app/node_modules": ("node_modules", 10),
+                "data/thumbs": ("CACHEDIR.TAG", 44),
+                "data/transcoded": (".stackbackignore", 100),
+                "data/photos/transcodes": (".stackbackignore", 5),
+            },
+        )
+
+    def test_apply_excludes(self):
+        """Candidates become excludes of the volume holding them"""
+        candidates = caches.discover(self.plan, workers=2)
+        caches.apply_excludes(self.plan, candidates)
+        self.assertEqual(
+            sorted(self.plan.volumes[0].excludes), sorted(c.path for c in candidates)
+        )
@@ -0,0 +1,56 @@
+"""Unit tests for validating the configuration"""
+
+import unittest
+import pytest
+
+from restic_compose_backup.config import Config
+
+pytestmark = pytest.mark.unit
+
+
+class ConfigTests(unittest.TestCase):
+    """Tests for Config.check"""
+
+    def make_config(self):
+        config = Config(check=False)
+        config.repository = config.password = "/restic_data"
+        return config
+
+    def test_defaults_are_valid(self):
+        """The defaults pass the check"""
+        self.make_config().check()
+
+    def test_positive_integers(self):
+        """Concurrency, workers and pressure settings must be positive integers"""
+        for name in [
+            "backup_concurrency",
+            "database_concurrency",
+            "sizing_workers",
+            "pressure_interval",
+            "pressure_max_pause",
+            "pressure_limit_upload",
+        ]:
+            for value in ["0", "-1", "two", "1.5"]:
+                config = self.make_config()
+                setattr(config, name, value)
+                with self.assertRaises(ValueError, msg=f"{name}={value}"):
+                    config.check()
+
+    def test_watch_and_fingerprint_settings(self):
+        """Watch delays and the fingerprint age must be numbers"""
+        for name, value in [
+            ("watch_debounce", "1m"),
+            ("watch_max_delay", "-5"),
+            ("fingerprint_max_age_days", "week"),
+            ("fingerprint_max_age_days", "-1"),
+            ("fingerprint_max_age_days", "nan"),
+        ]:
+            config = self.make_config()
+            setattr(config, name, value)
+            with self.assertRaises(ValueError, msg=f"{name}={value}"):
+                config.check()
+
+        config = self.make_config()
+        config.watch_debounce = "0"
+        config.fingerprint_max_age_days = "0.5"
+        config.check()
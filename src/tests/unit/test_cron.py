@@ -0,0 +1,150 @@
+"""Unit tests for cron schedules"""
+
+import unittest
+from datetime import datetime
+from unittest import mock
+import pytest
+
+from restic_compose_backup import cli, cron
+from restic_compose_backup.config import Config
+from restic_compose_backup.containers import RunningContainers
+from . import fixtures
+from .conftest import BaseTestCase
+
+pytestmark = pytest.mark.unit
+
+list_containers_func = "restic_compose_backup.utils.list_containers"
+
+
+class ScheduleTests(unittest.TestCase):
+    """Tests for parsing and matching cron expressions"""
+
+    def test_fields(self):
+        """Lists, ranges, steps and names are expanded"""
+        schedule = cron.parse("5/20 1,3 1-3 jan,jun */2")
+        self.assertEqual(schedule.fields[0], {5, 25, 45})
+        self.assertEqual(schedule.fields[1], {1, 3})
+        self.assertEqual(schedule.fields[2], {1, 2, 3})
+        self.assertEqual(schedule.fields[3], {1, 6})
+        self.assertEqual(schedule.fields[4], {0, 2, 4, 6})
+        self.assertEqual(cron.parse("0 0 * * 5-7").fields[4], {0, 5, 6})
+        self.assertEqual(cron.parse("'@hourly'").fields[0], {0})
+
+    def test_invalid(self):
+        """Invalid expressions raise ValueError"""
+        for expression in ["* * * *", "60 * * * *", "*/0 * * * *", "0 5-2 * * *"]:
+            with self.assertRaises(ValueError, msg=expression):
+                cron.parse(expression)
+
+    def test_matches(self):
+        """Day of month and day of week match either when both are set"""
+        monday = datetime(2024, 5, 6, 2, 0)
+        self.assertTrue(cron.parse("0 2 * * mon").matches(monday))
+        self.assertFalse(cron.parse("0 2 * * sun").matches(monday))
+        self.assertFalse(cron.parse("0 3 * * *").matches(monday))
+        self.assertTrue(cron.parse("0 2 1 * mon").matches(monday))
+        self.assertFalse(cron.parse("0 2 1 * *").matches(monday))
+
+    def test_next_fire(self):
+        """Next fire times are computed without scanning every minute"""
+        after = datetime(2024, 5, 6, 2, 7, 33)
+        self.assertEqual(
+            cron.parse("*/15 * * * *").next_fire(after), datetime(2024, 5, 6, 2, 15)
+        )
+        self.assertEqual(
+            cron.parse("0 0 29 feb *").next_fire(after), datetime(2028, 2, 29)
+        )
+        with self.assertRaises(ValueError):
+            cron.parse("0 0 30 feb *").next_fire(after)
+
+    def test_full_syntax_in_crontab(self):
+        """Steps, ranges and macros are no longer replaced by the default"""
+        config = Config(check=False)
+        config.cron_schedule = "*/15 1-5 * * *"
+        config.maintenance_schedule = "@weekly"
+        self.assertEqual(
+            [
+                line.split(" source")[0]
+                for line in cron.generate_crontab(config).splitlines()
+            ],
+            ["*/15 1-5 * * *", "0 0 * * 0"],
+        )
+
+    def test_dispatch_crontab(self):
+        """Services with their own schedule use the dispatcher"""
+        config = Config(check=False)
+        self.assertEqual(
+            cron.generate_crontab(config, scheduled=True).splitlines()[0],
+            "* * * * * source /.env && rcb backup --due > /proc/1/fd/1",
+        )
+
+    def test_jitter_offset(self):
+        """Offsets are stable per key and spread over the window"""
+        offsets = [cron.jitter_offset(f"host-{i}/project", 60) for i in range(60)]
+        self.assertEqual(offsets[0], cron.jitter_offset("host-0/project", 60))
+        self.assertTrue(all(0 <= offset < 3600 for offset in offsets))
+        # Most hosts start in a different minute
+        self.assertGreater(len({offset // 60 for offset in offsets}), 30)
+        self.assertEqual(cron.jitter_offset("host-0/project", 0), 0)
+
+    def test_delayed_crontab(self):
+        """Backups and maintenance start after the delay"""
+        config = Config(check=False)
+        config.maintenance_schedule = "0 4 * * *"
+        self.assertEqual(
+            cron.generate_crontab(config, delay=754).splitlines(),
+            [
+                "0 2 * * * sleep 754 && source /.env && rcb backup > /proc/1/fd/1",
+                "0 4 * * * sleep 754 && source /.env && rcb maintenance > /proc/1/fd/1",
+            ],
+        )
+        # The dispatcher has to know the minute it was started in
+        self.assertEqual(
+            cron.generate_crontab(config, scheduled=True, delay=754).splitlines()[0],
+            "* * * * * source /.env && rcb backup --due > /proc/1/fd/1",
+        )
+
+
+class DueServicesTests(BaseTestCase):
+    """Tests for picking the services due at a tick"""
+
+    def test_due_services(self):
+        """Due services are grouped into one run"""
+        containers = self.createContainers()
+        containers += [
+            {
+                "service": "db",
+                "labels": {
+                    "stack-back.volumes": True,
+                    "stack-back.schedule": "0 * * * *",
+                },
+            },
+            {
+                "service": "media",
+                "labels": {
+                    "stack-back.volumes": True,
+                    "stack-back.schedule": "0 3 * * sun",
+                },
+            },
+            {"service": "web", "labels": {"stack-back.volumes": True}},
+        ]
+        with mock.patch(
+            list_containers_func, fixtures.containers(containers=containers)
+        ):
+            cnt = RunningContainers()
+
+        config = Config(check=False)
+        config.cron_schedule = "0 2 * * *"
+        due = [
+            (when, cli.due_services(config, cnt, when))
+            for when in [
+                datetime(2024, 5, 6, 1, 0),
+                datetime(2024, 5, 6, 2, 0),
+                datetime(2024, 5, 5, 3, 0),
+                datetime(2024, 5, 5, 3, 30),
+            ]
+        ]
+        self.assertEqual(
+            [services for _, services in due],
+            [["db"], ["db", "web"], ["db", "media"], []],
+        )
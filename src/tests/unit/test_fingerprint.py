@@ -0,0 +1,82 @@
+"""Unit tests for skipping unchanged volumes"""
+
+import os
+import tempfile
+import time
+import unittest
+from unittest import mock
+import pytest
+
+from restic_compose_backup import jobs
+from restic_compose_backup.config import Config
+from restic_compose_backup.fingerprint import Fingerprints, fingerprint
+
+pytestmark = pytest.mark.unit
+
+
+class FingerprintTests(unittest.TestCase):
+    """Tests for volume fingerprints"""
+
+    def setUp(self):
+        self.tmp = tempfile.TemporaryDirectory()
+        self.volume = os.path.join(self.tmp.name, "volume")
+        os.makedirs(os.path.join(self.volume, "sub"))
+        self.file = os.path.join(self.volume, "sub", "file")
+        self.write(self.file, "data")
+
+        self.config = Config(check=False)
+        self.config.state_dir = os.path.join(self.tmp.name, "state")
+
+    def tearDown(self):
+        self.tmp.cleanup()
+
+    def write(self, path, data):
+        with open(path, "w") as fd:
+            fd.write(data)
+
+    def test_dirs_mode(self):
+        """Directory fingerprints see new files"""
+        before = fingerprint([self.volume], "dirs")
+        self.assertEqual(before, fingerprint([self.volume], "dirs"))
+        self.write(os.path.join(self.volume, "sub", "new"), "data")
+        self.assertNotEqual(before, fingerprint([self.volume], "dirs"))
+
+    def test_stat_mode(self):
+        """Stat fingerprints see files modified in place"""
+        before = fingerprint([self.volume], "stat")
+        os.utime(self.file, ns=(0, 123))
+        self.assertNotEqual(before, fingerprint([self.volume], "stat"))
+
+    def test_unchanged_until_max_age(self):
+        """A matching fingerprint is only trusted for a limited time"""
+        fingerprints = Fingerprints(self.config)
+        self.assertFalse(fingerprints.unchanged("web", "abc"))
+        fingerprints.commit("web", "abc")
+        self.assertTrue(fingerprints.unchanged("web", "abc"))
+        self.assertFalse(fingerprints.unchanged("web", "def"))
+
+        with mock.patch("time.time", return_value=time.time() + 8 * 86400):
+            self.assertFalse(fingerprints.unchanged("web", "abc"))
+
+    @mock.patch("restic_compose_backup.restic.backup_files", return_value=0)
+    def test_volume_job_skips_unchanged(self, backup_files):
+        """The second run of an unchanged volume does not run restic"""
+        fingerprints = Fingerprints(self.config)
+
+        def run():
+            job = jobs.VolumeJob(
+                "web",
+                "repo",
+                [self.volume],
+                fingerprint_mode="dirs",
+                fingerprints=fingerprints,
+            )
+            return jobs.run_job(job)
+
+        self.assertFalse(run().skipped)
+        self.assertTrue(run().skipped)
+        self.assertEqual(backup_files.call_count, 1)
+
+        self.write(os.path.join(self.volume, "new"), "data")
+        self.assertFalse(run().skipped)
+        self.assertEqual(backup_files.call_count, 2)
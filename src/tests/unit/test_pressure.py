@@ -0,0 +1,106 @@
+"""Unit tests for adaptive throttling driven by host pressure"""
+
+import asyncio
+import os
+import tempfile
+import unittest
+from unittest import mock
+import pytest
+
+from restic_compose_backup import pressure
+from restic_compose_backup.config import Config
+from restic_compose_backup.throttle import Throttle
+
+pytestmark = pytest.mark.unit
+
+PSI = """some avg10={some:.2f} avg60=1.00 avg300=0.50 total=12345
+full avg10=0.00 avg60=0.00 avg300=0.00 total=0
+"""
+
+
+class PressureTests(unittest.TestCase):
+    """Tests for sampling pressure and the throttle decisions"""
+
+    def setUp(self):
+        self.tmp = tempfile.TemporaryDirectory()
+        self.addCleanup(self.tmp.cleanup)
+        self.config = Config(check=False)
+        self.config.state_dir = self.tmp.name
+        self.config.pressure_target = "io=20"
+        self.config.pressure_limit_upload = "8192"
+
+    def write(self, resource, some):
+        with open(os.path.join(self.tmp.name, resource), "w") as fd:
+            fd.write(PSI.format(some=some))
+
+    def test_sample(self):
+        """The some avg10 value is read per available resource"""
+        self.write("io", 12.5)
+        self.write("cpu", 3)
+        self.assertEqual(pressure.sample(self.tmp.name), {"cpu": 3.0, "io": 12.5})
+
+    def test_parse_target(self):
+        """A single target applies to all resources"""
+        self.assertEqual(
+            pressure.parse_target("30"), {"cpu": 30.0, "io": 30.0, "memory": 30.0}
+        )
+        self.assertEqual(pressure.parse_target("io=20, cpu=60"), {"io": 20, "cpu": 60})
+        with self.assertRaises(ValueError):
+            pressure.parse_target("disk=10")
+
+    def test_upload_limit_levels(self):
+        """Each sample above target halves the upload limit of new runs"""
+        monitor = pressure.PressureMonitor(self.config, root=self.tmp.name)
+        self.assertEqual(monitor.adjust(), Throttle())
+
+        monitor.update({"io": 30.0})
+        monitor.update({"io": 30.0})
+        self.assertEqual(monitor.adjust().limit_upload, "2048")
+        self.assertEqual(
+            monitor.adjust(Throttle(limit_upload="400")).limit_upload, "100"
+        )
+        self.assertFalse(monitor.paused)
+
+        monitor.update({"io": 5.0})
+        self.assertEqual(monitor.level, 1)
+        self.assertEqual(len(monitor.decisions), 3)
+
+    def test_pause_relay(self):
+        """The relay pauses at twice the target until pressure is under target"""
+        monitor = pressure.PressureMonitor(self.config, root=self.tmp.name)
+        monitor.update({"io": 45.0})
+        self.assertTrue(monitor.paused)
+        monitor.update({"io": 25.0})
+        self.assertTrue(monitor.paused)
+        monitor.update({"io": 15.0})
+        self.assertFalse(monitor.paused)
+
+    def test_max_pause(self):
+        """A long pause is ended and not repeated until pressure drops"""
+        self.config.pressure_max_pause = "60"
+        monitor = pressure.PressureMonitor(self.config, root=self.tmp.name)
+        with mock.patch("time.monotonic", return_value=100.0):
+            monitor.update({"io": 45.0})
+        with mock.patch("time.monotonic", return_value=200.0):
+            monitor.update({"io": 45.0})
+            self.assertFalse(monitor.paused)
+            monitor.update({"io": 45.0})
+            self.assertFalse(monitor.paused)
+
+    def test_stop_saves_decisions(self):
+        """Stopping resumes the relay and keeps the decisions"""
+        monitor = pressure.PressureMonitor(self.config, root=self.tmp.name)
+        monitor.update({"io": 45.0})
+        monitor.stop()
+        self.assertFalse(monitor.paused)
+        asyncio.run(monitor.wait_resumed())
+        with open(os.path.join(self.tmp.name, "pressure.json")) as fd:
+            self.assertIn("resume relay (backup finished)", fd.read())
+
+    def test_disabled_without_pressure(self):
+        """No monitor without a target or without PSI"""
+        self.config.pressure_target = ""
+        self.assertIsNone(pressure.start_monitor(self.config))
+        self.config.pressure_target = "20"
+        with mock.patch("restic_compose_backup.pressure.sample", return_value={}):
+            self.assertIsNone(pressure.start_monitor(self.config))
@@ -0,0 +1,170 @@
+"""Unit tests for restic performance options"""
+
+import asyncio
+import unittest
+from unittest import mock
+import pytest
+
+from restic_compose_backup import restic
+from restic_compose_backup.config import Config
+
+pytestmark = pytest.mark.unit
+
+
+@mock.patch("os.cpu_count", return_value=4)
+class ResticOptionsTests(unittest.TestCase):
+    """Tests for backend aware restic defaults"""
+
+    def setUp(self):
+        self.config = Config(check=False)
+
+    def test_backend(self, _):
+        """Backends are taken from the repository scheme"""
+        self.assertEqual(restic.backend("s3:s3.amazonaws.com/bucket"), "s3")
+        self.assertEqual(restic.backend("rest:https://host:8000/"), "rest")
+        self.assertEqual(restic.backend("/restic_data"), "local")
+        self.assertEqual(restic.backend("local:/restic_data"), "local")
+
+    def test_remote_defaults(self, _):
+        """Remote backends get more connections and keep the default packs"""
+        self.assertEqual(
+            restic.global_options(self.config, "s3:host/bucket"),
+            ["-o", "s3.connections=8"],
+        )
+        self.assertEqual(
+            restic.backup_options(self.config), ["--read-concurrency", "4"]
+        )
+
+    def test_local_defaults(self, _):
+        """Local repositories keep the restic defaults"""
+        self.assertEqual(restic.global_options(self.config, "/restic_data"), [])
+
+    @mock.patch.object(restic.commands, "run", return_value=0)
+    def test_options_only_for_backup_and_prune(self, run, _):
+        """Reading commands run without the performance options"""
+        self.config.restic_pack_size = "32"
+        with mock.patch.object(restic, "config", self.config):
+            restic.prune("/restic_data")
+            restic.check("/restic_data")
+        self.assertEqual(
+            [call.args[0] for call in run.call_args_list],
+            [
+                ["restic", "-r", "/restic_data", "--pack-size", "32", "prune"],
+                ["restic", "-r", "/restic_data", "check"],
+            ],
+        )
+
+    def test_overrides(self, _):
+        """Configured values replace the defaults"""
+        self.config.restic_connections = "20"
+        self.config.restic_pack_size = "32"
+        self.config.restic_compression = "max"
+        self.config.restic_read_concurrency = "1"
+        self.config.restic_no_scan = "true"
+        self.assertEqual(
+            restic.global_options(self.config, "b2:bucket"),
+            [
+                "-o",
+                "b2.connections=20",
+                "--pack-size",
+                "32",
+                "--compression",
+                "max",
+            ],
+        )
+        self.assertEqual(
+            restic.backup_options(self.config),
+            ["--read-concurrency", "1", "--no-scan"],
+        )
+
+    def test_compression_override(self, _):
+        """A service compression level replaces the configured one"""
+        self.config.restic_compression = "auto"
+        self.assertEqual(
+            restic.global_options(self.config, "s3:bucket", compression="off"),
+            ["-o", "s3.connections=8", "--compression", "off"],
+        )
+
+    def test_paths_from_file(self, _):
+        """Several paths are passed in a file instead of the command line"""
+        calls = []
+
+        def run_capture(cmd):
+            self.assertIn("--quiet", cmd)
+            with open(cmd[cmd.index("--files-from-verbatim") + 1], "rb") as fd:
+                calls.append(fd.read())
+            return 0, b"", b""
+
+        with mock.patch.object(restic.commands, "run_capture", run_capture):
+            restic.backup_files("/restic_data", ["/volumes/a", "/volumes/b"])
+        self.assertEqual(calls, [b"/volumes/a\n/volumes/b\n"])
+
+    def test_text_output(self, _):
+        """The json output is logged like the restic text output"""
+        stdout = (
+            b'{"message_type":"status","percent_done":0.5}\n'
+            b"some warning\n"
+            b'{"message_type":"summary","files_new":2,"files_changed":1,'
+            b'"files_unmodified":7,"dirs_new":1,"dirs_changed":0,'
+            b'"dirs_unmodified":3,"data_added":2048,"data_added_packed":1024,'
+            b'"total_files_processed":10,"total_bytes_processed":4096,'
+            b'"total_duration":65.2,"snapshot_id":"0123456789abcdef"}\n'
+        )
+        self.assertEqual(
+            restic.text_output(stdout).splitlines(),
+            [
+                "some warning",
+                "Files: 2 new, 1 changed, 7 unmodified",
+                "Dirs: 1 new, 0 changed, 3 unmodified",
+                "Added to the repository: 2.0 KiB (1.0 KiB stored)",
+                "processed 10 files, 4.0 KiB in 0h01m05s",
+                "snapshot 01234567 saved",
+            ],
+        )
+
+    def test_parse_summary(self, _):
+        """The summary is taken from the json output of restic backup"""
+        stdout = (
+            b'{"message_type":"status","percent_done":0.5}\n'
+            b'{"message_type":"summary","data_added":800,"data_added_packed":100}\n'
+        )
+        self.assertEqual(
+            restic.parse_summary(stdout),
+            {"message_type": "summary", "data_added": 800, "data_added_packed": 100},
+        )
+        self.assertEqual(restic.parse_summary(b"Fatal: no repository\n"), {})
+
+
+class BackupFromStdinTests(unittest.TestCase):
+    """Tests for relaying a dump into restic"""
+
+    def test_restic_killed_when_relay_fails(self):
+        """A failing exec stream kills restic instead of leaving it running"""
+        processes = []
+        create = asyncio.create_subprocess_exec
+
+        async def create_subprocess_exec(*args, **kwargs):
+            processes.append(await create(*args, **kwargs))
+            return processes[-1]
+
+        async def exec_start(exec_id):
+            yield b"partial", b""
+            raise ConnectionResetError("docker went away")
+
+        client = mock.Mock()
+        client.exec_create = mock.AsyncMock(return_value="exec")
+        client.exec_start = exec_start
+
+        with (
+            mock.patch.object(restic, "restic", return_value=["cat"]),
+            mock.patch(
+                "asyncio.create_subprocess_exec", side_effect=create_subprocess_exec
+            ),
+        ):
+            with self.assertRaises(ConnectionResetError):
+                asyncio.run(
+                    restic.backup_from_stdin_async(
+                        "/repo", "/dump.sql", "db", ["dump"], client=client
+                    )
+                )
+        self.assertEqual(processes[0].returncode, -9)
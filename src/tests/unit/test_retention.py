@@ -0,0 +1,101 @@
+"""Unit tests for snapshot tags and per-service retention"""
+
+import unittest
+from unittest import mock
+import pytest
+
+from restic_compose_backup import retention
+from restic_compose_backup.config import Config
+
+pytestmark = pytest.mark.unit
+
+
+class RetentionTests(unittest.TestCase):
+    """Tests for forget tag groups and keep policies"""
+
+    def setUp(self):
+        self.config = Config(check=False)
+        self.config.keep_daily = "7"
+
+    def test_forget_groups(self):
+        """Snapshots are grouped by project and service or by their tags"""
+        snapshots = [
+            {"tags": ["project:app", "service:web"]},
+            {"tags": ["shard:/volumes/media#1of2", "project:app", "service:media"]},
+            {"tags": ["project:app", "service:web"]},
+            {"tags": None},
+            {"tags": ["legacy"]},
+        ]
+        self.assertEqual(
+            retention.forget_groups(snapshots),
+            [
+                "project:app,service:web",
+                "project:app,service:media,shard:/volumes/media#1of2",
+                "",
+                "legacy",
+            ],
+        )
+
+    def test_foreign_projects(self):
+        """Snapshots of other projects in a shared repository are left alone"""
+        snapshots = [
+            {"tags": ["project:a", "service:db"]},
+            {"tags": ["project:b", "service:db"]},
+            {"tags": ["legacy"]},
+            {"tags": []},
+        ]
+        self.assertEqual(
+            retention.forget_groups(snapshots, ["b"]),
+            ["project:b,service:db", "legacy", ""],
+        )
+
+    def test_shard_group_by_tags(self):
+        """Shards with changing paths are forgotten per shard tag"""
+        snapshots = [
+            {
+                "tags": ["shard:/volumes/m#a", "project:app", "service:m"],
+                "paths": ["/1"],
+            },
+            {
+                "tags": ["shard:/volumes/m#a", "project:app", "service:m"],
+                "paths": ["/1", "/2"],
+            },
+        ]
+        groups = retention.forget_groups(snapshots)
+        self.assertEqual(groups, ["project:app,service:m,shard:/volumes/m#a"])
+        self.assertEqual(retention.group_by(groups[0]), "host,tags")
+        self.assertEqual(retention.group_by("project:app,service:web"), "paths")
+
+    def test_policy_from_labels(self):
+        """Service labels override the configured keep policy"""
+        overrides = {"app/web": {"daily": "2"}}
+        self.assertEqual(
+            retention.policy(self.config, overrides, "project:app,service:web")[
+                "daily"
+            ],
+            "2",
+        )
+        self.assertEqual(
+            retention.policy(self.config, overrides, "project:other,service:web")[
+                "daily"
+            ],
+            "7",
+        )
+        self.assertEqual(retention.policy(self.config, overrides, "")["daily"], "7")
+
+    @mock.patch("restic_compose_backup.restic.forget", side_effect=[0, 1])
+    @mock.patch(
+        "restic_compose_backup.restic.snapshots_json",
+        return_value=[{"tags": ["project:app", "service:web"]}, {"tags": []}],
+    )
+    def test_forget_per_group(self, _, forget):
+        """Forget runs once per group and reports failures"""
+        self.assertEqual(
+            retention.forget(self.config, {"app/web": {"daily": "1"}}, ["app"]), 1
+        )
+        self.assertEqual(
+            [call.kwargs["tags"] for call in forget.call_args_list],
+            ["project:app,service:web", ""],
+        )
+        self.assertEqual(forget.call_args_list[0].kwargs["group_by"], "paths")
+        self.assertEqual(forget.call_args_list[0].args[1], "1")
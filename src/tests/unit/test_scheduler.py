@@ -0,0 +1,144 @@
+"""Unit tests for the built-in scheduler"""
+
+import tempfile
+import threading
+import unittest
+from datetime import datetime
+from unittest import mock
+import pytest
+
+from restic_compose_backup import cron, scheduler, state
+from restic_compose_backup.config import Config
+
+pytestmark = pytest.mark.unit
+
+
+class SchedulerTests(unittest.TestCase):
+    """Tests for firing, overlapping and catching up on schedules"""
+
+    def setUp(self):
+        self.tmp = tempfile.TemporaryDirectory()
+        self.addCleanup(self.tmp.cleanup)
+        self.config = Config(check=False)
+        self.config.state_dir = self.tmp.name
+        self.runs = []
+        self.release = threading.Event()
+        self.release.set()
+        self.now = datetime(2024, 5, 6, 1, 59, 30)
+
+    def run_group(self, group, services):
+        self.runs.append((group, services))
+        self.release.wait(5)
+
+    def make_scheduler(self, overlap="skip", delay=0):
+        return scheduler.Scheduler(
+            self.config,
+            lambda: [],
+            self.run_group,
+            overlap=overlap,
+            clock=lambda: self.now,
+            delay=delay,
+        )
+
+    def jobs(self):
+        return [
+            scheduler.ScheduledJob("nightly", cron.parse("0 2 * * *")),
+            scheduler.ScheduledJob("hourly", cron.parse("0 * * * *"), services=["db"]),
+        ]
+
+    def test_due_jobs_are_merged(self):
+        """Jobs due in the same minute start one run"""
+        sched = self.make_scheduler()
+        sched.start()
+        sched.tick(self.jobs(), datetime(2024, 5, 6, 1, 59))
+        sched.tick(self.jobs(), datetime(2024, 5, 6, 2, 0, 1))
+        sched.tick(self.jobs(), datetime(2024, 5, 6, 2, 0, 40))
+        sched.join()
+        self.assertEqual(self.runs, [("backup", None)])
+
+    def test_overlap_skip(self):
+        """Ticks during a running run are dropped"""
+        self.release.clear()
+        sched = self.make_scheduler()
+        sched.start()
+        sched.tick(self.jobs(), datetime(2024, 5, 6, 2, 0))
+        sched.tick(self.jobs(), datetime(2024, 5, 6, 3, 0))
+        self.release.set()
+        sched.join()
+        self.assertEqual(self.runs, [("backup", None)])
+
+    def test_overlap_queue(self):
+        """Ticks during a running run are merged and run afterwards"""
+        self.release.clear()
+        self.now = datetime(2024, 5, 6, 2, 30)
+        sched = self.make_scheduler(overlap="queue")
+        sched.start()
+        sched.tick(self.jobs(), datetime(2024, 5, 6, 3, 0))
+        sched.tick(self.jobs(), datetime(2024, 5, 6, 4, 0))
+        sched.tick(self.jobs(), datetime(2024, 5, 6, 5, 0))
+        self.release.set()
+        sched.join()
+        self.assertEqual(self.runs, [("backup", ["db"]), ("backup", ["db"])])
+
+    def test_catch_up_once(self):
+        """Schedules missed during downtime run once on start"""
+        state.save(
+            self.config, scheduler.SCHEDULER_STATE, {"checked": "2024-05-05T23:00:00"}
+        )
+        self.now = datetime(2024, 5, 6, 9, 30)
+        sched = self.make_scheduler()
+        sched.start()
+        sched.tick(self.jobs(), self.now)
+        sched.join()
+        self.assertEqual(self.runs, [("backup", None)])
+
+        sched = self.make_scheduler()
+        sched.start(catch_up=False)
+        sched.tick(self.jobs(), self.now)
+        sched.join()
+        self.assertEqual(len(self.runs), 1)
+
+    def test_sleep_time(self):
+        """Sleep until the next fire time but at most a minute"""
+        sched = self.make_scheduler()
+        self.assertEqual(sched.sleep_time(self.jobs(), self.now), 30.0)
+        self.assertEqual(sched.sleep_time([], self.now), scheduler.MAX_SLEEP)
+
+    def test_delay(self):
+        """Runs start after the delay and are dropped when stopped before"""
+        sched = self.make_scheduler(delay=1)
+        self.assertEqual(
+            sched.next_runs(self.jobs(), self.now)["nightly"],
+            datetime(2024, 5, 6, 2, 0, 1),
+        )
+        sched.start()
+        sched.tick(self.jobs(), datetime(2024, 5, 6, 2, 0))
+        self.assertEqual(self.runs, [])
+        sched.join()
+        self.assertEqual(self.runs, [("backup", None)])
+
+        sched = self.make_scheduler(delay=60)
+        sched.start()
+        sched.tick(self.jobs(), datetime(2024, 5, 6, 3, 0))
+        sched.stop()
+        sched.join()
+        self.assertEqual(len(self.runs), 1)
+
+    def test_load_errors_are_retried(self):
+        """Schedules that cannot be loaded are logged and retried"""
+        calls = []
+
+        def load_jobs():
+            calls.append(1)
+            if len(calls) < 3:
+                raise ValueError("bad schedule")
+            sched.stop()
+            return []
+
+        sched = self.make_scheduler()
+        sched.load_jobs = load_jobs
+        with mock.patch.object(scheduler, "MAX_SLEEP", 0.01):
+            with self.assertLogs(scheduler.logger, "ERROR") as logs:
+                sched.run()
+        self.assertEqual(len(calls), 3)
+        self.assertEqual(len(logs.output), 2)
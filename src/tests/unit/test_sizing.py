@@ -0,0 +1,67 @@
+"""Unit tests for the sizing pass"""
+
+import os
+import tempfile
+import unittest
+import pytest
+
+from restic_compose_backup import sizing
+from restic_compose_backup.config import Config
+from restic_compose_backup.plan import BackupPlan, VolumeTarget
+
+pytestmark = pytest.mark.unit
+
+
+class SizingTests(unittest.TestCase):
+    """Tests for volume sizes and ETA"""
+
+    def setUp(self):
+        self.tmp = tempfile.TemporaryDirectory()
+        self.config = Config(check=False)
+        self.config.state_dir = os.path.join(self.tmp.name, "state")
+
+    def tearDown(self):
+        self.tmp.cleanup()
+
+    def write(self, path, size):
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        with open(path, "wb") as fd:
+            fd.write(b"x" * size)
+
+    def test_size_volumes_per_service(self):
+        """Volumes are summed per service including nested directories"""
+        web = os.path.join(self.tmp.name, "web")
+        db = os.path.join(self.tmp.name, "db")
+        self.write(os.path.join(web, "index.html"), 10)
+        self.write(os.path.join(web, "static", "a", "b.css"), 20)
+        self.write(os.path.join(web, "static", "c.js"), 30)
+        self.write(os.path.join(db, "data"), 5)
+
+        plan = BackupPlan(
+            project_name="test",
+            volumes=[
+                VolumeTarget("web", "test", "/srv/web", web),
+                VolumeTarget("web", "test", "/srv/db", db),
+                VolumeTarget("other", "test", "/srv/missing", "/does/not/exist"),
+            ],
+        )
+        sizes = sizing.size_volumes(plan, workers=2)
+        self.assertEqual(sizes, {"web": sizing.Size(bytes=65, files=4)})
+
+    def test_eta_from_throughput_history(self):
+        """The ETA uses a moving average of earlier runs"""
+        self.assertIsNone(sizing.eta(self.config, sizing.KIND_VOLUME, 1000))
+
+        sizing.record_throughput(self.config, sizing.KIND_VOLUME, 1000, 10)
+        self.assertEqual(sizing.eta(self.config, sizing.KIND_VOLUME, 1000), 10)
+
+        sizing.record_throughput(self.config, sizing.KIND_VOLUME, 2000, 10)
+        self.assertAlmostEqual(sizing.throughput(self.config, sizing.KIND_VOLUME), 130)
+        self.assertIsNone(sizing.eta(self.config, sizing.KIND_DATABASE, 1000))
+
+    def test_sizes_roundtrip(self):
+        """Sizes saved by a run can be shown by status"""
+        volumes = {"web": sizing.Size(100, 3)}
+        databases = {"mysql": sizing.Size(2048)}
+        sizing.save_sizes(self.config, volumes, databases)
+        self.assertEqual(sizing.load_sizes(self.config), (volumes, databases))
@@ -0,0 +1,88 @@
+"""Unit tests for backup priority and bandwidth limits"""
+
+import subprocess
+import unittest
+from unittest import mock
+import pytest
+
+from restic_compose_backup.config import Config
+from restic_compose_backup.containers import RunningContainers
+from restic_compose_backup.throttle import Throttle
+from . import fixtures
+from .conftest import BaseTestCase
+
+pytestmark = pytest.mark.unit
+
+list_containers_func = "restic_compose_backup.utils.list_containers"
+
+
+class ThrottleTests(unittest.TestCase):
+    """Tests for resolving and applying the limits"""
+
+    def make_config(self, **values):
+        config = Config(check=False)
+        config.backup_nice = values.get("nice", "")
+        config.backup_ionice = values.get("ionice", "")
+        config.restic_limit_upload = values.get("limit_upload", "")
+        config.restic_limit_download = values.get("limit_download", "")
+        return config
+
+    def test_unset_by_default(self):
+        """Nothing is changed without settings"""
+        throttle = Throttle.from_config(self.make_config())
+        self.assertEqual(throttle, Throttle())
+        self.assertEqual(throttle.restic_args(), [])
+        self.assertEqual(throttle.wrap(["pg_dumpall"]), ["pg_dumpall"])
+
+    def test_overrides(self):
+        """Labels override the config and invalid values are ignored"""
+        config = self.make_config(nice="10", ionice="bogus", limit_upload="2048")
+        throttle = Throttle.from_config(config, {"limit_upload": "512"})
+        self.assertEqual(throttle, Throttle(nice=10, limit_upload="512"))
+        self.assertEqual(throttle.restic_args(), ["--limit-upload", "512"])
+
+    def test_wrap(self):
+        """Dump commands are run through nice and ionice"""
+        throttle = Throttle(nice=10, ionice="best-effort:7")
+        cmd = throttle.wrap(["mysqldump", "--all-databases"])
+        self.assertEqual(cmd[:2], ["sh", "-c"])
+        self.assertEqual(
+            cmd[3:], ["sh", "10", "-c 2 -n 7", "mysqldump", "--all-databases"]
+        )
+        self.assertEqual(Throttle(ionice="idle").wrap(["ls"])[4:], ["0", "-c 3", "ls"])
+
+    def test_wrap_runs(self):
+        """The wrapped command runs with the nice value"""
+        cmd = Throttle(nice=5, ionice="idle").wrap(
+            ["python3", "-c", "import os; print(os.nice(0))"]
+        )
+        self.assertEqual(subprocess.check_output(cmd).strip(), b"5")
+
+
+class ThrottleLabelTests(BaseTestCase):
+    """Tests for the priority and bandwidth labels"""
+
+    def test_labels(self):
+        """Valid labels become overrides"""
+        containers = self.createContainers()
+        containers += [
+            {
+                "service": "web",
+                "labels": {
+                    "stack-back.volumes": True,
+                    "stack-back.nice": "15",
+                    "stack-back.ionice": "Idle",
+                    "stack-back.limit-upload": "1M",
+                    "stack-back.limit-download": "4096",
+                },
+            },
+        ]
+        with mock.patch(
+            list_containers_func, fixtures.containers(containers=containers)
+        ):
+            cnt = RunningContainers()
+
+        self.assertEqual(
+            cnt.get_service("web").throttle,
+            {"nice": 15, "ionice": "idle", "limit_download": "4096"},
+        )
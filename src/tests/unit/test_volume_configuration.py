@@ -190,3 +190,106 @@ class VolumeConfigurationTests(BaseTestCase):
         web_service = cnt.get_service("web")
         self.assertNotEqual(web_service, None, msg="Web service not found")
         self.assertTrue(web_service.stop_during_backup)
+
+    def test_volume_sharding_label(self):
+        """Test parsing the shards label"""
+        containers = self.createContainers()
+        containers += [
+            {"service": "hashed", "labels": {"stack-back.volumes.shards": "8"}},
+            {"service": "dirs", "labels": {"stack-back.volumes.shards": "directory"}},
+            {"service": "broken", "labels": {"stack-back.volumes.shards": "many"}},
+            {"service": "plain"},
+        ]
+        with mock.patch(
+            list_containers_func, fixtures.containers(containers=containers)
+        ):
+            cnt = RunningContainers()
+        self.assertEqual(cnt.get_service("hashed").volume_sharding, ("hash", 8))
+        self.assertEqual(cnt.get_service("dirs").volume_sharding, ("directory", 0))
+        self.assertEqual(cnt.get_service("broken").volume_sharding, (None, 0))
+        self.assertEqual(cnt.get_service("plain").volume_sharding, (None, 0))
+
+    def test_change_detection_labels(self):
+        """Change detection labels apply to all or matching mounts"""
+        containers = self.createContainers()
+        containers += [
+            {
+                "service": "web",
+                "labels": {
+                    "stack-back.volumes": True,
+                    "stack-back.volumes.ignore-inode": "nfs,fuse",
+                    "stack-back.volumes.ignore-ctime": True,
+                    "stack-back.volumes.force": False,
+                },
+                "mounts": [
+                    {"Source": "/mnt/nfs/web", "Destination": "/a", "Type": "bind"},
+                    {"Source": "/srv/local", "Destination": "/b", "Type": "bind"},
+                ],
+            },
+        ]
+        with mock.patch(
+            list_containers_func, fixtures.containers(containers=containers)
+        ):
+            cnt = RunningContainers()
+        web = cnt.get_service("web")
+        nfs, local = web.filter_mounts()
+        self.assertEqual(web.change_detection(nfs), ["ignore-inode", "ignore-ctime"])
+        self.assertEqual(web.change_detection(local), ["ignore-ctime"])
+
+    def test_exclude_labels(self):
+        """Exclude labels are anchored to the service and validated"""
+        containers = self.createContainers()
+        containers += [
+            {
+                "service": "web",
+                "labels": {
+                    "stack-back.volumes": True,
+                    "stack-back.volumes.exclude-paths": "/srv/files/tmp,*.log",
+                    "stack-back.volumes.exclude-larger-than": "2G",
+                    "stack-back.volumes.exclude-if-present": "CACHEDIR.TAG, .nobackup",
+                },
+            },
+            {
+                "service": "broken",
+                "labels": {"stack-back.volumes.exclude-larger-than": "huge"},
+            },
+        ]
+        with mock.patch(
+            list_containers_func, fixtures.containers(containers=containers)
+        ):
+            cnt = RunningContainers()
+        web = cnt.get_service("web")
+        self.assertEqual(
+            web.volume_excludes("/volumes"),
+            ["/volumes/web/srv/files/tmp", "/volumes/web/**/*.log"],
+        )
+        self.assertEqual(web.volume_exclude_larger_than, "2G")
+        self.assertEqual(web.volume_exclude_if_present, ["CACHEDIR.TAG", ".nobackup"])
+        self.assertIsNone(cnt.get_service("broken").volume_exclude_larger_than)
+
+    def test_include_glob_pattern(self):
+        """Include patterns match substrings or whole sources with globs"""
+        containers = self.createContainers()
+        containers += [
+            {
+                "service": "web",
+                "labels": {
+                    "stack-back.volumes": True,
+                    "stack-back.volumes.include": "media,/srv/*/data",
+                },
+                "mounts": [
+                    {"Source": "/srv/media", "Destination": "/a", "Type": "bind"},
+                    {"Source": "/srv/app/data", "Destination": "/b", "Type": "bind"},
+                    {"Source": "/srv/app/data2", "Destination": "/c", "Type": "bind"},
+                    {"Source": "/opt/srv/x/data", "Destination": "/d", "Type": "bind"},
+                ],
+            },
+        ]
+        with mock.patch(
+            list_containers_func, fixtures.containers(containers=containers)
+        ):
+            cnt = RunningContainers()
+        mounts = cnt.get_service("web").filter_mounts()
+        self.assertEqual(
+            [mount.source for mount in mounts], ["/srv/media", "/srv/app/data"]
+        )
@@ -0,0 +1,96 @@
+"""Unit tests for change-triggered backups"""
+
+import os
+import tempfile
+import unittest
+from unittest import mock
+import pytest
+
+from restic_compose_backup import cli
+from restic_compose_backup.config import Config
+from restic_compose_backup.containers import RunningContainers
+from restic_compose_backup.watch import DirtyTracker, InotifyWatcher
+from . import fixtures
+from .conftest import BaseTestCase
+
+pytestmark = pytest.mark.unit
+
+
+class DirtyTrackerTests(unittest.TestCase):
+    """Tests for debouncing changes per service"""
+
+    def test_due_after_quiet_period(self):
+        """A service is due once changes have settled"""
+        tracker = DirtyTracker(debounce=60, max_delay=900)
+        tracker.record("web", "/volumes/web/media", now=0)
+        tracker.record("web", "/volumes/web/files", now=30)
+        self.assertEqual(tracker.pop_due(now=60), {})
+        self.assertEqual(
+            tracker.pop_due(now=90),
+            {"web": {"/volumes/web/media", "/volumes/web/files"}},
+        )
+        self.assertEqual(tracker.dirty, {})
+
+    def test_due_after_max_delay(self):
+        """Constant changes do not postpone a backup forever"""
+        tracker = DirtyTracker(debounce=60, max_delay=300)
+        for now in range(0, 301, 10):
+            tracker.record("db", "/volumes/db/data", now=now)
+        tracker.record("web", "/volumes/web/media", now=300)
+        self.assertEqual(list(tracker.pop_due(now=300)), ["db"])
+        self.assertEqual(list(tracker.dirty), ["web"])
+
+
+class InotifyWatcherTests(unittest.TestCase):
+    """Tests for the inotify watcher"""
+
+    def test_changes_in_new_directories_are_seen(self):
+        """Changes are reported per watched tree including new directories"""
+        with tempfile.TemporaryDirectory() as tmp:
+            watcher = InotifyWatcher()
+            try:
+                self.assertEqual(watcher.add_tree(tmp, "media"), 1)
+                os.mkdir(os.path.join(tmp, "new"))
+                self.assertIn(("media", os.path.join(tmp, "new")), watcher.read(1))
+
+                with open(os.path.join(tmp, "new", "file"), "w") as fd:
+                    fd.write("data")
+                changes = watcher.read(1)
+                self.assertIn(("media", os.path.join(tmp, "new", "file")), changes)
+            finally:
+                watcher.close()
+
+
+@mock.patch("restic_compose_backup.cli.alerts.send")
+@mock.patch("restic_compose_backup.cli.restic.is_initialized", return_value=True)
+class BackupResultTests(BaseTestCase):
+    """Tests for reporting the result of a triggered backup"""
+
+    def run_backup(self, **run):
+        containers = self.createContainers()
+        containers += [
+            {
+                "service": "web",
+                "labels": {"stack-back.volumes": True},
+                "mounts": [{"Source": "/srv/web", "Destination": "/srv/web"}],
+            },
+            {"service": "db", "labels": {"stack-back.volumes": True}},
+        ]
+        with mock.patch(
+            "restic_compose_backup.utils.list_containers",
+            fixtures.containers(containers=containers),
+        ):
+            cnt = RunningContainers()
+        with mock.patch("restic_compose_backup.cli.backup_runner.run", **run):
+            with mock.patch("builtins.open", mock.mock_open(read_data="log")):
+                return cli.backup(Config(check=False), cnt, services=["web"])
+
+    def test_success(self, *_):
+        """A backup process exiting with 0 succeeded"""
+        self.assertTrue(self.run_backup(return_value=0))
+
+    def test_failure(self, _, send):
+        """Failed backups are reported so the services stay dirty"""
+        self.assertFalse(self.run_backup(return_value=1))
+        self.assertFalse(self.run_backup(side_effect=RuntimeError("no docker")))
+        self.assertEqual(send.call_count, 2)